@@ -7,640 +7,5235 @@ and retries it if it failed, based on the configured retry behavior.
 """
 
 import argparse
+import base64
+import cProfile
+import fcntl
+import fnmatch
+import functools
+import gzip
+import hashlib
+import io
 import json
+import logging
+import math
 import os
+import pstats
+import random
+import re
+import shlex
+import shutil
 import subprocess
 import sys
-from typing import Dict, List, Optional, Tuple, Any
-
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from datetime import datetime
+from typing import IO, Any, Callable, Deque, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+
+logger = logging.getLogger("retry_workflow")
 
 # Constants for workflow statuses
 FAILED_STATUSES = {"failure", "timed_out", "cancelled"}
 SUCCESS_STATUS = "success"
 
+# Maximum page size of GitHub list endpoints
+PAGE_SIZE = 100
 
-class GitHubClient:
-    """Wrapper for GitHub CLI commands."""
+# Default maximum number of concurrent gh requests
+DEFAULT_MAX_CONCURRENCY = 8
 
-    def __init__(self, repo: str):
-        """
-        Initialize GitHub CLI client.
+# Default timeout of a single gh request in seconds
+DEFAULT_REQUEST_TIMEOUT = 60
 
-        Args:
-            repo: Repository in owner/repo format
-        """
-        self.repo = repo
+# Default time to wait for the run created by a workflow dispatch in seconds
+DISPATCH_TRACK_TIMEOUT = 60
 
-    def run_command(self, args: List[str]) -> str:
-        """
-        Run a GitHub CLI command and return the output.
+# gh errors worth retrying: server errors and network failures
+TRANSIENT_ERROR_PATTERN = re.compile(
+    r"HTTP 5\d\d|connection (reset|refused)|i/o timeout|TLS handshake timeout"
+    r"|unexpected EOF|no such host",
+    re.IGNORECASE
+)
 
-        Args:
-            args: List of command arguments for gh CLI
+# GitHub REST API root, used where gh cannot authenticate (GitHub App JWTs)
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
 
-        Returns:
-            Command output as string
+# gh errors caused by the rate limit of the token used
+RATE_LIMIT_ERROR_PATTERN = re.compile(r"rate limit|HTTP 429", re.IGNORECASE)
 
-        Raises:
-            subprocess.CalledProcessError: If command fails
-        """
-        cmd = ["gh"] + args
+# Arguments naming the state files shared between invocations
+STATE_FILE_ARGUMENTS = ("deferred_queue_file", "retry_lock_file", "rerun_quota_file", "history_memo_file")
 
-        # Set up environment with GH_REPO
-        env = os.environ.copy()
-        env["GH_REPO"] = self.repo
 
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-            env=env
-        )
-        return result.stdout.strip()
+class DeadlineExceededError(Exception):
+    """Raised when the overall time budget of the invocation is exhausted."""
 
-    def api_get(self, endpoint: str, jq_filter: Optional[str] = None, paginate: bool = False) -> str:
-        """
-        Execute a GET API request.
 
-        Args:
-            endpoint: API endpoint (e.g., "repos/owner/repo/commits/main")
-            jq_filter: Optional jq filter expression
-            paginate: Whether to paginate results
+class NoCredentialError(Exception):
+    """Raised when no credential of the token pool can make a request."""
 
-        Returns:
-            API response as string
-        """
-        args = ["api", endpoint]
-        if paginate:
-            args.append("--paginate")
-        if jq_filter:
-            args.extend(["--jq", jq_filter])
-        return self.run_command(args)
 
-    def api_post(self, endpoint: str) -> bool:
-        """
-        Execute a POST API request.
+class CircuitOpenError(Exception):
+    """Raised when requests are refused because the API looks unavailable."""
 
-        Args:
-            endpoint: API endpoint
 
-        Returns:
-            True if successful, False otherwise
-        """
-        try:
-            self.run_command(["api", "--method", "POST", endpoint])
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"Error executing POST {endpoint}: {e.stderr}", file=sys.stderr)
-            return False
+class RerunQuotaExceededError(Exception):
+    """Raised when the fleet-wide rerun quota does not allow another rerun."""
 
 
-class WorkflowStep:
-    """Represents a step within a workflow job."""
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse an ISO 8601 timestamp from the GitHub API.
 
-    def __init__(self, step_data: Dict):
+    Args:
+        value: Timestamp string (e.g., "2025-12-05T10:00:00Z")
+
+    Returns:
+        Timezone-aware datetime, or None if value is empty or invalid
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def elapsed_seconds(start: Optional[str], end: Optional[str]) -> Optional[int]:
+    """
+    Get the whole seconds elapsed between two GitHub API timestamps.
+
+    Args:
+        start: Start timestamp
+        end: End timestamp
+
+    Returns:
+        Elapsed seconds, or None if a timestamp is missing or end is before start
+    """
+    started = parse_timestamp(start)
+    ended = parse_timestamp(end)
+    if not started or not ended or ended < started:
+        return None
+    return int((ended - started).total_seconds())
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Format a duration for summaries.
+
+    Args:
+        seconds: Duration in seconds
+
+    Returns:
+        Duration such as "42s", "5m 03s" or "2h 05m"
+    """
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+def estimate_success_likelihood(retry_count: int) -> float:
+    """
+    Estimate the probability that one more attempt succeeds.
+
+    Uses Laplace's rule of succession: after n attempts that all failed, the
+    probability of success on the next one is 1 / (n + 2).
+
+    Args:
+        retry_count: Number of retries already performed
+
+    Returns:
+        Probability between 0 and 1
+    """
+    attempts = retry_count + 1
+    return 1 / (attempts + 2)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Check if a failed gh command is worth retrying.
+
+    Args:
+        error: Exception raised by subprocess.run
+
+    Returns:
+        True for timeouts, server errors and network failures
+    """
+    if isinstance(error, subprocess.TimeoutExpired):
+        return True
+    if isinstance(error, subprocess.CalledProcessError):
+        return bool(TRANSIENT_ERROR_PATTERN.search(error.stderr or ""))
+    return False
+
+
+class Deadline:
+    """Point in time after which no more requests are issued."""
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
         """
-        Initialize workflow step.
+        Initialize deadline.
 
         Args:
-            step_data: Step data dictionary from GitHub API
+            seconds: Time budget from now
+            clock: Monotonic clock measuring the budget
         """
-        self.name = step_data.get("name")
-        self.conclusion = step_data.get("conclusion")
-        self.status = step_data.get("status")
+        self.clock = clock
+        self.expires_at = clock() + seconds
 
-    def is_failed(self) -> bool:
+    def remaining(self) -> float:
         """
-        Check if step failed.
+        Get the time left before the deadline.
 
         Returns:
-            True if step failed, False otherwise
+            Remaining seconds (0 once expired)
         """
-        return self.conclusion in FAILED_STATUSES
+        return max(0.0, self.expires_at - self.clock())
 
 
-class WorkflowJob:
-    """Represents a job within a workflow run."""
+class CircuitBreaker:
+    """Stops issuing requests for a while after consecutive transient failures."""
 
-    def __init__(self, job_data: Dict):
+    def __init__(self, threshold: int = 5, cooldown: float = 30, clock: Callable[[], float] = time.monotonic):
         """
-        Initialize workflow job.
+        Initialize circuit breaker.
 
         Args:
-            job_data: Job data dictionary from GitHub API
+            threshold: Consecutive transient failures opening the circuit
+            cooldown: Seconds the circuit stays open before a trial request
+            clock: Monotonic clock measuring the cooldown
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        """
+        Check if a request may be issued.
 
         Raises:
-            ValueError: If required 'id' field is missing
+            CircuitOpenError: If the circuit is open
         """
-        if "id" not in job_data:
-            raise ValueError("Job data missing required 'id' field")
-        self.id = job_data["id"]
-        self.name = job_data.get("name")
-        self.conclusion = job_data.get("conclusion")
-        self.status = job_data.get("status")
-        self._steps_data = job_data.get("steps", [])
-        self._steps: Optional[List[WorkflowStep]] = None
+        with self._lock:
+            remaining = self.open_until - self.clock()
+        if remaining > 0:
+            raise CircuitOpenError(
+                f"GitHub API unavailable after {self.failures} consecutive failures, "
+                f"not retrying for {remaining:.0f}s"
+            )
 
-    @property
-    def steps(self) -> List[WorkflowStep]:
-        """
-        Get steps in this job (lazy loaded).
+    def record_success(self) -> None:
+        """Record a request that reached the API."""
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
 
-        Returns:
-            List of WorkflowStep objects
-        """
-        if self._steps is None:
-            self._steps = [WorkflowStep(step) for step in self._steps_data]
-        return self._steps
+    def record_failure(self) -> None:
+        """Record a transient failure, opening the circuit at the threshold."""
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.open_until = self.clock() + self.cooldown
 
-    def is_failed(self) -> bool:
+
+class LatencyTracker:
+    """Keeps recent request latencies to know when a request is slow."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
         """
-        Check if job failed.
+        Initialize latency tracker.
 
-        Returns:
-            True if job failed, False otherwise
+        Args:
+            window: Number of recent latencies kept
+            min_samples: Samples required before percentiles are trusted
         """
-        return self.conclusion in FAILED_STATUSES
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: List[float] = []
+        self._lock = threading.Lock()
 
-    def has_failed_step(self, step_name: str) -> Optional[WorkflowStep]:
+    def record(self, seconds: float) -> None:
         """
-        Check if a specific step failed.
+        Record the latency of a successful request.
 
         Args:
-            step_name: Name of the step to check
+            seconds: Request duration
+        """
+        with self._lock:
+            self._samples.append(seconds)
+            del self._samples[:-self.window]
+
+    def p95(self) -> Optional[float]:
+        """
+        Get the 95th percentile of recent latencies.
 
         Returns:
-            WorkflowStep if found and failed, None otherwise
+            Latency in seconds, or None without enough samples
         """
-        for step in self.steps:
-            if step.name == step_name and step.is_failed():
-                return step
-        return None
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
 
 
-class WorkflowRun:
-    """Represents a GitHub Actions workflow run."""
+class RequestPolicy:
+    """Deadline, retries, hedging and circuit breaking applied to requests."""
 
-    def __init__(self, client: GitHubClient, run_data: Dict):
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+        max_attempts: int = 3,
+        backoff: float = 1.0,
+        hedge: bool = True,
+        min_hedge_delay: float = 1.0,
+        breaker: Optional[CircuitBreaker] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
         """
-        Initialize workflow run.
+        Initialize request policy.
 
         Args:
-            client: GitHubClient instance
-            run_data: Workflow run data dictionary from GitHub API
-
-        Raises:
-            ValueError: If required 'id' field is missing
+            timeout: Overall time budget in seconds (unlimited if None)
+            request_timeout: Maximum duration of a single request in seconds
+            max_attempts: Attempts of an idempotent request on transient errors
+            backoff: Base of the exponential backoff between attempts in seconds
+            hedge: Whether to duplicate GETs slower than the p95 latency
+            min_hedge_delay: Minimum time before duplicating a GET in seconds
+            breaker: Circuit breaker (a default one is created if None)
+            clock: Monotonic clock of the deadline and the circuit breaker,
+                the one of the transport when requests are recorded or
+                replayed
         """
-        if "id" not in run_data:
-            raise ValueError("Workflow run data missing required 'id' field")
-        self.client = client
-        self.id = run_data["id"]
-        self.name = run_data.get("name")
-        self.status = run_data.get("status")
-        self.conclusion = run_data.get("conclusion")
-        self.created_at = run_data.get("created_at")
-        self.path = run_data.get("path", "")
-        self._jobs: Optional[List[WorkflowJob]] = None
-        self._retry_count: Optional[int] = None
-
-    @property
-    def jobs(self) -> List[WorkflowJob]:
+        self.deadline = Deadline(timeout, clock) if timeout else None
+        self.request_timeout = request_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.latency = LatencyTracker()
+
+    def timeout_for_request(self) -> float:
         """
-        Get jobs for this workflow run (lazy loaded).
+        Get the timeout of the next request, bounded by the deadline.
 
         Returns:
-            List of WorkflowJob objects
-        """
-        if self._jobs is None:
-            self._jobs = self._fetch_jobs()
-        return self._jobs
+            Timeout in seconds
 
-    @property
-    def retry_count(self) -> int:
+        Raises:
+            DeadlineExceededError: If the deadline has passed
         """
-        Get the number of retry attempts.
+        if self.deadline is None:
+            return self.request_timeout
+        remaining = self.deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceededError("Time budget exhausted, not issuing more requests")
+        return min(self.request_timeout, remaining)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        Get a jittered delay before retrying a request.
+
+        Args:
+            attempt: Number of attempts already made
 
         Returns:
-            Number of retry attempts (run_attempt - 1)
+            Delay in seconds, never past the deadline
         """
-        if self._retry_count is None:
-            self._retry_count = self._fetch_retry_count()
-        return self._retry_count
+        delay = random.uniform(0, self.backoff * 2 ** attempt)
+        if self.deadline is not None:
+            delay = min(delay, self.deadline.remaining())
+        return delay
 
-    def _fetch_jobs(self) -> List[WorkflowJob]:
+    def hedge_delay(self) -> Optional[float]:
         """
-        Fetch jobs from GitHub API.
+        Get how long to wait for a GET before sending a duplicate.
 
         Returns:
-            List of WorkflowJob objects
+            Delay in seconds, or None if hedging is disabled or there is
+            not enough latency data yet
         """
-        output = self.client.api_get(
-            f"repos/{self.client.repo}/actions/runs/{self.id}/jobs",
-            jq_filter=".jobs[]",
-            paginate=True
-        )
+        if not self.hedge:
+            return None
+        p95 = self.latency.p95()
+        if p95 is None:
+            return None
+        return max(p95, self.min_hedge_delay)
 
-        if not output:
-            return []
 
-        # Parse JSON lines
-        jobs = []
-        for line in output.strip().split("\n"):
-            if line:
-                jobs.append(WorkflowJob(json.loads(line)))
+class RequestStats:
+    """Counts requests issued by a client and the data they returned."""
 
-        return jobs
+    def __init__(self):
+        """Initialize request stats."""
+        self.requests = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
 
-    def _fetch_retry_count(self) -> int:
+    def record(self, bytes_received: int, seconds: float) -> None:
         """
-        Fetch retry count from GitHub API.
+        Record one request.
 
-        Returns:
-            Number of retry attempts
+        Args:
+            bytes_received: Size of the response
+            seconds: Duration of the request
         """
-        try:
-            output = self.client.api_get(
-                f"repos/{self.client.repo}/actions/runs/{self.id}",
-                jq_filter=".run_attempt"
-            )
-            run_attempt = int(output)
-            # run_attempt starts at 1, so subtract 1 to get retry count
-            return run_attempt - 1
-        except (ValueError, TypeError, subprocess.CalledProcessError):
-            return 0
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += bytes_received
+            self.seconds += seconds
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests, {self.bytes_received / 1024:.1f} KiB received "
+            f"in {self.seconds:.1f}s"
+        )
 
-    def is_failed(self) -> bool:
-        """
-        Check if workflow is in a failed state.
 
-        Returns:
-            True if workflow failed, False otherwise
+class Profiler:
+    """
+    Profiles the decision pipeline with cProfile and tracemalloc.
+
+    The pipeline marks its phases (ref resolution, run listing, job fetch,
+    decision, output) with profiled(). The time and traced memory of every
+    phase are accumulated, and a memory snapshot is taken when a phase
+    first completes, so that what each phase allocates is reported without
+    snapshotting every target of large batches.
+
+    Phases and memory are measured in every thread, but cProfile only
+    records the functions called by the thread that started it: the work
+    of the pool threads (concurrent targets, pages and requests) shows up
+    in the function statistics as the main thread waiting for them.
+    """
+
+    # Profiler of this invocation, used by profiled()
+    active: Optional["Profiler"] = None
+
+    def __init__(self, path: str, top: int = 25):
         """
-        return self.conclusion in FAILED_STATUSES
+        Initialize profiler.
 
-    def succeeded(self) -> bool:
+        Args:
+            path: Path of the pstats file, the report is written to the
+                same path with .txt appended
+            top: Number of functions and allocations listed in the report
         """
-        Check if workflow succeeded.
+        self.path = path
+        self.report_path = path + ".txt"
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.snapshots: List[Tuple[str, tracemalloc.Snapshot]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self) -> None:
+        """Start profiling and make this profiler the active one."""
+        tracemalloc.start()
+        self.snapshots.append(("start", tracemalloc.take_snapshot()))
+        Profiler.active = self
+        self.profile.enable()
+
+    def stop(self) -> None:
+        """Stop profiling and write the pstats file and the report."""
+        self.profile.disable()
+        Profiler.active = None
+        self.snapshots.append(("end", tracemalloc.take_snapshot()))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.profile.dump_stats(self.path)
+        with open(self.report_path, "w") as f:
+            f.write(self.report(peak))
+        logger.info(f"Profile written to {self.path} and {self.report_path}")
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Measure a phase of the pipeline.
 
-        Returns:
-            True if workflow succeeded, False otherwise
+        Nested calls of the same phase in a thread are only measured once.
+
+        Args:
+            name: Name of the phase
         """
-        return self.conclusion == SUCCESS_STATUS
+        running = getattr(self._local, "phases", None)
+        if running is None:
+            running = self._local.phases = set()
+        if name in running:
+            yield
+            return
 
-    def retry(self, mode: str = "failed-only") -> bool:
+        running.add(name)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            running.discard(name)
+            seconds = time.monotonic() - started
+            current, _ = tracemalloc.get_traced_memory()
+            with self._lock:
+                first = name not in self.phases
+                stats = self.phases.setdefault(name, {"calls": 0, "seconds": 0.0, "memory": 0})
+                stats["calls"] += 1
+                stats["seconds"] += seconds
+                stats["memory"] = max(stats["memory"], current)
+            if first:
+                snapshot = tracemalloc.take_snapshot()
+                with self._lock:
+                    self.snapshots.append((name, snapshot))
+
+    def report(self, peak: int) -> str:
         """
-        Retry this workflow run.
+        Build the text report of the profile.
 
         Args:
-            mode: Either "all" or "failed-only"
+            peak: Peak traced memory in bytes
 
         Returns:
-            True if retry was successful, False otherwise
+            Report with the phases, the allocations of each phase, the top
+            allocations and the top functions by cumulative time
         """
-        endpoint = (
-            f"repos/{self.client.repo}/actions/runs/{self.id}/rerun"
-            if mode == "all"
-            else f"repos/{self.client.repo}/actions/runs/{self.id}/rerun-failed-jobs"
+        ignored = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
         )
+        lines = [f"Peak traced memory: {peak / 1024:.1f} KiB", "", "Phases (times include nested phases):"]
+        for name, stats in self.phases.items():
+            lines.append(
+                f"  {name}: {stats['calls']} calls, {stats['seconds']:.3f}s, "
+                f"{stats['memory'] / 1024:.1f} KiB traced at most"
+            )
 
-        return self.client.api_post(endpoint)
+        snapshots = [(name, snapshot.filter_traces(ignored)) for name, snapshot in self.snapshots]
+        for (_, previous), (name, snapshot) in zip(snapshots, snapshots[1:]):
+            if name == "end":
+                continue
+            lines += ["", f"Allocated until the end of the first {name}:"]
+            for stat in snapshot.compare_to(previous, "lineno")[:self.top]:
+                if stat.size_diff > 0:
+                    lines.append(f"  {stat}")
 
-    def _check_job_and_step_filter(
-        self,
-        job_name: str,
-        step_name: str
-    ) -> Tuple[bool, str]:
-        """
-        Check if specific job/step combination failed.
+        lines += ["", "Top allocations at the end:"]
+        lines += [f"  {stat}" for stat in snapshots[-1][1].statistics("lineno")[:self.top]]
 
-        Args:
-            job_name: Name of the job to check
-            step_name: Name of the step to check
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(self.top)
+        lines += ["", "Top functions by cumulative time:", stream.getvalue()]
+        return "\n".join(lines)
 
-        Returns:
-            Tuple of (should_retry, reason)
-        """
-        for job in self.jobs:
-            if job.name == job_name:
-                failed_step = job.has_failed_step(step_name)
-                if failed_step:
-                    return True, f"Step '{step_name}' in job '{job_name}' failed"
-                return False, (
-                    f"Step '{step_name}' in job '{job_name}' did not fail "
-                    f"(other failures ignored)"
-                )
-        return False, f"Job '{job_name}' not found"
 
-    def _check_step_filter(self, step_name: str) -> Tuple[bool, str]:
-        """
-        Check if specific step failed in any job.
+def profiled(phase: str) -> Callable:
+    """
+    Mark a function as a phase of the pipeline for the active Profiler.
 
-        Args:
-            step_name: Name of the step to check
+    Args:
+        phase: Name of the phase
 
-        Returns:
-            Tuple of (should_retry, reason)
-        """
-        for job in self.jobs:
-            failed_step = job.has_failed_step(step_name)
-            if failed_step:
-                return True, f"Step '{step_name}' failed in job '{job.name}'"
-        return False, f"Step '{step_name}' did not fail (other failures ignored)"
+    Returns:
+        Decorator, which adds no overhead but a check when not profiling
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            profiler = Profiler.active
+            if profiler is None:
+                return function(*args, **kwargs)
+            with profiler.phase(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RequestShaper:
+    """
+    Shapes list requests and trims their items to the fields models use.
 
-    def _check_job_filter(self, job_name: str) -> Tuple[bool, str]:
+    Every list request asks for the maximum page size and the narrowest
+    result set the endpoint supports, and every item is projected right
+    when its page is parsed so full API objects are never kept around.
+    """
+
+    # Query parameters narrowing each kind of list
+    QUERY = {
+        # Only the latest attempt of each job, not every attempt of reruns
+        "jobs": {"filter": "latest"},
+        "workflow_runs": {"exclude_pull_requests": "true"},
+    }
+
+    # Fields read by WorkflowJob, WorkflowStep and WorkflowRun
+    FIELDS = {
+        "jobs": ("id", "name", "status", "conclusion", "created_at", "started_at", "completed_at", "steps"),
+        "steps": ("name", "status", "conclusion"),
+        "workflow_runs": (
+            "id", "name", "path", "status", "conclusion", "created_at", "run_started_at", "updated_at",
+            "run_attempt", "head_sha", "display_title"
+        ),
+        "workflows": ("id", "name", "path"),
+    }
+
+    @classmethod
+    def shape(cls, endpoint: str, items_key: str) -> str:
         """
-        Check if specific job failed.
+        Add page size and filters to a list endpoint.
+
+        Parameters already present in the endpoint are kept as is.
 
         Args:
-            job_name: Name of the job to check
+            endpoint: API endpoint of a list
+            items_key: Key of the list in the response (e.g., "jobs")
 
         Returns:
-            Tuple of (should_retry, reason)
+            Shaped endpoint, without page parameter
         """
-        for job in self.jobs:
-            if job.name == job_name:
-                if job.is_failed():
-                    return True, f"Job '{job_name}' failed"
-                return False, f"Job '{job_name}' did not fail (other failures ignored)"
-        return False, f"Job '{job_name}' not found"
-
-    def should_retry(
-        self,
-        job_name: Optional[str] = None,
-        step_name: Optional[str] = None
-    ) -> Tuple[bool, str]:
+        path, _, query = endpoint.partition("?")
+        params = dict(parse_qsl(query))
+        extra = dict(cls.QUERY.get(items_key, {}))
+        # Listing the jobs of a given attempt does not support filter
+        if "/attempts/" in path:
+            extra.pop("filter", None)
+        for key, value in extra.items():
+            params.setdefault(key, value)
+        params["per_page"] = str(PAGE_SIZE)
+        return f"{path}?{urlencode(params, safe='/:')}"
+
+    @classmethod
+    def project(cls, items_key: str, item: Dict) -> Dict:
         """
-        Determine if workflow should be retried based on filters.
+        Keep only the fields models use from a list item.
 
         Args:
-            job_name: Optional job name filter
-            step_name: Optional step name filter
+            items_key: Key of the list the item comes from
+            item: Item as returned by the API
 
         Returns:
-            Tuple of (should_retry, reason)
+            Projected item (unchanged if the list kind is unknown)
         """
-        # If workflow has no conclusion (still in progress), don't retry
-        if self.conclusion is None:
-            return False, f"Workflow is still in progress (status: {self.status}), not retrying"
+        fields = cls.FIELDS.get(items_key)
+        if fields is None:
+            return item
+        projected = {key: item[key] for key in fields if key in item}
+        if "steps" in projected:
+            projected["steps"] = [cls.project("steps", step) for step in projected["steps"]]
+        return projected
 
-        # If workflow succeeded overall, don't retry
-        if self.succeeded():
-            return False, f"Workflow status is '{self.conclusion}', no retry needed"
 
-        # Check filters based on what was provided
-        if job_name and step_name:
-            return self._check_job_and_step_filter(job_name, step_name)
-        if step_name:
-            return self._check_step_filter(step_name)
-        if job_name:
-            return self._check_job_filter(job_name)
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Check if a gh failure is due to the rate limit of the token used.
 
-        # No filters, retry on any failure
-        return True, "Workflow has failures"
+    Args:
+        error: Exception raised by a gh command
 
+    Returns:
+        True if the request was rejected by a (primary or secondary) rate limit
+    """
+    if isinstance(error, subprocess.CalledProcessError):
+        return bool(RATE_LIMIT_ERROR_PATTERN.search(error.stderr or ""))
+    return False
 
-class WorkflowRetryManager:
-    """Manages workflow retry operations."""
 
-    def __init__(
-        self,
-        repo: str,
-        branch: str,
-        workflow_name: str,
-        max_retries: int = 1,
-        retry_mode: str = "failed-only"
-    ):
-        """
-        Initialize workflow retry manager.
+def normalize_endpoint(endpoint: str) -> str:
+    """
+    Normalize an API endpoint so equivalent requests compare equal.
 
-        Args:
-            repo: Repository in owner/repo format
-            branch: Branch name
-            workflow_name: Workflow name
-            max_retries: Maximum number of retries allowed
-            retry_mode: Retry behavior ("all" or "failed-only")
-        """
-        self.client = GitHubClient(repo)
-        self.branch = branch
-        self.workflow_name = workflow_name
-        self.max_retries = max_retries
-        self.retry_mode = retry_mode
+    Args:
+        endpoint: API endpoint, with or without leading slash and query
 
-    def get_latest_commit_sha(self) -> str:
-        """
-        Get the SHA of the latest commit on the branch.
+    Returns:
+        Endpoint without leading slash and with sorted query parameters
+    """
+    path, _, query = endpoint.lstrip("/").partition("?")
+    if not query:
+        return path
+    return f"{path}?{urlencode(sorted(parse_qsl(query)), safe='/:')}"
 
-        Returns:
-            Commit SHA
-        """
-        output = self.client.api_get(
-            f"repos/{self.client.repo}/commits/{self.branch}",
-            jq_filter=".sha"
-        )
-        return output
 
-    def get_workflow_runs(self, commit_sha: str) -> List[WorkflowRun]:
+class ResponseCache:
+    """
+    Memoizes GET responses for the duration of a check.
+
+    WorkflowRetryManager.check() and RetryBatch.check() clear the cache
+    they use when they start, so clients reused by long-running services
+    never answer a check with responses of a previous one.
+
+    Concurrent identical requests are coalesced: the first caller fetches
+    the response while the others wait for its result.
+    """
+
+    def __init__(self):
+        """Initialize response cache."""
+        self.hits = 0
+        self._entries: Dict[Tuple, Any] = {}
+        self._inflight: Dict[Tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_or_fetch(self, key: Tuple, fetch: Any) -> Any:
         """
-        Get workflow runs for a specific commit.
+        Get a cached response, or fetch it once for all concurrent callers.
 
         Args:
-            commit_sha: Commit SHA to filter by
+            key: Request key, starting with the normalized endpoint
+            fetch: Callable returning the response (or a value built from
+                responses)
 
         Returns:
-            List of WorkflowRun objects
+            Response
+
+        Raises:
+            Exception: Whatever fetch raised, to every waiting caller
         """
-        print(f"Querying workflow runs for: workflow={self.workflow_name}, branch={self.branch}, commit={commit_sha[:8]}")
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.hits += 1
 
-        try:
-            output = self.client.api_get(
-                f"repos/{self.client.repo}/actions/runs?branch={self.branch}&head_sha={commit_sha}",
-                jq_filter=".workflow_runs[]",
-                paginate=True
-            )
-        except subprocess.CalledProcessError as e:
-            print(f"Warning: Failed to query workflow runs: {e.stderr}")
-            return []
+        if not owner:
+            return future.result()
 
-        if not output:
-            print("No workflow runs found")
-            return []
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            # Not stored if the entry was invalidated while being fetched
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+                self._entries[key] = value
+        future.set_result(value)
+        return value
+
+    def clear(self) -> None:
+        """Forget all cached responses, requests in flight are still shared."""
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate_run(self, run_id: int) -> None:
+        """
+        Forget cached responses about a workflow run.
 
-        # Parse JSON lines
-        runs = []
-        for line in output.strip().split("\n"):
-            if line:
-                run_data = json.loads(line)
-                # Filter by workflow name
-                if run_data.get("name") == self.workflow_name or \
-                   run_data.get("path", "").endswith(f"/{self.workflow_name}"):
-                    runs.append(WorkflowRun(self.client, run_data))
-
-        print(f"Found {len(runs)} matching workflow runs")
-        return runs
+        The commit snapshots listing the run are forgotten too, with the
+        other responses about their commit (e.g. its run listings).
 
-    def get_latest_workflow_run(self) -> Optional[WorkflowRun]:
+        Args:
+            run_id: Workflow run ID
         """
-        Get the most recent workflow run.
+        with self._lock:
+            shas = {
+                value.commit_sha for value in self._entries.values()
+                if isinstance(value, CommitSnapshot) and any(run.get("id") == run_id for run in value.runs)
+            }
+            patterns = [rf"/actions/runs/{run_id}(/|\?|$)"]
+            patterns.extend(rf"(/commits/|head_sha=){re.escape(sha)}(/|&|$)" for sha in shas)
+            pattern = re.compile("|".join(patterns))
+            for entries in (self._entries, self._inflight):
+                for key in [k for k in entries if pattern.search(k[0])]:
+                    del entries[key]
 
-        Returns:
-            Latest WorkflowRun or None if not found
+
+class SubprocessTransport:
+    """
+    Runs gh commands as subprocesses and App requests over HTTPS.
+
+    Transports also give the clock of the client, so that replays can run
+    faster than the recording.
+    """
+
+    def run(self, cmd: List[str], env: Dict[str, str], timeout: float) -> str:
         """
-        commit_sha = self.get_latest_commit_sha()
-        print(f"Latest commit on {self.branch}: {commit_sha}")
+        Run a gh command.
 
-        runs = self.get_workflow_runs(commit_sha)
+        Args:
+            cmd: Command line
+            env: Environment of the process
+            timeout: Maximum duration in seconds
 
-        if not runs:
-            return None
+        Returns:
+            Command output
 
-        # Sort by created_at descending to get the latest
-        runs.sort(key=lambda x: x.created_at or "", reverse=True)
-        return runs[0]
+        Raises:
+            subprocess.CalledProcessError: If command fails
+            subprocess.TimeoutExpired: If command does not complete in time
+        """
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            check=True,
+            env=env,
+            timeout=timeout
+        )
+        return result.stdout
 
-    def execute_retry_logic(
-        self,
-        job_filter: Optional[str] = None,
-        step_filter: Optional[str] = None
-    ) -> Dict[str, Any]:
+    def request(self, method: str, url: str, headers: Dict[str, str], timeout: float) -> str:
         """
-        Execute the complete retry logic and return results.
+        Send an HTTP request, for the API calls gh cannot make (App JWT).
 
         Args:
-            job_filter: Optional job name filter
-            step_filter: Optional step name filter
+            method: HTTP method
+            url: Request URL
+            headers: Request headers
+            timeout: Maximum duration in seconds
 
         Returns:
-            Dictionary with status, retry_count, was_retried, and run_id
+            Response body
+
+        Raises:
+            urllib.error.HTTPError: If the response has an error status
         """
-        print(f"Repository: {self.client.repo}")
+        request = urllib.request.Request(url, method=method, headers=headers)
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.read().decode()
 
-        # Get latest workflow run
-        workflow_run = self.get_latest_workflow_run()
+    def now(self) -> float:
+        """Get the current time in epoch seconds."""
+        return time.time()
 
-        if not workflow_run:
-            print(
-                f"No workflow run found for '{self.workflow_name}' "
-                f"on branch '{self.branch}'"
-            )
-            return {
-                "status": "not_found",
-                "retry_count": 0, # No retries performed, it does not exists
-                "was_retried": False,
-                "run_id": None
-            }
+    def monotonic(self) -> float:
+        """Get the monotonic clock used for deadlines, in seconds."""
+        return time.monotonic()
 
-        print(f"Workflow run ID: {workflow_run.id}")
-        print(f"Workflow status: {workflow_run.conclusion}")
+    def sleep(self, seconds: float) -> None:
+        """
+        Wait, e.g. between polls or before retrying a request.
 
-        # Early exit if workflow succeeded - no retry needed
-        # This avoids unnecessary API calls and filter checks
-        if workflow_run.succeeded():
-            print("Workflow succeeded, no retry needed")
-            return {
-                "status": workflow_run.conclusion or "unknown",
-                "retry_count": 0,  # No retries performed by this action run
-                "was_retried": False,
-                "run_id": workflow_run.id
-            }
+        Args:
+            seconds: Time to wait
+        """
+        time.sleep(seconds)
 
-        # Workflow failed - check if it matches retry filters
-        should_retry, retry_reason = workflow_run.should_retry(
-            job_filter,
-            step_filter
-        )
-        print(f"Retry decision: {retry_reason}")
+    def marker(self) -> str:
+        """Get a random marker correlating a dispatch with its run."""
+        return uuid.uuid4().hex[:12]
 
-        # Early exit if filters don't match
-        if not should_retry:
-            print(f"Not retrying: {retry_reason}")
-            return {
-                "status": workflow_run.conclusion or workflow_run.status or "unknown",
-                "retry_count": 0,  # No retries performed by this action run
-                "was_retried": False,
-                "run_id": workflow_run.id
-            }
 
-        # Only fetch retry count if we actually need to consider retrying
-        retry_count = workflow_run.retry_count
-        print(f"Current retry count: {retry_count}")
+def open_cassette(path: str, mode: str) -> IO[str]:
+    """
+    Open a cassette file, gzip-compressed if its name ends with .gz.
 
-        # Determine if we should retry based on max_retries
-        was_retried = False
-        if retry_count < self.max_retries:
-            print(
-                f"Retrying workflow (mode: {self.retry_mode}, "
-                f"attempt {retry_count + 1}/{self.max_retries})..."
-            )
-            was_retried = workflow_run.retry(mode=self.retry_mode)
-            if was_retried:
-                print("Workflow retry initiated successfully")
-                retry_count += 1
-            else:
-                print("Failed to retry workflow", file=sys.stderr)
-        else:
-            print(
-                f"Max retries ({self.max_retries}) already reached, "
-                f"not retrying"
-            )
+    Args:
+        path: Cassette file
+        mode: "r" or "w"
 
-        return {
-            "status": workflow_run.conclusion or "unknown",
-            "retry_count": retry_count,
-            "was_retried": was_retried,
-            "run_id": workflow_run.id
-        }
+    Returns:
+        Text file object
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
 
 
-class RetryOutputWriter:
-    """Handles writing outputs and summaries."""
+class RecordingTransport:
+    """
+    Records every gh command and its outcome to a cassette file.
 
-    @staticmethod
-    def write_github_output(
-        output_file: Optional[str],
-        status: str,
-        retry_count: int,
-        was_retried: bool
-    ) -> None:
+    The cassette holds one JSON object per line with the repository, the
+    command, its output, error and exit code and its duration. Tokens are
+    passed in the environment and never recorded. HTTP requests of GitHub
+    Apps are recorded without headers and with the minted tokens redacted,
+    and the times read from the clock are recorded too.
+    """
+
+    def __init__(self, path: str, transport: Optional[SubprocessTransport] = None):
         """
-        Write output variables for GitHub Actions.
+        Initialize recording transport.
 
         Args:
-            output_file: Path to output file (GITHUB_OUTPUT)
-            status: Workflow status
-            retry_count: Number of retries performed
-            was_retried: Whether retry was triggered
+            path: Cassette file (gzip-compressed if it ends with .gz)
+            transport: Transport actually running the commands
         """
-        variables = {
-            "status": status,
-            "retry_count": str(retry_count),
-            "was_retried": "true" if was_retried else "false"
+        self.transport = transport if transport is not None else SubprocessTransport()
+        self.file = open_cassette(path, "w")
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def run(self, cmd: List[str], env: Dict[str, str], timeout: float) -> str:
+        """Run and record a gh command, see SubprocessTransport.run."""
+        entry: Dict[str, Any] = {
+            "repo": env.get("GH_REPO"),
+            "cmd": cmd,
+            "offset": round(time.monotonic() - self.started, 3)
         }
+        started = time.monotonic()
+        try:
+            output = self.transport.run(cmd, env, timeout)
+            entry.update(returncode=0, stdout=output)
+            return output
+        except subprocess.CalledProcessError as e:
+            entry.update(returncode=e.returncode, stdout=e.stdout or "", stderr=e.stderr or "")
+            raise
+        except subprocess.TimeoutExpired:
+            entry.update(timeout=True)
+            raise
+        finally:
+            entry["seconds"] = round(time.monotonic() - started, 3)
+            self._write(entry)
+
+    def request(self, method: str, url: str, headers: Dict[str, str], timeout: float) -> str:
+        """Send and record an HTTP request, see SubprocessTransport.request."""
+        entry: Dict[str, Any] = {"method": method, "url": url, "offset": round(time.monotonic() - self.started, 3)}
+        started = time.monotonic()
+        try:
+            body = self.transport.request(method, url, headers, timeout)
+            data = json.loads(body) if body else {}
+            if isinstance(data, dict) and "token" in data:
+                data["token"] = "***"
+            entry.update(status=200, body=json.dumps(data))
+            return body
+        except urllib.error.HTTPError as e:
+            entry.update(status=e.code, body="")
+            raise
+        except (OSError, ValueError) as e:
+            # Network failures, timeouts and invalid responses
+            entry.update(error=type(e).__name__, message=str(e))
+            raise
+        finally:
+            entry["seconds"] = round(time.monotonic() - started, 3)
+            self._write(entry)
+
+    def now(self) -> float:
+        """Get and record the current time, see SubprocessTransport.now."""
+        now = self.transport.now()
+        self._write({"now": now})
+        return now
+
+    def monotonic(self) -> float:
+        """Get the monotonic clock, see SubprocessTransport.monotonic."""
+        return self.transport.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        """Wait, see SubprocessTransport.sleep."""
+        self.transport.sleep(seconds)
+
+    def marker(self) -> str:
+        """Get and record a marker, see SubprocessTransport.marker."""
+        marker = self.transport.marker()
+        self._write({"marker": marker})
+        return marker
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        """Append an entry to the cassette."""
+        with self.lock:
+            self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def close(self) -> None:
+        """Flush and close the cassette."""
+        with self.lock:
+            self.file.close()
+
+
+class ReplayTransport:
+    """
+    Answers gh commands from a cassette, without network access.
+
+    Commands are matched by repository and command line, and HTTP requests
+    by method and URL; identical commands get the recorded responses in
+    order, then the last one again. The clock of the client starts at the
+    recorded times and moves forward by the waits and recorded durations,
+    which are only actually waited for, divided by the speed, if a speed
+    is set. Dispatches get the recorded correlation markers, so that they
+    find the recorded runs.
+    """
 
-        if output_file:
-            with open(output_file, "a") as f:
-                for key, value in variables.items():
-                    f.write(f"{key}={value}\n")
+    # Exceptions raised again for the HTTP request failures of a cassette
+    HTTP_ERRORS = {
+        "URLError": urllib.error.URLError,
+        "TimeoutError": TimeoutError,
+        "JSONDecodeError": ValueError,
+        "ValueError": ValueError,
+    }
 
-        # Also print to stdout
-        print("\nOutput variables:")
-        for key, value in variables.items():
-            print(f"  {key}={value}")
+    def __init__(self, path: str, speed: Optional[float] = None):
+        """
+        Initialize replay transport.
+
+        Args:
+            path: Cassette file written by RecordingTransport
+            speed: Replay speed relative to the recording (1 for recorded
+                durations, 10 for ten times faster), no delay if None
+        """
+        self.speed = speed
+        self.entries: Dict[Tuple, Deque[Dict]] = {}
+        self.times: Deque[float] = deque()
+        self.markers: Deque[str] = deque()
+        # Time skipped by faster than real time waits
+        self.skipped = 0.0
+        self.lock = threading.Lock()
+        with open_cassette(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "now" in entry:
+                    self.times.append(entry["now"])
+                elif "marker" in entry:
+                    self.markers.append(entry["marker"])
+                elif "url" in entry:
+                    self.entries.setdefault(("http", entry["method"], entry["url"]), deque()).append(entry)
+                else:
+                    self.entries.setdefault(self._key(entry["repo"], entry["cmd"]), deque()).append(entry)
 
     @staticmethod
-    def write_step_summary(
-        workflow_name: str,
-        branch: str,
-        status: str,
-        retry_count: int,
-        was_retried: bool,
-        max_retries: int,
-        retry_mode: str,
-        run_id: Optional[int] = None
-    ) -> None:
+    def _key(repo: Optional[str], cmd: List[str]) -> Tuple:
+        """Get the key matching a command to its recorded entries."""
+        return (repo, tuple(cmd))
+
+    def _next(self, key: Tuple, description: str) -> Dict:
         """
-        Write a summary to GitHub Actions step summary.
+        Get the next recorded entry of a command or request.
+
+        Raises:
+            KeyError: If the command or request was not recorded
+        """
+        with self.lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                raise KeyError(f"Not in cassette: {description}")
+            return recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+    def run(self, cmd: List[str], env: Dict[str, str], timeout: float) -> str:
+        """
+        Replay the response of a gh command, see SubprocessTransport.run.
+
+        Raises:
+            KeyError: If the command was not recorded
+        """
+        repo = env.get("GH_REPO")
+        entry = self._next(self._key(repo, cmd), f"{' '.join(cmd)} (repo {repo})")
+        self.sleep(min(entry["seconds"], timeout))
+        if entry.get("timeout"):
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if entry["returncode"]:
+            raise subprocess.CalledProcessError(
+                entry["returncode"], cmd, output=entry["stdout"], stderr=entry["stderr"]
+            )
+        return entry["stdout"]
+
+    def request(self, method: str, url: str, headers: Dict[str, str], timeout: float) -> str:
+        """
+        Replay the response of an HTTP request, see SubprocessTransport.request.
+
+        Raises:
+            KeyError: If the request was not recorded
+        """
+        entry = self._next(("http", method, url), f"{method} {url}")
+        self.sleep(min(entry["seconds"], timeout))
+        if "error" in entry:
+            raise self.HTTP_ERRORS.get(entry["error"], OSError)(entry["message"])
+        if entry["status"] >= 400:
+            raise urllib.error.HTTPError(url, entry["status"], "Recorded error", None, None)
+        return entry["body"]
+
+    def now(self) -> float:
+        """Get the next recorded time, the current time if none was recorded."""
+        with self.lock:
+            if not self.times:
+                return time.time() + self.skipped
+            return self.times.popleft() if len(self.times) > 1 else self.times[0]
+
+    def monotonic(self) -> float:
+        """Get the monotonic clock, moved forward by the skipped waits."""
+        return time.monotonic() + self.skipped
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Wait for seconds divided by the speed, not at all if no speed is set.
+
+        Args:
+            seconds: Time to wait at the recorded speed
+        """
+        waited = seconds / self.speed if self.speed else 0.0
+        with self.lock:
+            self.skipped += seconds - waited
+        if waited > 0:
+            time.sleep(waited)
+
+    def marker(self) -> str:
+        """Get the next recorded marker, a new one if none is left."""
+        with self.lock:
+            if self.markers:
+                return self.markers.popleft()
+        return uuid.uuid4().hex[:12]
+
+
+class Credential:
+    """A token and the rate-limit state tracked for it."""
+
+    def __init__(
+        self,
+        token: str,
+        name: str,
+        repos: Optional[List[str]] = None,
+        scopes: Optional[FrozenSet[str]] = None
+    ):
+        """
+        Initialize credential.
+
+        Args:
+            token: Token passed to gh
+            name: Name of the credential in logs (the token is never printed)
+            repos: owner/repo patterns the token has access to (all if None)
+            scopes: OAuth scopes of the token (discovered if None, unknown
+                for App and fine-grained tokens)
+        """
+        self.token = token
+        self.name = name
+        self.repos = repos
+        self.scopes = scopes
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+        self.checked_at: Optional[float] = None
+
+    def can_access(self, repo: str) -> bool:
+        """
+        Check if the credential has access to a repository.
+
+        Args:
+            repo: Repository in owner/repo format
+
+        Returns:
+            True if the repository matches one of the credential patterns
+        """
+        if self.repos is None:
+            return True
+        return any(fnmatch.fnmatch(repo, pattern) for pattern in self.repos)
+
+    def current_token(self) -> str:
+        """
+        Get the token to send with the next request.
+
+        Returns:
+            Token passed to gh
+        """
+        return self.token
+
+    def has_scope(self, scope: str) -> bool:
+        """
+        Check if the credential has an OAuth scope.
+
+        Args:
+            scope: Scope name (e.g., "workflow")
+
+        Returns:
+            True if the scope was granted, or if scopes are unknown
+        """
+        return self.scopes is None or scope in self.scopes
+
+    def headroom(self) -> int:
+        """
+        Get the number of requests the credential can still make.
+
+        Returns:
+            Remaining requests in the current rate-limit window
+        """
+        if self.remaining is None:
+            return 0
+        return max(self.remaining, 0)
+
+
+class GitHubAppAuth:
+    """
+    Authenticates as a GitHub App and mints installation tokens.
+
+    The JWT is signed locally with openssl, then exchanged for installation
+    tokens. Tokens are kept in memory and in an optional cache file shared
+    between invocations, until expiry_margin seconds before they expire.
+    """
+
+    def __init__(
+        self,
+        app_id: str,
+        private_key: str,
+        cache_file: Optional[str] = None,
+        expiry_margin: float = 300,
+        transport: Optional[Any] = None
+    ):
+        """
+        Initialize GitHub App authentication.
+
+        Args:
+            app_id: GitHub App ID (or client ID)
+            private_key: PEM private key of the App
+            cache_file: File caching installation tokens (optional)
+            expiry_margin: Seconds before expiry after which a token is
+                replaced
+            transport: Transport sending the API requests of the App, to
+                record them (SubprocessTransport if not provided)
+        """
+        self.app_id = str(app_id)
+        self.private_key = private_key
+        self.cache_file = JsonStateFile(cache_file) if cache_file else None
+        self.expiry_margin = expiry_margin
+        self.transport = transport if transport is not None else SubprocessTransport()
+        self.tokens: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+        if cache_file and not os.path.exists(cache_file):
+            # Tokens must not be readable by other users
+            os.close(os.open(cache_file, os.O_CREAT | os.O_WRONLY, 0o600))
+
+    @staticmethod
+    def _base64url(data: bytes) -> str:
+        """Encode data in unpadded base64url."""
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+    def _sign(self, data: bytes) -> bytes:
+        """
+        Sign data with RS256 using openssl.
+
+        Args:
+            data: Data to sign
+
+        Returns:
+            Signature bytes
+        """
+        fd, key_path = tempfile.mkstemp(suffix=".pem")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.private_key)
+            result = subprocess.run(
+                ["openssl", "dgst", "-sha256", "-sign", key_path],
+                input=data,
+                capture_output=True,
+                check=True
+            )
+        finally:
+            os.unlink(key_path)
+        return result.stdout
+
+    def create_jwt(self) -> str:
+        """
+        Create a JWT authenticating as the App for 10 minutes.
+
+        Returns:
+            Signed JWT
+        """
+        now = int(time.time())
+        header = self._base64url(json.dumps({"alg": "RS256", "typ": "JWT"}).encode())
+        # Backdated to allow for clock drift
+        payload = self._base64url(json.dumps({"iat": now - 60, "exp": now + 540, "iss": self.app_id}).encode())
+        signing_input = f"{header}.{payload}"
+        return f"{signing_input}.{self._base64url(self._sign(signing_input.encode()))}"
+
+    def _request(self, method: str, path: str, jwt: str) -> Any:
+        """
+        Send an API request authenticated with a JWT.
+
+        Args:
+            method: HTTP method
+            path: API path (e.g., "/repos/owner/repo/installation")
+            jwt: App JWT
+
+        Returns:
+            Decoded JSON response
+        """
+        headers = {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"Bearer {jwt}",
+            "X-GitHub-Api-Version": "2022-11-28"
+        }
+        return json.loads(self.transport.request(method, f"{GITHUB_API_URL}{path}", headers, DEFAULT_REQUEST_TIMEOUT))
+
+    def _is_valid(self, entry: Optional[Dict]) -> bool:
+        """Check if a cached token can still be used."""
+        return bool(entry) and entry["expires_at"] - self.expiry_margin > time.time()
+
+    def _find_installation(self, owner: str, jwt: str) -> int:
+        """
+        Look up the installation of the App on an organization or user.
+
+        Args:
+            owner: Account the App is installed on
+            jwt: App JWT
+
+        Returns:
+            Installation ID
+
+        Raises:
+            NoCredentialError: If the App is not installed on owner
+        """
+        for path in (f"/orgs/{owner}/installation", f"/users/{owner}/installation"):
+            try:
+                return self._request("GET", path, jwt)["id"]
+            except urllib.error.HTTPError as e:
+                if e.code != 404:
+                    raise
+        raise NoCredentialError(f"GitHub App {self.app_id} is not installed on {owner}")
+
+    def _mint(self, owner: str, installation_id: Optional[int]) -> Dict:
+        """
+        Exchange a new JWT for an installation token.
+
+        Args:
+            owner: Account the App is installed on
+            installation_id: Installation ID (looked up from owner if None)
+
+        Returns:
+            Token entry with "token", "expires_at" and "permissions"
+        """
+        jwt = self.create_jwt()
+        if installation_id is None:
+            installation_id = self._find_installation(owner, jwt)
+        data = self._request("POST", f"/app/installations/{installation_id}/access_tokens", jwt)
+        return {
+            "token": data["token"],
+            "expires_at": parse_timestamp(data["expires_at"]).timestamp(),
+            "permissions": data.get("permissions", {})
+        }
+
+    def installation_token(self, owner: str, installation_id: Optional[int] = None) -> Dict:
+        """
+        Get a valid installation token, minting one only if needed.
+
+        Args:
+            owner: Account the App is installed on
+            installation_id: Installation ID (looked up from owner if None)
+
+        Returns:
+            Token entry with "token", "expires_at" and "permissions"
+        """
+        key = f"{self.app_id}#{installation_id or owner}"
+        with self.lock:
+            entry = self.tokens.get(key)
+            if self._is_valid(entry):
+                return entry
+
+            if self.cache_file is None:
+                entry = self._mint(owner, installation_id)
+            else:
+                # Concurrent invocations wait for the first one to mint
+                with self.cache_file.update() as state:
+                    entry = state.get(key)
+                    if not self._is_valid(entry):
+                        entry = self._mint(owner, installation_id)
+                        state[key] = entry
+            self.tokens[key] = entry
+            return entry
+
+
+class AppInstallationCredential(Credential):
+    """
+    A GitHub App installation in a token pool.
+
+    The installation token is minted by current_token(), which also sets
+    the scopes from the permissions of the installation.
+    """
+
+    def __init__(
+        self,
+        auth: GitHubAppAuth,
+        owner: str,
+        installation_id: Optional[int] = None,
+        name: Optional[str] = None,
+        repos: Optional[List[str]] = None
+    ):
+        """
+        Initialize App installation credential.
+
+        Args:
+            auth: Authentication of the App
+            owner: Account the App is installed on
+            installation_id: Installation ID (looked up from owner if None)
+            name: Name of the credential in logs
+            repos: owner/repo patterns the installation has access to
+                (repositories of owner if None)
+        """
+        super().__init__(
+            # Not minted yet
+            token="",
+            name=name or f"app-{auth.app_id}-{owner}",
+            repos=repos if repos is not None else [f"{owner}/*"]
+        )
+        self.auth = auth
+        self.owner = owner
+        self.installation_id = installation_id
+
+    def current_token(self) -> str:
+        """
+        Get the installation token, minted if it is missing or expiring.
+
+        Returns:
+            Installation token
+
+        Raises:
+            NoCredentialError: If the App is not installed on the owner
+            urllib.error.URLError: If the App API could not be reached
+        """
+        entry = self.auth.installation_token(self.owner, self.installation_id)
+        self.token = entry["token"]
+        # Rerunning workflows requires write access to actions
+        self.scopes = frozenset({"workflow"}) if entry["permissions"].get("actions") == "write" else frozenset()
+        return self.token
+
+
+class TokenPool:
+    """
+    Routes requests to the credential with the most rate-limit headroom.
+
+    The rate limit of each credential is read from the rate_limit endpoint
+    (which does not count against it), then decremented locally for every
+    request and read again after refresh_interval, as other jobs consume
+    the same limit.
+    """
+
+    def __init__(
+        self,
+        credentials: List[Credential],
+        refresh_interval: float = 60,
+        apps: Optional[List[GitHubAppAuth]] = None
+    ):
+        """
+        Initialize token pool.
+
+        Args:
+            credentials: Credentials of the pool
+            refresh_interval: Seconds after which the rate limit of a
+                credential is read again
+            apps: GitHub Apps whose installation on the owner of each
+                repository is added to the pool when first needed
+        """
+        self.credentials = credentials
+        self.refresh_interval = refresh_interval
+        self.apps = apps or []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(
+        cls,
+        path: str,
+        app_token_cache_file: Optional[str] = None,
+        transport: Optional[Any] = None
+    ) -> "TokenPool":
+        """
+        Load a token pool from a JSON file.
+
+        The file holds a list of objects with either a "token_env" key, the
+        name of the environment variable holding the token (or "token"), or
+        an "app_id" key and a "private_key_env" key, the name of the
+        environment variable holding the App private key. Optional keys are
+        "name", "repos" and "scopes" for tokens, "owner" and
+        "installation_id" for Apps (installed on the owner of each
+        repository if no owner is set).
+
+        Args:
+            path: Path to the tokens file
+            app_token_cache_file: File caching App installation tokens
+                (optional)
+            transport: Transport sending the API requests of the Apps
+                (optional)
+
+        Returns:
+            TokenPool with the credentials of the file
+
+        Raises:
+            ValueError: If an entry has no token or private key
+        """
+        with open(path) as f:
+            entries = json.load(f)
+
+        credentials: List[Credential] = []
+        apps = []
+        for index, entry in enumerate(entries):
+            if entry.get("app_id"):
+                private_key = os.environ.get(entry.get("private_key_env", ""))
+                if not private_key:
+                    raise ValueError(f"GitHub App {entry['app_id']} has no private key")
+                auth = GitHubAppAuth(entry["app_id"], private_key, app_token_cache_file, transport=transport)
+                if entry.get("owner"):
+                    credentials.append(AppInstallationCredential(
+                        auth,
+                        entry["owner"],
+                        entry.get("installation_id"),
+                        name=entry.get("name"),
+                        repos=entry.get("repos")
+                    ))
+                else:
+                    apps.append(auth)
+                continue
+
+            name = entry.get("name") or entry.get("token_env") or f"token-{index + 1}"
+            token = os.environ.get(entry["token_env"]) if entry.get("token_env") else entry.get("token")
+            if not token:
+                raise ValueError(f"Credential {name} has no token")
+            scopes = entry.get("scopes")
+            credentials.append(Credential(
+                token=token,
+                name=name,
+                repos=entry.get("repos"),
+                scopes=frozenset(scopes) if scopes is not None else None
+            ))
+        return cls(credentials, apps=apps)
+
+    def refresh(
+        self,
+        credential: Credential,
+        run: Optional[Callable[[List[str], Dict[str, str]], str]] = None
+    ) -> None:
+        """
+        Read the rate-limit state and scopes of a credential.
+
+        A rate_limit endpoint answering 404 means rate limiting is disabled
+        (GitHub Enterprise Server), the credential is then unlimited.
+
+        Args:
+            credential: Credential to refresh
+            run: Function running a gh command line with an environment,
+                so that the request goes through the concurrency limit,
+                request policy and transport of a client (a plain gh
+                process if None)
+        """
+        now = time.time()
+        cmd = ["gh", "api", "--include", "rate_limit"]
+        try:
+            env = dict(os.environ, GH_TOKEN=credential.current_token())
+            if run is not None:
+                output = run(cmd, env)
+            else:
+                output = SubprocessTransport().run(cmd, env, DEFAULT_REQUEST_TIMEOUT)
+        except subprocess.CalledProcessError as e:
+            if " 404" in (e.stdout or "").split("\n", 1)[0] or "HTTP 404" in (e.stderr or ""):
+                logger.info(f"Rate limiting is disabled for {credential.name}")
+                with self.lock:
+                    credential.remaining = sys.maxsize
+                    credential.reset_at = now + self.refresh_interval
+                    credential.checked_at = now
+                return
+            self._mark_unknown(credential, now, e)
+            return
+        except (subprocess.TimeoutExpired, NoCredentialError, OSError) as e:
+            self._mark_unknown(credential, now, e)
+            return
+
+        head, _, body = output.replace("\r\n", "\n").partition("\n\n")
+        core = json.loads(body)["resources"]["core"]
+        with self.lock:
+            credential.remaining = core["remaining"]
+            credential.reset_at = core["reset"]
+            credential.checked_at = now
+            for line in head.split("\n")[1:]:
+                name, _, value = line.partition(":")
+                # Only classic tokens report their scopes
+                if name.strip().lower() == "x-oauth-scopes" and credential.scopes is None:
+                    credential.scopes = frozenset(s.strip() for s in value.split(",") if s.strip())
+
+    def _mark_unknown(self, credential: Credential, now: float, error: Exception) -> None:
+        """Don't use a credential whose rate limit could not be read until the next refresh."""
+        logger.warning(f"Could not read rate limit of {credential.name}: {error}")
+        with self.lock:
+            credential.remaining = 0
+            credential.reset_at = now + self.refresh_interval
+            credential.checked_at = now
+
+    def _is_stale(self, credential: Credential, now: float) -> bool:
+        """Check if the rate-limit state of a credential must be read again."""
+        if credential.checked_at is None:
+            return True
+        if credential.remaining == 0:
+            return now >= credential.reset_at
+        return now - credential.checked_at >= self.refresh_interval
+
+    def _add_app_installations(self, owner: str) -> None:
+        """Add the installations of the pool Apps on an owner, once."""
+        with self.lock:
+            for auth in self.apps:
+                if not any(
+                    isinstance(c, AppInstallationCredential) and c.auth is auth and c.owner == owner
+                    for c in self.credentials
+                ):
+                    self.credentials.append(AppInstallationCredential(auth, owner))
+
+    def _candidates(self, repo: str, scope: Optional[str]) -> List[Credential]:
+        """Get the credentials usable for a request."""
+        if self.apps:
+            self._add_app_installations(repo.split("/")[0])
+        return [
+            c for c in self.credentials
+            if c.can_access(repo) and (scope is None or c.has_scope(scope))
+        ]
+
+    def select(
+        self,
+        repo: str,
+        scope: Optional[str] = None,
+        run: Optional[Callable[[List[str], Dict[str, str]], str]] = None
+    ) -> Credential:
+        """
+        Select the credential of a request and account for it.
+
+        Args:
+            repo: Repository of the request in owner/repo format
+            scope: OAuth scope required by the request (optional)
+            run: Function running the rate_limit requests (see refresh)
+
+        Returns:
+            Usable credential with the most headroom
+
+        Raises:
+            NoCredentialError: If no credential has access to the repository
+                and the scope, or all of them are rate limited
+        """
+        candidates = self._candidates(repo, scope)
+        if not candidates:
+            raise NoCredentialError(f"No credential for {repo}" + (f" with scope {scope}" if scope else ""))
+
+        now = time.time()
+        for credential in candidates:
+            if self._is_stale(credential, now):
+                self.refresh(credential, run)
+
+        # Scopes may have been discovered by the refresh
+        candidates = [c for c in candidates if scope is None or c.has_scope(scope)]
+        with self.lock:
+            best = max(candidates, key=lambda c: c.headroom(), default=None)
+            if best is None or best.headroom() == 0:
+                raise NoCredentialError(f"All credentials for {repo} are rate limited")
+            best.remaining -= 1
+        return best
+
+    def record_rate_limited(self, credential: Credential) -> None:
+        """
+        Mark a credential as rate limited until its limit resets.
+
+        Args:
+            credential: Credential whose request was rejected
+        """
+        with self.lock:
+            credential.remaining = 0
+            # Secondary rate limits don't report a reset time
+            credential.reset_at = max(credential.reset_at, time.time() + self.refresh_interval)
+
+
+class GitHubClient:
+    """Wrapper for GitHub CLI commands."""
+
+    # Limits concurrent gh processes across all clients
+    max_concurrency = DEFAULT_MAX_CONCURRENCY
+    request_slots = threading.BoundedSemaphore(DEFAULT_MAX_CONCURRENCY)
+
+    @classmethod
+    def set_max_concurrency(cls, max_concurrency: int) -> None:
+        """
+        Set the maximum number of concurrent requests of all clients.
+
+        Args:
+            max_concurrency: Maximum number of concurrent gh processes
+        """
+        cls.max_concurrency = max_concurrency
+        cls.request_slots = threading.BoundedSemaphore(max_concurrency)
+
+    def __init__(
+        self,
+        repo: str,
+        cache: Optional[ResponseCache] = None,
+        policy: Optional[RequestPolicy] = None,
+        tokens: Optional[TokenPool] = None,
+        transport: Optional[Any] = None
+    ):
+        """
+        Initialize GitHub CLI client.
+
+        Args:
+            repo: Repository in owner/repo format
+            cache: Response cache, may be shared between clients
+                (a private one is created if not provided)
+            policy: Request policy, may be shared between clients
+                (a default one is created if not provided)
+            tokens: Token pool, may be shared between clients
+                (gh uses the token of the environment if not provided)
+            transport: Transport running the gh commands and giving the
+                clock, to record or replay them (SubprocessTransport if not
+                provided)
+        """
+        self.repo = repo
+        self.stats = RequestStats()
+        self.cache = cache if cache is not None else ResponseCache()
+        self.policy = policy if policy is not None else RequestPolicy()
+        self.tokens = tokens
+        self.transport = transport if transport is not None else SubprocessTransport()
+
+    def now(self) -> float:
+        """Get the current time in epoch seconds, from the transport clock."""
+        return self.transport.now()
+
+    def monotonic(self) -> float:
+        """Get the monotonic clock of deadlines, from the transport."""
+        return self.transport.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Wait through the transport, so that replays can wait less.
+
+        Args:
+            seconds: Time to wait
+        """
+        self.transport.sleep(seconds)
+
+    def marker(self) -> str:
+        """Get a dispatch correlation marker, from the transport."""
+        return self.transport.marker()
+
+    def run_command(self, args: List[str], scope: Optional[str] = None) -> str:
+        """
+        Run a GitHub CLI command and return the output.
+
+        With a token pool, the command runs with the credential having the
+        most headroom, and is sent again with another credential if it is
+        rejected by the rate limit.
+
+        Args:
+            args: List of command arguments for gh CLI
+            scope: OAuth scope required by the command (optional)
+
+        Returns:
+            Command output as string
+
+        Raises:
+            subprocess.CalledProcessError: If command fails
+            subprocess.TimeoutExpired: If command does not complete in time
+            DeadlineExceededError: If the overall deadline has passed
+            CircuitOpenError: If the API is considered unavailable
+            NoCredentialError: If no credential of the pool can be used
+        """
+        cmd = ["gh"] + args
+
+        # Set up environment with GH_REPO
+        env = os.environ.copy()
+        env["GH_REPO"] = self.repo
+
+        if self.tokens is None:
+            return self._run_subprocess(cmd, env)
+
+        while True:
+            credential = self.tokens.select(self.repo, scope, self._run_subprocess)
+            try:
+                return self._run_subprocess(cmd, dict(env, GH_TOKEN=credential.current_token()))
+            except subprocess.CalledProcessError as e:
+                if not is_rate_limit_error(e):
+                    raise
+                # Rejected requests were not executed, even POSTs can be resent
+                logger.warning(f"{credential.name} is rate limited, switching credential")
+                self.tokens.record_rate_limited(credential)
+
+    def _run_subprocess(self, cmd: List[str], env: Dict[str, str]) -> str:
+        """
+        Run a gh process within the concurrency limit and request policy.
+
+        Args:
+            cmd: Command line
+            env: Environment of the process
+
+        Returns:
+            Command output as string
+        """
+        self.policy.breaker.check()
+        timeout = self.policy.timeout_for_request()
+
+        with self.request_slots:
+            started = self.monotonic()
+            output = ""
+            try:
+                output = self.transport.run(cmd, env, timeout)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                if is_transient_error(e):
+                    self.policy.breaker.record_failure()
+                else:
+                    self.policy.breaker.record_success()
+                raise
+            finally:
+                self.stats.record(len(output), self.monotonic() - started)
+
+        self.policy.breaker.record_success()
+        self.policy.latency.record(self.monotonic() - started)
+        return output.strip()
+
+    def _run_hedged(self, args: List[str]) -> str:
+        """
+        Run a read-only command, duplicating it if it is slower than usual.
+
+        When the command takes longer than the recent p95 latency, an
+        identical request is sent and the first response wins.
+
+        Args:
+            args: List of command arguments for gh CLI
+
+        Returns:
+            Command output as string
+        """
+        hedge_delay = self.policy.hedge_delay()
+        if hedge_delay is None:
+            return self.run_command(args)
+
+        pool = ThreadPoolExecutor(max_workers=2)
+        try:
+            futures = [pool.submit(self.run_command, args)]
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                futures.append(pool.submit(self.run_command, args))
+            error: Optional[BaseException] = None
+            for future in as_completed(futures):
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+            raise error
+        finally:
+            # Don't wait for the slower request
+            pool.shutdown(wait=False)
+
+    def _run_idempotent(self, args: List[str]) -> str:
+        """
+        Run a read-only command, retrying transient errors.
+
+        Server errors, network failures and timeouts are retried with a
+        jittered exponential backoff, within the policy deadline.
+
+        Args:
+            args: List of command arguments for gh CLI
+
+        Returns:
+            Command output as string
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._run_hedged(args)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                attempt += 1
+                if not is_transient_error(e) or attempt >= self.policy.max_attempts:
+                    raise
+                delay = self.policy.backoff_delay(attempt)
+                reason = "timeout" if isinstance(e, subprocess.TimeoutExpired) else (e.stderr or "").strip()
+                logger.warning(f"Transient error ({reason}), retrying in {delay:.1f}s")
+                self.sleep(delay)
+
+    def api_get(
+        self,
+        endpoint: str,
+        jq_filter: Optional[str] = None,
+        paginate: bool = False,
+        fresh: bool = False
+    ) -> str:
+        """
+        Execute a GET API request.
+
+        Responses are memoized by the client cache unless fresh is set.
+
+        Args:
+            endpoint: API endpoint (e.g., "repos/owner/repo/commits/main")
+            jq_filter: Optional jq filter expression
+            paginate: Whether to paginate results
+            fresh: Bypass the cache, for values that change over time
+
+        Returns:
+            API response as string
+        """
+        args = ["api", endpoint]
+        if paginate:
+            args.append("--paginate")
+        if jq_filter:
+            args.extend(["--jq", jq_filter])
+        if fresh:
+            return self._run_idempotent(args)
+        key = (normalize_endpoint(endpoint), jq_filter, paginate)
+        return self.cache.get_or_fetch(key, lambda: self._run_idempotent(args))
+
+    def api_get_pages(self, endpoint: str, items_key: str, fresh: bool = False) -> List[Dict]:
+        """
+        Execute a paginated GET API request, fetching pages concurrently.
+
+        The first page gives total_count, from which the remaining page
+        URLs are computed and fetched in parallel (within the client
+        concurrency limit) instead of following Link headers one by one.
+        Requests are shaped and items projected by RequestShaper.
+
+        Args:
+            endpoint: API endpoint of a list returning total_count
+            items_key: Key of the list in the response (e.g., "jobs")
+            fresh: Bypass the cache, for lists that change over time
+
+        Returns:
+            All projected items, in page order
+        """
+        endpoint = RequestShaper.shape(endpoint, items_key)
+
+        def fetch_page(page: int) -> Tuple[int, List[Dict]]:
+            output = self.api_get(f"{endpoint}&page={page}", fresh=fresh)
+            data = json.loads(output) if output else {}
+            items = [RequestShaper.project(items_key, item) for item in data.get(items_key, [])]
+            return data.get("total_count", len(items)), items
+
+        total_count, items = fetch_page(1)
+        page_count = math.ceil(total_count / PAGE_SIZE)
+
+        if page_count > 1:
+            workers = min(page_count - 1, self.max_concurrency)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for _, page_items in pool.map(fetch_page, range(2, page_count + 1)):
+                    items.extend(page_items)
+
+        return items
+
+    def api_get_conditional(
+        self,
+        endpoint: str,
+        etag: Optional[str] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Execute a conditional GET API request.
+
+        Responses that did not change since etag are answered with
+        304 Not Modified, which does not count against the rate limit.
+
+        Args:
+            endpoint: API endpoint
+            etag: ETag of the previous response (optional)
+
+        Returns:
+            Tuple of (body, etag). body is None if not modified.
+        """
+        args = ["api", endpoint, "--include"]
+        if etag:
+            args.extend(["-H", f"If-None-Match: {etag}"])
+        try:
+            output = self._run_idempotent(args)
+        except subprocess.CalledProcessError as e:
+            # gh exits with an error on 304, the response is still on stdout
+            if " 304" not in (e.stdout or "").split("\n", 1)[0]:
+                raise
+            return None, etag
+
+        head, _, body = output.replace("\r\n", "\n").partition("\n\n")
+        lines = head.split("\n")
+        if " 304" in lines[0]:
+            return None, etag
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "etag":
+                etag = value.strip()
+        return body, etag
+
+    def api_post(
+        self,
+        endpoint: str,
+        fields: Optional[Dict[str, str]] = None,
+        scope: Optional[str] = None
+    ) -> bool:
+        """
+        Execute a POST API request.
+
+        Args:
+            endpoint: API endpoint
+            fields: String parameters of the request body (optional)
+            scope: OAuth scope required by the request, e.g. "workflow"
+                to rerun or dispatch workflows (optional)
+
+        Returns:
+            True if successful, False otherwise
+        """
+        match = re.search(r"/actions/runs/(\d+)", f"/{endpoint.lstrip('/')}")
+        if match:
+            self.cache.invalidate_run(int(match.group(1)))
+        try:
+            args = ["api", "--method", "POST", endpoint]
+            for key, value in (fields or {}).items():
+                args.extend(["-f", f"{key}={value}"])
+            self.run_command(args, scope=scope)
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.error(f"POST {endpoint} failed: {e.stderr}")
+            return False
+
+
+class WorkflowStep:
+    """Represents a step within a workflow job."""
+
+    def __init__(self, step_data: Dict):
+        """
+        Initialize workflow step.
+
+        Args:
+            step_data: Step data dictionary from GitHub API
+        """
+        self.name = step_data.get("name")
+        self.conclusion = step_data.get("conclusion")
+        self.status = step_data.get("status")
+
+    def is_failed(self) -> bool:
+        """
+        Check if step failed.
+
+        Returns:
+            True if step failed, False otherwise
+        """
+        return self.conclusion in FAILED_STATUSES
+
+
+class WorkflowJob:
+    """Represents a job within a workflow run."""
+
+    def __init__(self, job_data: Dict):
+        """
+        Initialize workflow job.
+
+        Args:
+            job_data: Job data dictionary from GitHub API
+
+        Raises:
+            ValueError: If required 'id' field is missing
+        """
+        if "id" not in job_data:
+            raise ValueError("Job data missing required 'id' field")
+        self.id = job_data["id"]
+        self.name = job_data.get("name")
+        self.conclusion = job_data.get("conclusion")
+        self.status = job_data.get("status")
+        self.created_at = job_data.get("created_at")
+        self.started_at = job_data.get("started_at")
+        self.completed_at = job_data.get("completed_at")
+        self._steps_data = job_data.get("steps", [])
+        self._steps: Optional[List[WorkflowStep]] = None
+
+    @property
+    def steps(self) -> List[WorkflowStep]:
+        """
+        Get steps in this job (lazy loaded).
+
+        Returns:
+            List of WorkflowStep objects
+        """
+        if self._steps is None:
+            self._steps = [WorkflowStep(step) for step in self._steps_data]
+        return self._steps
+
+    def is_failed(self) -> bool:
+        """
+        Check if job failed.
+
+        Returns:
+            True if job failed, False otherwise
+        """
+        return self.conclusion in FAILED_STATUSES
+
+    def has_failed_step(self, step_name: str) -> Optional[WorkflowStep]:
+        """
+        Check if a specific step failed.
+
+        Args:
+            step_name: Name of the step to check
+
+        Returns:
+            WorkflowStep if found and failed, None otherwise
+        """
+        for step in self.steps:
+            if step.name == step_name and step.is_failed():
+                return step
+        return None
+
+    def duration_minutes(self) -> int:
+        """
+        Get the runner time used by this job, rounded up to whole minutes.
+
+        Returns:
+            Duration in minutes (0 if the job did not start or complete)
+        """
+        started = parse_timestamp(self.started_at)
+        completed = parse_timestamp(self.completed_at)
+        if not started or not completed or completed < started:
+            return 0
+        return math.ceil((completed - started).total_seconds() / 60)
+
+    def queue_seconds(self) -> Optional[int]:
+        """
+        Get the time this job waited for a runner.
+
+        Returns:
+            Seconds from creation to start (None if the job did not start)
+        """
+        return elapsed_seconds(self.created_at, self.started_at)
+
+    def execution_seconds(self) -> Optional[int]:
+        """
+        Get the time this job ran.
+
+        Returns:
+            Seconds from start to completion (None if the job did not complete)
+        """
+        return elapsed_seconds(self.started_at, self.completed_at)
+
+    def failed_steps(self) -> List[WorkflowStep]:
+        """
+        Get all failed steps in this job.
+
+        Returns:
+            List of failed WorkflowStep objects
+        """
+        return [step for step in self.steps if step.is_failed()]
+
+
+def failure_fingerprint(jobs: List[WorkflowJob]) -> FrozenSet[Tuple[str, Optional[str]]]:
+    """
+    Build a fingerprint of the failures in a set of jobs.
+
+    Each failed job contributes one (job name, step name) pair per failed
+    step, or (job name, None) when no individual step is marked as failed
+    (e.g. the job timed out or was cancelled before a step concluded).
+
+    Args:
+        jobs: Jobs of a single workflow run attempt
+
+    Returns:
+        Frozen set of (job_name, step_name) pairs, empty if nothing failed
+    """
+    fingerprint = set()
+    for job in jobs:
+        if not job.is_failed():
+            continue
+        failed_steps = job.failed_steps()
+        if not failed_steps:
+            fingerprint.add((job.name, None))
+        for step in failed_steps:
+            fingerprint.add((job.name, step.name))
+    return frozenset(fingerprint)
+
+
+class WorkflowRun:
+    """Represents a GitHub Actions workflow run."""
+
+    def __init__(self, client: GitHubClient, run_data: Dict):
+        """
+        Initialize workflow run.
+
+        Args:
+            client: GitHubClient instance
+            run_data: Workflow run data dictionary from GitHub API
+
+        Raises:
+            ValueError: If required 'id' field is missing
+        """
+        if "id" not in run_data:
+            raise ValueError("Workflow run data missing required 'id' field")
+        self.client = client
+        self.id = run_data["id"]
+        self.name = run_data.get("name")
+        self.status = run_data.get("status")
+        self.conclusion = run_data.get("conclusion")
+        self.created_at = run_data.get("created_at")
+        self.run_started_at = run_data.get("run_started_at")
+        self.updated_at = run_data.get("updated_at")
+        self.path = run_data.get("path", "")
+        self._jobs: Optional[List[WorkflowJob]] = None
+        self._attempt_jobs: Dict[int, List[WorkflowJob]] = {}
+        run_attempt = run_data.get("run_attempt")
+        self._retry_count: Optional[int] = run_attempt - 1 if run_attempt else None
+
+    @property
+    def jobs(self) -> List[WorkflowJob]:
+        """
+        Get jobs for this workflow run (lazy loaded).
+
+        Returns:
+            List of WorkflowJob objects
+        """
+        if self._jobs is None:
+            self._jobs = self._fetch_jobs()
+        return self._jobs
+
+    @property
+    def retry_count(self) -> int:
+        """
+        Get the number of retry attempts.
+
+        Returns:
+            Number of retry attempts (run_attempt - 1)
+        """
+        if self._retry_count is None:
+            self._retry_count = self._fetch_retry_count()
+        return self._retry_count
+
+    def describe(self) -> Dict[str, Any]:
+        """
+        Describe the run with the data already fetched, without requests.
+
+        Returns:
+            Dictionary with attempt (when known), failures, the failed jobs
+            and steps (when the jobs were fetched), and timings (when known)
+        """
+        description: Dict[str, Any] = {}
+        if self._retry_count is not None:
+            description["attempt"] = self._retry_count + 1
+        if self._jobs is not None:
+            description["failures"] = [
+                {"job": job, "step": step}
+                for job, step in sorted(failure_fingerprint(self._jobs), key=lambda f: (f[0], f[1] or ""))
+            ]
+        timings = self.timings()
+        if timings:
+            description["timings"] = timings
+        return description
+
+    def timings(self) -> Dict[str, Any]:
+        """
+        Measure where the run spent its time, with the data already fetched.
+
+        Retry overhead is the time from the creation of the run to the start
+        of its latest attempt, i.e. what the previous attempts and the delay
+        before the rerun added. Time to green is the time from the creation
+        of the run to its success. Queue and execution times are those of
+        the jobs of the latest attempt, when they were fetched.
+
+        Returns:
+            Dictionary with retry_overhead_seconds (retried runs only),
+            time_to_green_seconds (successful runs only), and queue_seconds,
+            max_queue_seconds, execution_seconds and per-job timings (when
+            the jobs were fetched)
+        """
+        timings: Dict[str, Any] = {}
+        if self._retry_count:
+            retry_overhead = elapsed_seconds(self.created_at, self.run_started_at)
+            if retry_overhead is not None:
+                timings["retry_overhead_seconds"] = retry_overhead
+        if self.succeeded():
+            time_to_green = elapsed_seconds(self.created_at, self.updated_at)
+            if time_to_green is not None:
+                timings["time_to_green_seconds"] = time_to_green
+
+        if self._jobs is not None:
+            jobs = []
+            queue = max_queue = execution = 0
+            for job in self._jobs:
+                job_queue = job.queue_seconds()
+                job_execution = job.execution_seconds()
+                if job_queue is None and job_execution is None:
+                    continue
+                jobs.append({
+                    "name": job.name,
+                    "queue_seconds": job_queue,
+                    "execution_seconds": job_execution
+                })
+                queue += job_queue or 0
+                max_queue = max(max_queue, job_queue or 0)
+                execution += job_execution or 0
+            if jobs:
+                timings.update(
+                    queue_seconds=queue,
+                    max_queue_seconds=max_queue,
+                    execution_seconds=execution,
+                    jobs=jobs
+                )
+        return timings
+
+    def get_attempt_jobs(self, attempt: int) -> List[WorkflowJob]:
+        """
+        Get jobs for a specific attempt of this workflow run.
+
+        Args:
+            attempt: Run attempt number (starts at 1)
+
+        Returns:
+            List of WorkflowJob objects for that attempt
+        """
+        if attempt not in self._attempt_jobs:
+            self._attempt_jobs[attempt] = self._fetch_jobs(
+                f"repos/{self.client.repo}/actions/runs/{self.id}/attempts/{attempt}/jobs"
+            )
+        return self._attempt_jobs[attempt]
+
+    @profiled("job fetch")
+    def _fetch_jobs(self, endpoint: Optional[str] = None) -> List[WorkflowJob]:
+        """
+        Fetch jobs from GitHub API.
+
+        Args:
+            endpoint: Optional jobs endpoint (defaults to the latest attempt)
+
+        Returns:
+            List of WorkflowJob objects
+        """
+        jobs = self.client.api_get_pages(
+            endpoint or f"repos/{self.client.repo}/actions/runs/{self.id}/jobs",
+            "jobs"
+        )
+        return [WorkflowJob(job) for job in jobs]
+
+    def _fetch_retry_count(self) -> int:
+        """
+        Fetch retry count from GitHub API.
+
+        Returns:
+            Number of retry attempts
+        """
+        run_attempt = self.fetch_run_attempt()
+        # run_attempt starts at 1, so subtract 1 to get retry count
+        return run_attempt - 1 if run_attempt else 0
+
+    def fetch_run_attempt(self) -> Optional[int]:
+        """
+        Fetch the current attempt number from GitHub API.
+
+        Unlike retry_count, this is never cached so it reflects retries
+        triggered by other invocations in the meantime.
+
+        Returns:
+            Run attempt number (starts at 1), or None if it cannot be fetched
+        """
+        try:
+            output = self.client.api_get(
+                f"repos/{self.client.repo}/actions/runs/{self.id}",
+                jq_filter=".run_attempt",
+                fresh=True
+            )
+            return int(output)
+        except (ValueError, TypeError, subprocess.CalledProcessError):
+            return None
+
+    def is_failed(self) -> bool:
+        """
+        Check if workflow is in a failed state.
+
+        Returns:
+            True if workflow failed, False otherwise
+        """
+        return self.conclusion in FAILED_STATUSES
+
+    def succeeded(self) -> bool:
+        """
+        Check if workflow succeeded.
+
+        Returns:
+            True if workflow succeeded, False otherwise
+        """
+        return self.conclusion == SUCCESS_STATUS
+
+    def retry(self, mode: str = "failed-only") -> bool:
+        """
+        Retry this workflow run.
+
+        Args:
+            mode: Either "all" or "failed-only"
+
+        Returns:
+            True if retry was successful, False otherwise
+        """
+        endpoint = (
+            f"repos/{self.client.repo}/actions/runs/{self.id}/rerun"
+            if mode == "all"
+            else f"repos/{self.client.repo}/actions/runs/{self.id}/rerun-failed-jobs"
+        )
+
+        return self.client.api_post(endpoint, scope="workflow")
+
+    def estimate_rerun_minutes(self, mode: str = "failed-only", fetch: bool = True) -> Optional[int]:
+        """
+        Estimate the runner minutes a rerun would cost from job durations.
+
+        Args:
+            mode: Either "all" or "failed-only"
+            fetch: Whether to list the jobs if they were not listed yet
+
+        Returns:
+            Estimated runner minutes, or None if the jobs were not listed
+            and fetch is False
+        """
+        if not fetch and self._jobs is None:
+            return None
+        jobs = self.jobs if mode == "all" else [job for job in self.jobs if job.is_failed()]
+        return sum(job.duration_minutes() for job in jobs)
+
+    def has_deterministic_failure(self) -> Tuple[bool, str]:
+        """
+        Check if the latest attempt failed exactly like the previous one.
+
+        Compares the failing job/step fingerprint of the latest attempt with
+        the fingerprint of the attempt before it. A failure that reproduces
+        identically is unlikely to be fixed by another rerun.
+
+        Returns:
+            Tuple of (is_deterministic, reason)
+        """
+        attempt = self.retry_count + 1
+        if attempt < 2:
+            return False, "No previous attempt to compare with"
+
+        current = failure_fingerprint(self.jobs)
+        if not current:
+            return False, "No failing jobs in the latest attempt"
+
+        previous = failure_fingerprint(self.get_attempt_jobs(attempt - 1))
+        if current != previous:
+            return False, f"Failures differ from attempt {attempt - 1}"
+
+        failures = ", ".join(
+            f"{job}/{step}" if step else job
+            for job, step in sorted(current, key=lambda x: (x[0] or "", x[1] or ""))
+        )
+        return True, (
+            f"Attempts {attempt - 1} and {attempt} failed identically ({failures})"
+        )
+
+    def wait_for_attempt(
+        self,
+        attempt: int,
+        timeout: float,
+        poll_interval: float = 15,
+        max_poll_interval: float = 120
+    ) -> Optional[Dict]:
+        """
+        Wait until an attempt of this run completes.
+
+        Polls with conditional requests. The interval grows while the run
+        does not change and is reset when it changes state.
+
+        Args:
+            attempt: Run attempt to wait for
+            timeout: Maximum time to wait in seconds
+            poll_interval: Initial polling interval in seconds
+            max_poll_interval: Maximum polling interval in seconds
+
+        Returns:
+            Run data of the completed attempt, or None on timeout
+        """
+        endpoint = f"repos/{self.client.repo}/actions/runs/{self.id}"
+        deadline = self.client.monotonic() + timeout
+        interval = poll_interval
+        etag = None
+        last_state = None
+
+        while True:
+            body, etag = self.client.api_get_conditional(endpoint, etag)
+            if body is not None:
+                run_data = json.loads(body)
+                state = (run_data.get("run_attempt"), run_data.get("status"))
+                if (run_data.get("run_attempt") or 0) >= attempt and run_data.get("status") == "completed":
+                    return run_data
+                if state != last_state:
+                    logger.info(f"Run {self.id} attempt {state[0]}: {state[1]}")
+                    last_state = state
+                    interval = poll_interval
+
+            remaining = deadline - self.client.monotonic()
+            if remaining <= 0:
+                return None
+            self.client.sleep(min(interval, remaining))
+            interval = min(interval * 1.5, max_poll_interval)
+
+    def _check_job_and_step_filter(
+        self,
+        job_name: str,
+        step_name: str
+    ) -> Tuple[bool, str]:
+        """
+        Check if specific job/step combination failed.
+
+        Args:
+            job_name: Name of the job to check
+            step_name: Name of the step to check
+
+        Returns:
+            Tuple of (should_retry, reason)
+        """
+        for job in self.jobs:
+            if job.name == job_name:
+                failed_step = job.has_failed_step(step_name)
+                if failed_step:
+                    return True, f"Step '{step_name}' in job '{job_name}' failed"
+                return False, (
+                    f"Step '{step_name}' in job '{job_name}' did not fail "
+                    f"(other failures ignored)"
+                )
+        return False, f"Job '{job_name}' not found"
+
+    def _check_step_filter(self, step_name: str) -> Tuple[bool, str]:
+        """
+        Check if specific step failed in any job.
+
+        Args:
+            step_name: Name of the step to check
+
+        Returns:
+            Tuple of (should_retry, reason)
+        """
+        for job in self.jobs:
+            failed_step = job.has_failed_step(step_name)
+            if failed_step:
+                return True, f"Step '{step_name}' failed in job '{job.name}'"
+        return False, f"Step '{step_name}' did not fail (other failures ignored)"
+
+    def _check_job_filter(self, job_name: str) -> Tuple[bool, str]:
+        """
+        Check if specific job failed.
+
+        Args:
+            job_name: Name of the job to check
+
+        Returns:
+            Tuple of (should_retry, reason)
+        """
+        for job in self.jobs:
+            if job.name == job_name:
+                if job.is_failed():
+                    return True, f"Job '{job_name}' failed"
+                return False, f"Job '{job_name}' did not fail (other failures ignored)"
+        return False, f"Job '{job_name}' not found"
+
+    def should_retry(
+        self,
+        job_name: Optional[str] = None,
+        step_name: Optional[str] = None
+    ) -> Tuple[bool, str]:
+        """
+        Determine if workflow should be retried based on filters.
+
+        Args:
+            job_name: Optional job name filter
+            step_name: Optional step name filter
+
+        Returns:
+            Tuple of (should_retry, reason)
+        """
+        # If workflow has no conclusion (still in progress), don't retry
+        if self.conclusion is None:
+            return False, f"Workflow is still in progress (status: {self.status}), not retrying"
+
+        # If workflow succeeded overall, don't retry
+        if self.succeeded():
+            return False, f"Workflow status is '{self.conclusion}', no retry needed"
+
+        # Check filters based on what was provided
+        if job_name and step_name:
+            return self._check_job_and_step_filter(job_name, step_name)
+        if step_name:
+            return self._check_step_filter(step_name)
+        if job_name:
+            return self._check_job_filter(job_name)
+
+        # No filters, retry on any failure
+        return True, "Workflow has failures"
+
+
+class CommitSnapshot:
+    """
+    Runs of all workflows of a commit, indexed by workflow and conclusion.
+
+    One listing of the runs of a commit serves every workflow checked on
+    that commit.
+    """
+
+    def __init__(self, commit_sha: str, runs_data: List[Dict]):
+        """
+        Initialize commit snapshot.
+
+        Args:
+            commit_sha: Commit SHA
+            runs_data: Projected runs of the commit
+        """
+        self.commit_sha = commit_sha
+        # Latest first, so the first run of a workflow is its latest run
+        self.runs = sorted(runs_data, key=lambda run: run.get("created_at") or "", reverse=True)
+        self.by_workflow: Dict[str, List[Dict]] = {}
+        self.by_conclusion: Dict[str, List[Dict]] = {}
+        for run in self.runs:
+            # A workflow is referred to by its name or its file name
+            keys = {run.get("name"), self.workflow_file(run)} - {None, ""}
+            for key in keys:
+                self.by_workflow.setdefault(key, []).append(run)
+            self.by_conclusion.setdefault(run.get("conclusion") or run.get("status") or "", []).append(run)
+
+    @staticmethod
+    def workflow_file(run_data: Dict) -> str:
+        """
+        Get the file name of the workflow of a run.
+
+        Args:
+            run_data: Run data
+
+        Returns:
+            File name (e.g., "ci.yaml"), empty if unknown
+        """
+        return (run_data.get("path") or "").rsplit("/", 1)[-1]
+
+    @classmethod
+    def matches(cls, run_data: Dict, workflow: str) -> bool:
+        """
+        Check whether a run is a run of a workflow.
+
+        Args:
+            run_data: Run data
+            workflow: Workflow name or file name
+
+        Returns:
+            True if the workflow name or file name of the run is workflow
+        """
+        return workflow in (run_data.get("name"), cls.workflow_file(run_data))
+
+    @classmethod
+    def fetch(cls, client: GitHubClient, branch: str, commit_sha: str) -> "CommitSnapshot":
+        """
+        List the runs of a commit once.
+
+        Args:
+            client: Client of the repository
+            branch: Branch of the commit
+            commit_sha: Commit SHA
+
+        Returns:
+            CommitSnapshot instance
+        """
+        runs_data = client.api_get_pages(
+            f"repos/{client.repo}/actions/runs?branch={branch}&head_sha={commit_sha}",
+            "workflow_runs"
+        )
+        return cls(commit_sha, runs_data)
+
+    @classmethod
+    def get(cls, client: GitHubClient, branch: str, commit_sha: str) -> "CommitSnapshot":
+        """
+        Get the snapshot of a commit from the client cache, or fetch it.
+
+        Clients sharing a cache list the runs of a commit once.
+
+        Args:
+            client: Client of the repository
+            branch: Branch of the commit
+            commit_sha: Commit SHA
+
+        Returns:
+            CommitSnapshot instance
+        """
+        key = (f"snapshot:repos/{client.repo}/commits/{commit_sha}", branch)
+        return client.cache.get_or_fetch(key, lambda: cls.fetch(client, branch, commit_sha))
+
+    def runs_of(self, workflow: str) -> List[Dict]:
+        """
+        Get the runs of a workflow, latest first.
+
+        Args:
+            workflow: Workflow name or file name
+
+        Returns:
+            Run data of the workflow
+        """
+        return list(self.by_workflow.get(workflow, []))
+
+    def latest_runs(self) -> Dict[str, Dict]:
+        """
+        Get the latest run of each workflow.
+
+        Returns:
+            Dictionary of run data by workflow file name
+        """
+        latest: Dict[str, Dict] = {}
+        for run in self.runs:
+            latest.setdefault(self.workflow_file(run) or run.get("name") or "", run)
+        return latest
+
+
+class JsonStateFile:
+    """JSON document on disk shared between invocations."""
+
+    def __init__(self, path: str):
+        """
+        Initialize state file.
+
+        Args:
+            path: Path to the JSON state file (created on first update)
+        """
+        self.path = path
+
+    def read(self) -> Dict:
+        """
+        Read the current state.
+
+        Returns:
+            State dictionary (empty if the file does not exist yet)
+        """
+        try:
+            with open(self.path) as f:
+                content = f.read()
+        except FileNotFoundError:
+            return {}
+        return json.loads(content) if content.strip() else {}
+
+    @contextmanager
+    def update(self) -> Iterator[Dict]:
+        """
+        Read-modify-write the state under an exclusive file lock.
+
+        The yielded dictionary is written back when the block exits without
+        raising, so concurrent invocations never lose each other's changes.
+
+        Yields:
+            Mutable state dictionary
+        """
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                data = json.loads(content) if content.strip() else {}
+                yield data
+                f.seek(0)
+                f.truncate()
+                json.dump(data, f, indent=2)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class MemoryStateStore:
+    """In-process stand-in for JsonStateFile, e.g. for a resident service."""
+
+    def __init__(self):
+        """Initialize memory state store."""
+        self._data: Dict = {}
+        self._mutex = threading.Lock()
+
+    def read(self) -> Dict:
+        """
+        Read the current state.
+
+        Returns:
+            Copy of the state dictionary
+        """
+        with self._mutex:
+            return json.loads(json.dumps(self._data))
+
+    @contextmanager
+    def update(self) -> Iterator[Dict]:
+        """
+        Read-modify-write the state under an exclusive lock.
+
+        Yields:
+            Mutable state dictionary, kept when the block exits without raising
+        """
+        with self._mutex:
+            data = json.loads(json.dumps(self._data))
+            yield data
+            self._data = data
+
+
+class FileRetryLock:
+    """
+    Retry lock shared between invocations through a file.
+
+    A lock is acquired once per run attempt and is not released after a
+    successful rerun: it marks the attempt as retried so that concurrent or
+    later invocations evaluating the same attempt never rerun it again.
+    """
+
+    def __init__(self, path: str, max_age: float = 7 * 24 * 3600):
+        """
+        Initialize file retry lock.
+
+        Args:
+            path: Path to the JSON file holding acquired locks
+            max_age: Seconds after which acquired locks are forgotten
+        """
+        self.state = JsonStateFile(path)
+        self.max_age = max_age
+
+    def acquire(self, key: str) -> bool:
+        """
+        Acquire the lock for a key.
+
+        Args:
+            key: Lock key (see retry_lock_key)
+
+        Returns:
+            True if acquired, False if already held
+        """
+        now = time.time()
+        with self.state.update() as data:
+            locks = {
+                k: acquired_at for k, acquired_at in data.get("locks", {}).items()
+                if now - acquired_at < self.max_age
+            }
+            acquired = key not in locks
+            if acquired:
+                locks[key] = now
+            data["locks"] = locks
+        return acquired
+
+    def release(self, key: str) -> None:
+        """
+        Release the lock for a key (e.g. when the rerun request failed).
+
+        Args:
+            key: Lock key
+        """
+        with self.state.update() as data:
+            data.get("locks", {}).pop(key, None)
+
+
+class MemoryRetryLock:
+    """In-process retry lock, stand-in for a shared backend."""
+
+    def __init__(self):
+        """Initialize memory retry lock."""
+        self._locks: Dict[str, float] = {}
+        self._mutex = threading.Lock()
+
+    def acquire(self, key: str) -> bool:
+        """
+        Acquire the lock for a key.
+
+        Args:
+            key: Lock key (see retry_lock_key)
+
+        Returns:
+            True if acquired, False if already held
+        """
+        with self._mutex:
+            if key in self._locks:
+                return False
+            self._locks[key] = time.time()
+            return True
+
+    def release(self, key: str) -> None:
+        """
+        Release the lock for a key.
+
+        Args:
+            key: Lock key
+        """
+        with self._mutex:
+            self._locks.pop(key, None)
+
+
+def retry_lock_key(repo: str, run_id: int, attempt: int) -> str:
+    """
+    Build the retry lock key of a run attempt.
+
+    Args:
+        repo: Repository in owner/repo format
+        run_id: Workflow run ID
+        attempt: Run attempt being retried
+
+    Returns:
+        Lock key
+    """
+    return f"{repo}#{run_id}#{attempt}"
+
+
+class RerunQuota:
+    """
+    Sliding-window quota of reruns shared by every invocation of a fleet.
+
+    Reruns are recorded in a state backend (JsonStateFile, MemoryStateStore
+    or any object with the same read() and update() methods), checked and
+    recorded atomically so that concurrent invocations never exceed the
+    quota together. Only a state file shared by the invocations makes the
+    quota fleet-wide, the in-process store only limits one invocation.
+    """
+
+    def __init__(self, limit: int, window: float = 3600, state: Optional[Any] = None):
+        """
+        Initialize rerun quota.
+
+        Args:
+            limit: Maximum number of reruns within the window
+            window: Length of the sliding window in seconds
+            state: State backend (in-process MemoryStateStore if None)
+        """
+        self.limit = limit
+        self.window = window
+        self.state = state if state is not None else MemoryStateStore()
+
+    def check(self) -> Tuple[bool, str]:
+        """
+        Check if the quota allows another rerun, without recording it.
+
+        Lets callers skip the requests preparing a rerun once the quota is
+        exhausted, acquire() still decides atomically.
+
+        Returns:
+            Tuple of (available, reason)
+        """
+        now = time.time()
+        count = sum(1 for r in self.state.read().get("reruns", []) if now - r["at"] < self.window)
+        if count >= self.limit:
+            return False, self._exhausted_reason()
+        return True, f"{count}/{self.limit} reruns in the last {round(self.window / 60)} min"
+
+    def _exhausted_reason(self) -> str:
+        """Get the reason of a rerun refused by the quota."""
+        return f"Fleet rerun quota reached ({self.limit} reruns in the last {round(self.window / 60)} min)"
+
+    def acquire(self, key: str) -> Tuple[bool, str]:
+        """
+        Record a rerun if the quota allows it.
+
+        Args:
+            key: Key of the rerun (see retry_lock_key)
+
+        Returns:
+            Tuple of (acquired, reason)
+        """
+        now = time.time()
+        with self.state.update() as data:
+            reruns = [r for r in data.get("reruns", []) if now - r["at"] < self.window]
+            acquired = len(reruns) < self.limit
+            if acquired:
+                reruns.append({"key": key, "at": now})
+            data["reruns"] = reruns
+        if not acquired:
+            return False, self._exhausted_reason()
+        return True, f"{len(reruns)}/{self.limit} reruns in the last {round(self.window / 60)} min"
+
+    def release(self, key: str) -> None:
+        """
+        Forget a recorded rerun (e.g. when the rerun request failed).
+
+        Args:
+            key: Key of the rerun
+        """
+        with self.state.update() as data:
+            data["reruns"] = [r for r in data.get("reruns", []) if r["key"] != key]
+
+
+class RunnerCapacityChecker:
+    """Checks whether the runner pool has room for a retry."""
+
+    def __init__(
+        self,
+        client: GitHubClient,
+        max_queued_runs: Optional[int] = None,
+        min_idle_runners: Optional[int] = None,
+        runner_scope: str = "repo"
+    ):
+        """
+        Initialize runner capacity checker.
+
+        Args:
+            client: GitHubClient instance
+            max_queued_runs: Defer retries when this many runs are queued
+            min_idle_runners: Defer retries when fewer runners are idle
+            runner_scope: Where to look for runners ("repo" or "org")
+        """
+        self.client = client
+        self.max_queued_runs = max_queued_runs
+        self.min_idle_runners = min_idle_runners
+        self.runner_scope = runner_scope
+
+    def count_runs(self, status: str) -> int:
+        """
+        Count workflow runs of the repository in a given status.
+
+        Args:
+            status: Run status ("queued", "in_progress", ...)
+
+        Returns:
+            Number of runs in that status
+        """
+        output = self.client.api_get(
+            f"repos/{self.client.repo}/actions/runs?status={status}&per_page=1",
+            jq_filter=".total_count",
+            fresh=True
+        )
+        return int(output or 0)
+
+    def count_idle_runners(self) -> Optional[int]:
+        """
+        Count online self-hosted runners that are not busy.
+
+        Returns:
+            Number of idle runners, or None if runners cannot be listed
+            (listing runners requires admin access)
+        """
+        if self.runner_scope == "org":
+            endpoint = f"orgs/{self.client.repo.split('/')[0]}/actions/runners?per_page=100"
+        else:
+            endpoint = f"repos/{self.client.repo}/actions/runners?per_page=100"
+        try:
+            output = self.client.api_get(
+                endpoint,
+                jq_filter='[.runners[] | select(.status == "online" and (.busy | not))] | length',
+                fresh=True
+            )
+            return int(output or 0)
+        except (ValueError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Could not list runners: {getattr(e, 'stderr', e)}")
+            return None
+
+    def check(self) -> Tuple[bool, str]:
+        """
+        Check if the runner pool has capacity for a retry.
+
+        Returns:
+            Tuple of (has_capacity, reason)
+        """
+        queued = self.count_runs("queued")
+        in_progress = self.count_runs("in_progress")
+        load = f"{queued} queued, {in_progress} in progress"
+
+        if self.max_queued_runs is not None and queued >= self.max_queued_runs:
+            return False, f"Runner pool saturated ({load}, limit {self.max_queued_runs} queued)"
+
+        if self.min_idle_runners is not None:
+            idle = self.count_idle_runners()
+            if idle is not None and idle < self.min_idle_runners:
+                return False, (
+                    f"Not enough idle runners ({idle} idle, "
+                    f"{self.min_idle_runners} required, {load})"
+                )
+
+        return True, f"Runner pool has capacity ({load})"
+
+
+class SupersededRunCanceller:
+    """
+    Cancels the active runs of a workflow on older commits of a branch.
+
+    Such runs are superseded by the runs of the branch head and only hold
+    runners that retries and fresh runs are waiting for.
+    """
+
+    # Statuses of runs holding or waiting for runners
+    ACTIVE_STATUSES = ("queued", "waiting", "in_progress")
+
+    # Statuses of jobs holding or waiting for a runner, jobs waiting for an
+    # environment approval have not asked for one yet
+    RUNNER_STATUSES = ("queued", "in_progress")
+
+    def __init__(
+        self,
+        client: GitHubClient,
+        branch: str,
+        workflow_name: str,
+        dry_run: bool = False
+    ):
+        """
+        Initialize superseded run canceller.
+
+        Args:
+            client: GitHubClient instance
+            branch: Branch name
+            workflow_name: Workflow name or file name
+            dry_run: Only report the runs that would be cancelled
+        """
+        self.client = client
+        self.branch = branch
+        self.workflow_name = workflow_name
+        self.dry_run = dry_run
+
+    def find_superseded_runs(self) -> List[Dict]:
+        """
+        Find the active runs of the workflow on commits older than the head.
+
+        Runs created after the head commit are kept, they may belong to a
+        commit pushed since the head was read. Only the runs of the workflow
+        are listed when it is given by file name or ID, the runs of all
+        workflows of the branch otherwise.
+
+        Returns:
+            Projected run data of the superseded runs
+        """
+        head = json.loads(self.client.api_get(
+            f"repos/{self.client.repo}/commits/{self.branch}",
+            jq_filter="{sha: .sha, date: .commit.committer.date}"
+        ))
+        head_date = parse_timestamp(head["date"])
+
+        runs_endpoint = f"repos/{self.client.repo}/actions/runs"
+        if self.workflow_name.endswith((".yml", ".yaml")) or self.workflow_name.isdigit():
+            runs_endpoint = f"repos/{self.client.repo}/actions/workflows/{self.workflow_name}/runs"
+
+        superseded = []
+        for status in self.ACTIVE_STATUSES:
+            for run_data in self.client.api_get_pages(
+                f"{runs_endpoint}?branch={self.branch}&status={status}", "workflow_runs", fresh=True
+            ):
+                created_at = parse_timestamp(run_data.get("created_at"))
+                if run_data.get("head_sha") == head["sha"]:
+                    continue
+                if not CommitSnapshot.matches(run_data, self.workflow_name):
+                    continue
+                if head_date is None or created_at is None or created_at > head_date:
+                    continue
+                superseded.append(run_data)
+        return superseded
+
+    def count_busy_jobs(self, run_id: int) -> int:
+        """
+        Count the jobs of a run holding or waiting for a runner.
+
+        Args:
+            run_id: Workflow run ID
+
+        Returns:
+            Number of queued and in-progress jobs
+        """
+        jobs = self.client.api_get_pages(f"repos/{self.client.repo}/actions/runs/{run_id}/jobs", "jobs")
+        return sum(1 for job in jobs if job.get("status") in self.RUNNER_STATUSES)
+
+    def cancel_run(self, run_data: Dict) -> Dict[str, Any]:
+        """
+        Cancel a superseded run.
+
+        Args:
+            run_data: Run data returned by find_superseded_runs
+
+        Returns:
+            Dictionary with run_id, head_sha, status, busy_jobs and cancelled
+        """
+        # A run waiting for a deployment approval holds no runner
+        busy_jobs = 0 if run_data.get("status") == "waiting" else self.count_busy_jobs(run_data["id"])
+        cancelled = False
+        if not self.dry_run:
+            cancelled = self.client.api_post(f"repos/{self.client.repo}/actions/runs/{run_data['id']}/cancel")
+        return {
+            "run_id": run_data["id"],
+            "head_sha": run_data.get("head_sha"),
+            "status": run_data.get("status"),
+            "busy_jobs": busy_jobs,
+            "cancelled": cancelled
+        }
+
+    def execute(self) -> Dict[str, Any]:
+        """
+        Cancel all superseded runs concurrently.
+
+        Returns:
+            Dictionary with runs (see cancel_run), freed_runner_slots (busy
+            jobs of the cancelled runs, or of the runs that would be
+            cancelled in dry run) and dry_run
+        """
+        superseded = self.find_superseded_runs()
+        runs: List[Dict[str, Any]] = []
+        if superseded:
+            workers = min(len(superseded), self.client.max_concurrency)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                runs = list(pool.map(self.cancel_run, superseded))
+
+        freed = sum(r["busy_jobs"] for r in runs if r["cancelled"] or self.dry_run)
+        action = "Would cancel" if self.dry_run else "Cancelled"
+        for r in runs:
+            if r["cancelled"] or self.dry_run:
+                logger.info(f"{action} superseded run {r['run_id']} ({r['status']}, commit {(r['head_sha'] or '')[:8]})")
+        logger.info(f"{action} {len(runs)} superseded runs, freeing {freed} runner slots")
+        return {"runs": runs, "freed_runner_slots": freed, "dry_run": self.dry_run}
+
+
+class DeferredRetryQueue:
+    """Retries deferred because of runner pressure or the rerun quota, persisted between invocations."""
+
+    def __init__(self, path: str):
+        """
+        Initialize deferred retry queue.
+
+        Args:
+            path: Path to the JSON file holding the queue
+        """
+        self.state = JsonStateFile(path)
+
+    def add(
+        self,
+        repo: str,
+        run_id: int,
+        attempt: int,
+        retry_mode: str,
+        priority: int = 0
+    ) -> None:
+        """
+        Add a run to the queue (replacing any previous entry for it).
+
+        Args:
+            repo: Repository in owner/repo format
+            run_id: Workflow run ID
+            attempt: Run attempt that failed
+            retry_mode: Retry behavior ("all" or "failed-only")
+            priority: Higher priorities are retried first
+        """
+        with self.state.update() as data:
+            entries = [
+                e for e in data.get("deferred", [])
+                if not (e["repo"] == repo and e["run_id"] == run_id)
+            ]
+            entries.append({
+                "repo": repo,
+                "run_id": run_id,
+                "attempt": attempt,
+                "retry_mode": retry_mode,
+                "priority": priority,
+                "deferred_at": time.time()
+            })
+            data["deferred"] = entries
+
+    def entries(self, repo: str) -> List[Dict]:
+        """
+        Get queued entries of a repository, highest priority first.
+
+        Args:
+            repo: Repository in owner/repo format
+
+        Returns:
+            List of entry dictionaries
+        """
+        entries = [e for e in self.state.read().get("deferred", []) if e["repo"] == repo]
+        entries.sort(key=lambda e: (-e.get("priority", 0), e.get("deferred_at", 0)))
+        return entries
+
+    def remove(self, repo: str, run_id: int) -> None:
+        """
+        Remove a run from the queue.
+
+        Args:
+            repo: Repository in owner/repo format
+            run_id: Workflow run ID
+        """
+        with self.state.update() as data:
+            data["deferred"] = [
+                e for e in data.get("deferred", [])
+                if not (e["repo"] == repo and e["run_id"] == run_id)
+            ]
+
+
+class CommitHistoryMemo:
+    """
+    Commits found by history fallbacks, persisted between invocations.
+
+    For each target, remembers the head of the branch at the time of the
+    walk and the commit whose runs were used, so later invocations on the
+    same head skip the walk.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize commit history memo.
+
+        Args:
+            path: Path to the JSON state file
+        """
+        self.state = JsonStateFile(path)
+
+    def get(self, key: str, head_sha: str) -> Tuple[bool, Optional[str]]:
+        """
+        Get the commit found by the last walk from a head.
+
+        Args:
+            key: Target identity (repo/workflow/branch)
+            head_sha: Current head of the branch
+
+        Returns:
+            Tuple of (known, commit_sha). known is False if no walk was
+            memoized from this head, commit_sha is None if that walk found
+            no run.
+        """
+        entry = self.state.read().get("history", {}).get(key)
+        if not entry or entry.get("head") != head_sha:
+            return False, None
+        return True, entry.get("sha")
+
+    def set(self, key: str, head_sha: str, commit_sha: Optional[str]) -> None:
+        """
+        Memoize the result of a walk.
+
+        Args:
+            key: Target identity (repo/workflow/branch)
+            head_sha: Head of the branch the walk started from
+            commit_sha: Commit whose runs were used (None if not found)
+        """
+        with self.state.update() as data:
+            data.setdefault("history", {})[key] = {
+                "head": head_sha,
+                "sha": commit_sha,
+                "updated_at": time.time()
+            }
+
+
+class TimingsAggregate:
+    """Aggregates the timings of runs (see WorkflowRun.timings) as they come."""
+
+    def __init__(self):
+        """Initialize empty aggregate."""
+        self.runs = 0
+        self.jobs = 0
+        self.queue_seconds = 0
+        self.max_queue_seconds = 0
+        self.execution_seconds = 0
+        self.retried_runs = 0
+        self.retry_overhead_seconds = 0
+        self.green_runs = 0
+        self.time_to_green_seconds = 0
+
+    def add(self, timings: Optional[Dict[str, Any]]) -> None:
+        """
+        Add the timings of a run.
+
+        Args:
+            timings: Timings of the run (ignored if empty or None)
+        """
+        if not timings:
+            return
+        self.runs += 1
+        self.jobs += len(timings.get("jobs", []))
+        self.queue_seconds += timings.get("queue_seconds", 0)
+        self.max_queue_seconds = max(self.max_queue_seconds, timings.get("max_queue_seconds", 0))
+        self.execution_seconds += timings.get("execution_seconds", 0)
+        if "retry_overhead_seconds" in timings:
+            self.retried_runs += 1
+            self.retry_overhead_seconds += timings["retry_overhead_seconds"]
+        if "time_to_green_seconds" in timings:
+            self.green_runs += 1
+            self.time_to_green_seconds += timings["time_to_green_seconds"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Get the aggregated timings.
+
+        Returns:
+            Dictionary with totals and averages, in seconds
+        """
+        return {
+            "runs": self.runs,
+            "jobs": self.jobs,
+            "queue_seconds": self.queue_seconds,
+            "avg_queue_seconds": round(self.queue_seconds / self.jobs) if self.jobs else 0,
+            "max_queue_seconds": self.max_queue_seconds,
+            "execution_seconds": self.execution_seconds,
+            "retried_runs": self.retried_runs,
+            "retry_overhead_seconds": self.retry_overhead_seconds,
+            "green_runs": self.green_runs,
+            "avg_time_to_green_seconds": (
+                round(self.time_to_green_seconds / self.green_runs) if self.green_runs else 0
+            )
+        }
+
+
+class RetryResult:
+    """Outcome of the retry decision of a workflow."""
+
+    def __init__(
+        self,
+        status: str,
+        retry_count: int,
+        was_retried: bool,
+        run_id: Optional[int] = None,
+        reason: Optional[str] = None,
+        repo: Optional[str] = None,
+        branch: Optional[str] = None,
+        workflow: Optional[str] = None,
+        estimated_minutes: Optional[int] = None,
+        superseded_runs: Optional[Dict[str, Any]] = None,
+        deferred: Optional[bool] = None
+    ):
+        """
+        Initialize retry result.
+
+        Args:
+            status: Conclusion of the run, or "not_found", "deferred", "error"
+            retry_count: Number of retries of the run, including this one
+            was_retried: Whether a rerun was requested
+            run_id: ID of the workflow run (None if not found)
+            reason: Reason of the decision
+            repo: Repository in owner/repo format
+            branch: Branch name
+            workflow: Workflow name
+            estimated_minutes: Estimated runner minutes of the rerun (batch only)
+            superseded_runs: Report of SupersededRunCanceller.execute, when
+                superseded runs were cancelled before the retry
+            deferred: For "deferred" results, whether the retry was queued
+                to be issued later, or dropped without a deferred queue
+        """
+        self.status = status
+        self.retry_count = retry_count
+        self.was_retried = was_retried
+        self.run_id = run_id
+        self.reason = reason
+        self.repo = repo
+        self.branch = branch
+        self.workflow = workflow
+        self.estimated_minutes = estimated_minutes
+        self.superseded_runs = superseded_runs
+        self.deferred = deferred
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RetryResult":
+        """
+        Create a result from a result dictionary.
+
+        Args:
+            data: Result dictionary, as returned by execute_retry_logic
+
+        Returns:
+            RetryResult instance
+        """
+        return cls(
+            status=data["status"],
+            retry_count=data["retry_count"],
+            was_retried=data["was_retried"],
+            run_id=data.get("run_id"),
+            reason=data.get("reason"),
+            repo=data.get("repo"),
+            branch=data.get("branch"),
+            workflow=data.get("workflow"),
+            estimated_minutes=data.get("estimated_minutes"),
+            superseded_runs=data.get("superseded_runs"),
+            deferred=data.get("deferred")
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert the result to a dictionary, omitting unset optional values.
+
+        Returns:
+            Result dictionary
+        """
+        data = {"status": self.status, "retry_count": self.retry_count, "was_retried": self.was_retried}
+        for key in (
+            "run_id", "reason", "repo", "branch", "workflow", "estimated_minutes", "superseded_runs", "deferred"
+        ):
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value
+        return data
+
+    def __repr__(self) -> str:
+        return (
+            f"RetryResult(repo={self.repo!r}, workflow={self.workflow!r}, status={self.status!r}, "
+            f"was_retried={self.was_retried}, reason={self.reason!r})"
+        )
+
+
+class WorkflowRetryManager:
+    """
+    Manages workflow retry operations.
+
+    This is the library entry point: create a manager (optionally with a
+    shared GitHubClient) and call check(). Progress is reported through the
+    "retry_workflow" logger.
+    """
+
+    def __init__(
+        self,
+        repo: str,
+        branch: str,
+        workflow_name: str,
+        max_retries: int = 1,
+        retry_mode: str = "failed-only",
+        skip_deterministic_failures: bool = False,
+        max_queued_runs: Optional[int] = None,
+        min_idle_runners: Optional[int] = None,
+        runner_scope: str = "repo",
+        priority: int = 0,
+        deferred_queue_file: Optional[str] = None,
+        retry_lock_file: Optional[str] = None,
+        cancel_superseded: bool = False,
+        cancel_dry_run: bool = False,
+        history_depth: int = 1,
+        history_memo_file: Optional[str] = None,
+        rerun_quota: Optional[RerunQuota] = None,
+        client_options: Optional[Dict[str, Any]] = None,
+        client: Optional[GitHubClient] = None
+    ):
+        """
+        Initialize workflow retry manager.
+
+        Args:
+            repo: Repository in owner/repo format
+            branch: Branch name
+            workflow_name: Workflow name
+            max_retries: Maximum number of retries allowed
+            retry_mode: Retry behavior ("all" or "failed-only")
+            skip_deterministic_failures: Do not retry when the latest attempt
+                failed on the same jobs/steps as the previous one
+            max_queued_runs: Defer the retry when this many runs are queued
+            min_idle_runners: Defer the retry when fewer runners are idle
+            runner_scope: Where to look for runners ("repo" or "org")
+            priority: Priority of this retry when deferred (higher first)
+            deferred_queue_file: Optional file persisting deferred retries
+                between invocations
+            retry_lock_file: Optional file shared between invocations
+                guaranteeing at most one rerun per run attempt
+            cancel_superseded: Cancel the active runs of the workflow on
+                older commits of the branch before retrying
+            cancel_dry_run: Only report the superseded runs, without
+                cancelling them
+            history_depth: Number of latest commits of the branch to look
+                for a run on, when the head has none (1 for the head only)
+            history_memo_file: Optional file remembering the commits found
+                by history fallbacks between invocations
+            rerun_quota: Optional quota of reruns shared with other managers
+                and invocations, retries over it are deferred
+            client_options: Optional GitHubClient options (cache, policy...)
+                shared with other managers
+            client: Client to use instead of creating one from client_options
+
+        Raises:
+            ValueError: If client is for another repository
+        """
+        if client is not None and client.repo != repo:
+            raise ValueError(f"Client is for {client.repo}, not {repo}")
+        self.client = client if client is not None else GitHubClient(repo, **(client_options or {}))
+        self.branch = branch
+        self.workflow_name = workflow_name
+        self.max_retries = max_retries
+        self.retry_mode = retry_mode
+        self.skip_deterministic_failures = skip_deterministic_failures
+        self.capacity_checker = (
+            RunnerCapacityChecker(self.client, max_queued_runs, min_idle_runners, runner_scope)
+            if max_queued_runs is not None or min_idle_runners is not None
+            else None
+        )
+        self.priority = priority
+        self.deferred_queue = (
+            DeferredRetryQueue(deferred_queue_file) if deferred_queue_file else None
+        )
+        self.retry_lock = FileRetryLock(retry_lock_file) if retry_lock_file else None
+        self.superseded_canceller = (
+            SupersededRunCanceller(self.client, branch, workflow_name, cancel_dry_run)
+            if cancel_superseded
+            else None
+        )
+        self.history_depth = history_depth
+        self.history_memo = CommitHistoryMemo(history_memo_file) if history_memo_file else None
+        self.rerun_quota = rerun_quota
+        # Last evaluated run, described in structured results
+        self.last_run: Optional[WorkflowRun] = None
+
+    @profiled("ref resolution")
+    def get_latest_commit_sha(self) -> str:
+        """
+        Get the SHA of the latest commit on the branch.
+
+        Returns:
+            Commit SHA
+        """
+        output = self.client.api_get(
+            f"repos/{self.client.repo}/commits/{self.branch}",
+            jq_filter=".sha"
+        )
+        return output
+
+    @profiled("run listing")
+    def get_workflow_runs(self, commit_sha: str) -> List[WorkflowRun]:
+        """
+        Get workflow runs for a specific commit.
+
+        Args:
+            commit_sha: Commit SHA to filter by
+
+        Returns:
+            List of WorkflowRun objects
+        """
+        logger.info(f"Querying workflow runs for: workflow={self.workflow_name}, branch={self.branch}, commit={commit_sha[:8]}")
+
+        try:
+            snapshot = self.get_commit_snapshot(commit_sha)
+        except subprocess.CalledProcessError as e:
+            logger.warning(f"Failed to query workflow runs: {e.stderr}")
+            return []
+
+        if not snapshot.runs:
+            logger.info("No workflow runs found")
+            return []
+
+        runs = [WorkflowRun(self.client, run_data) for run_data in snapshot.runs_of(self.workflow_name)]
+
+        logger.info(f"Found {len(runs)} matching workflow runs")
+        return runs
+
+    @profiled("run listing")
+    def get_previous_workflow_runs(self, head_sha: str) -> List[WorkflowRun]:
+        """
+        Get the workflow runs of the latest commit before the head having some.
+
+        Used when a push skipped the workflow (e.g. path filters). The
+        latest history_depth commits are listed in one request and their
+        runs fetched concurrently; the first commit, newest first, with a
+        run of the workflow is used. The result is memoized per head, unless
+        the runs of a newer commit could not be fetched.
+
+        Args:
+            head_sha: Head of the branch, which has no run of the workflow
+
+        Returns:
+            List of WorkflowRun objects (empty if none found)
+        """
+        key = f"{self.client.repo}/{self.workflow_name}/{self.branch}"
+        if self.history_memo:
+            known, commit_sha = self.history_memo.get(key, head_sha)
+            if known and commit_sha is None:
+                logger.info(f"No run in the last {self.history_depth} commits (memoized)")
+                return []
+            if known:
+                logger.info(f"Using runs of commit {commit_sha[:8]} (memoized)")
+                runs = self.get_workflow_runs(commit_sha)
+                if runs:
+                    return runs
+
+        output = self.client.api_get(
+            f"repos/{self.client.repo}/commits?sha={self.branch}&per_page={min(self.history_depth, PAGE_SIZE)}",
+            jq_filter="[.[].sha]"
+        )
+        previous = [sha for sha in json.loads(output or "[]") if sha != head_sha][:self.history_depth - 1]
+        logger.info(f"No run on the head, looking at the {len(previous)} previous commits")
+
+        found_sha = None
+        complete = True
+        runs: List[WorkflowRun] = []
+        if previous:
+            with ThreadPoolExecutor(max_workers=min(len(previous), self.client.max_concurrency)) as pool:
+                futures = [
+                    pool.submit(CommitSnapshot.get, self.client, self.branch, sha) for sha in previous
+                ]
+                for index, (sha, future) in enumerate(zip(previous, futures)):
+                    try:
+                        matching = future.result().runs_of(self.workflow_name)
+                    except subprocess.CalledProcessError as e:
+                        logger.warning(f"Failed to query workflow runs of {sha[:8]}: {e.stderr}")
+                        complete = False
+                        continue
+                    if matching:
+                        found_sha = sha
+                        runs = [WorkflowRun(self.client, run_data) for run_data in matching]
+                        logger.info(f"Using runs of commit {sha[:8]}, {index + 1} commits before the head")
+                        # Older commits are not needed anymore
+                        for other in futures[index + 1:]:
+                            other.cancel()
+                        break
+
+        # A failed fetch could have hidden the runs of a newer commit
+        if self.history_memo and complete:
+            self.history_memo.set(key, head_sha, found_sha)
+        return runs
+
+    def get_commit_snapshot(self, commit_sha: str) -> CommitSnapshot:
+        """
+        Get the runs of all workflows of a commit.
+
+        Args:
+            commit_sha: Commit SHA
+
+        Returns:
+            CommitSnapshot of the commit, shared by the managers of the cache
+        """
+        return CommitSnapshot.get(self.client, self.branch, commit_sha)
+
+    def get_latest_workflow_run(self) -> Optional[WorkflowRun]:
+        """
+        Get the most recent workflow run.
+
+        Returns:
+            Latest WorkflowRun or None if not found
+        """
+        commit_sha = self.get_latest_commit_sha()
+        logger.info(f"Latest commit on {self.branch}: {commit_sha}")
+
+        runs = self.get_workflow_runs(commit_sha)
+        if not runs and self.history_depth > 1:
+            runs = self.get_previous_workflow_runs(commit_sha)
+
+        if not runs:
+            return None
+
+        # Sort by created_at descending to get the latest
+        runs.sort(key=lambda x: x.created_at or "", reverse=True)
+        return runs[0]
+
+    def _retry_once(
+        self,
+        workflow_run: WorkflowRun,
+        attempt: int,
+        mode: str
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Retry a run attempt unless another invocation already did.
+
+        Re-checks run_attempt right before the rerun request and, when a
+        retry lock is configured, acquires it for that attempt. When a rerun
+        quota is configured, the rerun is then recorded in it, unless the
+        quota is exhausted. An exhausted quota is detected before the
+        attempt is fetched and the lock acquired.
+
+        Args:
+            workflow_run: Workflow run to retry
+            attempt: Attempt that was evaluated and should be retried
+            mode: Either "all" or "failed-only"
+
+        Returns:
+            Tuple of (was_retried, skip_reason). skip_reason is set when the
+            rerun was not requested, and None when it was requested, whether
+            it succeeded or not.
+
+        Raises:
+            RerunQuotaExceededError: If the rerun quota is exhausted
+        """
+        if self.rerun_quota:
+            has_quota, quota_reason = self.rerun_quota.check()
+            if not has_quota:
+                raise RerunQuotaExceededError(quota_reason)
+
+        current_attempt = workflow_run.fetch_run_attempt()
+        if current_attempt is None:
+            logger.warning("Could not re-check run attempt before retrying")
+        elif current_attempt != attempt:
+            return False, (
+                f"Run is already at attempt {current_attempt}, "
+                f"attempt {attempt} was retried by another invocation"
+            )
+
+        key = retry_lock_key(self.client.repo, workflow_run.id, attempt)
+        if self.retry_lock and not self.retry_lock.acquire(key):
+            return False, f"Retry of attempt {attempt} already claimed by another invocation"
+
+        if self.rerun_quota:
+            has_quota, quota_reason = self.rerun_quota.acquire(key)
+            logger.info(f"Fleet rerun quota: {quota_reason}")
+            if not has_quota:
+                if self.retry_lock:
+                    self.retry_lock.release(key)
+                raise RerunQuotaExceededError(quota_reason)
+
+        if workflow_run.retry(mode=mode):
+            return True, None
+
+        if self.retry_lock:
+            self.retry_lock.release(key)
+        if self.rerun_quota:
+            self.rerun_quota.release(key)
+        return False, None
+
+    def process_deferred_retries(self) -> List[int]:
+        """
+        Issue previously deferred retries while the runner pool has capacity.
+
+        Called once per invocation and repository (by check(), RetryBatch
+        and OrgSweep) since each entry costs a request.
+
+        Entries are processed highest priority first, until the runner pool
+        is saturated or the rerun quota exhausted. Runs that were retried or
+        changed state since they were deferred are dropped from the queue.
+
+        Returns:
+            List of run IDs that were retried
+        """
+        if not self.deferred_queue:
+            return []
+
+        retried = []
+        for entry in self.deferred_queue.entries(self.client.repo):
+            if self.capacity_checker:
+                has_capacity, capacity_reason = self.capacity_checker.check()
+                if not has_capacity:
+                    logger.info(f"Keeping deferred retries queued: {capacity_reason}")
+                    break
+
+            run_id = entry["run_id"]
+            try:
+                run_data = json.loads(
+                    self.client.api_get(f"repos/{self.client.repo}/actions/runs/{run_id}")
+                )
+            except (ValueError, subprocess.CalledProcessError) as e:
+                logger.warning(f"Dropping deferred run {run_id}: {getattr(e, 'stderr', e)}")
+                self.deferred_queue.remove(self.client.repo, run_id)
+                continue
+
+            workflow_run = WorkflowRun(self.client, run_data)
+            if run_data.get("run_attempt") != entry["attempt"] or not workflow_run.is_failed():
+                logger.info(f"Dropping deferred retry of run {run_id}: run changed since it was deferred")
+            else:
+                try:
+                    was_retried, skip_reason = self._retry_once(
+                        workflow_run, entry["attempt"], entry["retry_mode"]
+                    )
+                except RerunQuotaExceededError as e:
+                    logger.info(f"Keeping deferred retries queued: {e}")
+                    break
+                if was_retried:
+                    logger.info(f"Issued deferred retry of run {run_id} (priority {entry['priority']})")
+                    retried.append(run_id)
+                elif skip_reason is None:
+                    logger.error(f"Failed to issue deferred retry of run {run_id}")
+                    continue
+                else:
+                    logger.info(f"Dropping deferred retry of run {run_id}: {skip_reason}")
+            self.deferred_queue.remove(self.client.repo, run_id)
+
+        return retried
+
+    def plan_retry(
+        self,
+        job_filter: Optional[str] = None,
+        step_filter: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], Optional[WorkflowRun]]:
+        """
+        Evaluate the latest workflow run without retrying it.
+
+        Args:
+            job_filter: Optional job name filter
+            step_filter: Optional step name filter
+
+        Returns:
+            Tuple of (result, workflow_run). workflow_run is only set when the
+            run should be retried, result is then the result to report if the
+            retry ends up not being issued.
+        """
+        logger.info(f"Repository: {self.client.repo}")
+
+        # Get latest workflow run
+        workflow_run = self.get_latest_workflow_run()
+
+        if not workflow_run:
+            reason = f"No workflow run found for '{self.workflow_name}' on branch '{self.branch}'"
+            logger.info(reason)
+            return {
+                "status": "not_found",
+                "retry_count": 0, # No retries performed, it does not exists
+                "was_retried": False,
+                "run_id": None,
+                "reason": reason
+            }, None
+
+        return self.evaluate_run(workflow_run, job_filter, step_filter)
+
+    @profiled("decision")
+    def evaluate_run(
+        self,
+        workflow_run: WorkflowRun,
+        job_filter: Optional[str] = None,
+        step_filter: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], Optional[WorkflowRun]]:
+        """
+        Decide whether a workflow run should be retried.
+
+        Args:
+            workflow_run: Workflow run to evaluate
+            job_filter: Optional job name filter
+            step_filter: Optional step name filter
+
+        Returns:
+            Tuple of (result, workflow_run), see plan_retry
+        """
+        self.last_run = workflow_run
+        logger.info(f"Workflow run ID: {workflow_run.id}")
+        logger.info(f"Workflow status: {workflow_run.conclusion}")
+
+        # Early exit if workflow succeeded - no retry needed
+        # This avoids unnecessary API calls and filter checks
+        if workflow_run.succeeded():
+            logger.info("Workflow succeeded, no retry needed")
+            return {
+                "status": workflow_run.conclusion or "unknown",
+                "retry_count": 0,  # No retries performed by this action run
+                "was_retried": False,
+                "run_id": workflow_run.id,
+                "reason": "Workflow succeeded"
+            }, None
+
+        # Workflow failed - check if it matches retry filters
+        should_retry, retry_reason = workflow_run.should_retry(
+            job_filter,
+            step_filter
+        )
+        logger.info(f"Retry decision: {retry_reason}")
+
+        # Early exit if filters don't match
+        if not should_retry:
+            logger.info(f"Not retrying: {retry_reason}")
+            return {
+                "status": workflow_run.conclusion or workflow_run.status or "unknown",
+                "retry_count": 0,  # No retries performed by this action run
+                "was_retried": False,
+                "run_id": workflow_run.id,
+                "reason": retry_reason
+            }, None
+
+        # Only fetch retry count if we actually need to consider retrying
+        retry_count = workflow_run.retry_count
+        logger.info(f"Current retry count: {retry_count}")
+
+        result = {
+            "status": workflow_run.conclusion or "unknown",
+            "retry_count": retry_count,
+            "was_retried": False,
+            "run_id": workflow_run.id,
+            "reason": retry_reason
+        }
+
+        if retry_count >= self.max_retries:
+            logger.info(f"Max retries ({self.max_retries}) already reached, not retrying")
+            result["reason"] = f"Max retries ({self.max_retries}) already reached"
+            return result, None
+
+        # A failure that reproduced identically in the previous attempt will
+        # most likely fail again, don't spend runners on it
+        if self.skip_deterministic_failures:
+            is_deterministic, deterministic_reason = workflow_run.has_deterministic_failure()
+            logger.info(f"Deterministic failure check: {deterministic_reason}")
+            if is_deterministic:
+                logger.info("Not retrying: failure reproduces identically across attempts")
+                result["reason"] = deterministic_reason
+                return result, None
+
+        return result, workflow_run
+
+    @profiled("decision")
+    def issue_retry(self, workflow_run: WorkflowRun, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Retry a workflow run selected by plan_retry.
+
+        Args:
+            workflow_run: Workflow run to retry
+            result: Result returned by plan_retry for that run
+
+        Returns:
+            Dictionary with status, retry_count, was_retried, and run_id
+        """
+        result = dict(result)
+        retry_count = result["retry_count"]
+
+        # Free the runners held by runs nobody waits for anymore, before
+        # measuring capacity
+        if self.superseded_canceller:
+            try:
+                result["superseded_runs"] = self.superseded_canceller.execute()
+            except subprocess.CalledProcessError as e:
+                logger.warning(f"Could not cancel superseded runs: {e.stderr}")
+
+        # Don't add to the queue of a saturated runner pool, defer instead
+        if self.capacity_checker:
+            has_capacity, capacity_reason = self.capacity_checker.check()
+            logger.info(f"Runner capacity: {capacity_reason}")
+            if not has_capacity:
+                return self.defer_retry(workflow_run, result, capacity_reason)
+
+        logger.info(
+            f"Retrying workflow (mode: {self.retry_mode}, "
+            f"attempt {retry_count + 1}/{self.max_retries})..."
+        )
+        try:
+            was_retried, skip_reason = self._retry_once(
+                workflow_run, retry_count + 1, self.retry_mode
+            )
+        except RerunQuotaExceededError as e:
+            return self.defer_retry(workflow_run, result, str(e))
+        if was_retried:
+            logger.info("Workflow retry initiated successfully")
+            result.update(retry_count=retry_count + 1, was_retried=True)
+        elif skip_reason is None:
+            logger.error("Failed to retry workflow")
+            result["reason"] = "Retry request failed"
+        else:
+            logger.info(f"Not retrying: {skip_reason}")
+            result["reason"] = skip_reason
+
+        return result
+
+    def defer_retry(
+        self,
+        workflow_run: WorkflowRun,
+        result: Dict[str, Any],
+        reason: str
+    ) -> Dict[str, Any]:
+        """
+        Defer a retry, recording it in the deferred queue if configured.
+
+        Without a deferred queue, the retry is dropped: nothing will issue
+        it later, which the result tells with deferred set to False.
+
+        Args:
+            workflow_run: Workflow run to retry later
+            result: Result of the run being retried
+            reason: Why the retry is deferred
+
+        Returns:
+            The result, with status "deferred"
+        """
+        if self.deferred_queue:
+            self.deferred_queue.add(
+                self.client.repo,
+                workflow_run.id,
+                result["retry_count"] + 1,
+                self.retry_mode,
+                self.priority
+            )
+            logger.info(f"Retry deferred (priority {self.priority})")
+        else:
+            logger.warning(f"Retry dropped, no deferred queue to issue it later: {reason}")
+        result.update(status="deferred", reason=reason, deferred=self.deferred_queue is not None)
+        return result
+
+    def annotate(self, result: Dict[str, Any], started: float) -> Dict[str, Any]:
+        """
+        Add the details of the evaluation to a result, for structured output.
+
+        Adds the attempt and failures of the evaluated run (see
+        WorkflowRun.describe), the number of requests of the client and the
+        duration of the evaluation.
+
+        Args:
+            result: Result of this manager
+            started: time.monotonic() when the evaluation started
+
+        Returns:
+            The result, updated
+        """
+        if self.last_run is not None and self.last_run.id == result.get("run_id"):
+            result.update(self.last_run.describe())
+        result["requests"] = self.client.stats.requests
+        result["seconds"] = round(time.monotonic() - started, 2)
+        return result
+
+    def execute_retry_logic(
+        self,
+        job_filter: Optional[str] = None,
+        step_filter: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Execute the complete retry logic and return results.
+
+        Args:
+            job_filter: Optional job name filter
+            step_filter: Optional step name filter
+
+        Returns:
+            Dictionary with status, retry_count, was_retried, and run_id
+        """
+        result, workflow_run = self.plan_retry(job_filter, step_filter)
+        if workflow_run is None:
+            return result
+        return self.issue_retry(workflow_run, result)
+
+    def check(
+        self,
+        job_filter: Optional[str] = None,
+        step_filter: Optional[str] = None,
+        wait: bool = False,
+        wait_timeout: float = 3600,
+        poll_interval: float = 15
+    ) -> RetryResult:
+        """
+        Check the latest workflow run and retry it if needed.
+
+        Args:
+            job_filter: Optional job name filter
+            step_filter: Optional step name filter
+            wait: Wait for retried attempts and retry them again if needed
+            wait_timeout: Maximum time to wait in seconds
+            poll_interval: Initial polling interval in seconds
+
+        Returns:
+            Result of the decision, with its reason
+        """
+        # Responses cached by a previous check of a reused client are stale
+        self.client.cache.clear()
+        # Give retries deferred by previous invocations a chance first
+        self.process_deferred_retries()
+
+        if wait:
+            result = self.supervise(job_filter, step_filter, wait_timeout, poll_interval)
+        else:
+            result = self.execute_retry_logic(job_filter, step_filter)
+        return RetryResult.from_dict(
+            dict(result, repo=self.client.repo, branch=self.branch, workflow=self.workflow_name)
+        )
+
+    def supervise(
+        self,
+        job_filter: Optional[str] = None,
+        step_filter: Optional[str] = None,
+        timeout: float = 3600,
+        poll_interval: float = 15
+    ) -> Dict[str, Any]:
+        """
+        Retry, wait for the new attempt and re-evaluate it until done.
+
+        Runs the retry logic, then keeps waiting for each retried attempt to
+        complete and applies the same retry decision to it, until the run
+        succeeds, should not be retried anymore or max_retries is reached.
+
+        Args:
+            job_filter: Optional job name filter
+            step_filter: Optional step name filter
+            timeout: Maximum time to supervise the run in seconds
+            poll_interval: Initial polling interval in seconds
+
+        Returns:
+            Dictionary with the final status, retry_count, was_retried
+            (whether any retry was triggered) and run_id
+        """
+        deadline = self.client.monotonic() + timeout
+        result, workflow_run = self.plan_retry(job_filter, step_filter)
+        was_retried = False
+        superseded_runs: Optional[Dict[str, Any]] = None
+
+        while workflow_run is not None:
+            result = self.issue_retry(workflow_run, result)
+            if "superseded_runs" in result:
+                report = result["superseded_runs"]
+                if superseded_runs is None:
+                    superseded_runs = report
+                else:
+                    superseded_runs["runs"].extend(report["runs"])
+                    superseded_runs["freed_runner_slots"] += report["freed_runner_slots"]
+            if not result["was_retried"]:
+                break
+            was_retried = True
+
+            attempt = result["retry_count"] + 1
+            logger.info(f"Waiting for attempt {attempt} of run {workflow_run.id}...")
+            run_data = workflow_run.wait_for_attempt(
+                attempt,
+                deadline - self.client.monotonic(),
+                poll_interval
+            )
+            if run_data is None:
+                logger.info(f"Timed out waiting for attempt {attempt}")
+                result.update(status="in_progress", reason=f"Timed out waiting for attempt {attempt}")
+                break
+
+            workflow_run = WorkflowRun(self.client, run_data)
+            logger.info(f"Attempt {attempt} completed: {workflow_run.conclusion}")
+            result, workflow_run = self.evaluate_run(workflow_run, job_filter, step_filter)
+            # Report the attempts of the run, not the retries of this check
+            result["retry_count"] = attempt - 1
+
+        result["was_retried"] = was_retried or result["was_retried"]
+        if superseded_runs is not None:
+            result["superseded_runs"] = superseded_runs
+        return result
+
+
+class ResultsSink:
+    """
+    Writes one JSON record per evaluated target to a newline-delimited JSON file.
+
+    Records are written and flushed as soon as each target is decided, so
+    consumers can follow large batches while they run.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize results sink.
+
+        Args:
+            path: Path to the NDJSON file (overwritten)
+        """
+        self.path = path
+        self.count = 0
+        self._file = open(path, "w")
+        self._lock = threading.Lock()
+
+    @profiled("output")
+    def write(self, result: Dict[str, Any]) -> None:
+        """
+        Write the record of a target.
+
+        Args:
+            result: Result of the target, see WorkflowRetryManager.annotate
+        """
+        line = json.dumps(dict(result, decided_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.count += 1
+
+    def close(self) -> None:
+        """Close the file."""
+        with self._lock:
+            self._file.close()
+
+
+class RetryTarget:
+    """A workflow to check and retry, as listed in a targets file."""
+
+    def __init__(
+        self,
+        repo: str,
+        branch: str,
+        workflow: str,
+        job_name: Optional[str] = None,
+        step_name: Optional[str] = None,
+        priority: int = 0
+    ):
+        """
+        Initialize retry target.
+
+        Args:
+            repo: Repository in owner/repo format
+            branch: Branch name
+            workflow: Workflow name
+            job_name: Optional job name filter
+            step_name: Optional step name filter
+            priority: Priority of the retry (higher first)
+        """
+        self.repo = repo
+        self.branch = branch
+        self.workflow = workflow
+        self.job_name = job_name
+        self.step_name = step_name
+        self.priority = priority
+
+    @property
+    def key(self) -> str:
+        """Identity of the target, used to assign it to a shard."""
+        return f"{self.repo}/{self.workflow}/{self.branch}"
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Parse a shard specification.
+
+    Args:
+        value: Shard in i/N format, i starting at 1
+
+    Returns:
+        Tuple of (index, count)
+
+    Raises:
+        argparse.ArgumentTypeError: If the specification is invalid
+    """
+    match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/N with 1 <= i <= N")
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_of(key: str, shard_count: int) -> int:
+    """
+    Get the shard of a key.
+
+    The shard only depends on the key and the number of shards, so a target
+    stays on the same shard when other targets are added or removed.
+
+    Args:
+        key: Key to assign (e.g., "owner/repo/workflow/branch")
+        shard_count: Number of shards
+
+    Returns:
+        Shard index, starting at 1
+    """
+    digest = hashlib.sha256(key.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count + 1
+
+
+def load_targets(path: str, default_repo: str, default_branch: Optional[str]) -> List[RetryTarget]:
+    """
+    Load retry targets from a JSON file.
+
+    The file holds a list of objects with a required "workflow" key and
+    optional "repo", "branch", "job_name", "step_name" and "priority" keys.
+
+    Args:
+        path: Path to the targets file
+        default_repo: Repository used when a target has no "repo"
+        default_branch: Branch used when a target has no "branch"
+
+    Returns:
+        List of RetryTarget objects
+
+    Raises:
+        ValueError: If a target has no workflow or no branch
+    """
+    with open(path) as f:
+        entries = json.load(f)
+
+    targets = []
+    for entry in entries:
+        branch = entry.get("branch") or default_branch
+        if not entry.get("workflow") or not branch:
+            raise ValueError(f"Target missing workflow or branch: {entry}")
+        targets.append(RetryTarget(
+            repo=entry.get("repo") or default_repo,
+            branch=branch,
+            workflow=entry["workflow"],
+            job_name=entry.get("job_name") or None,
+            step_name=entry.get("step_name") or None,
+            priority=int(entry.get("priority", 0))
+        ))
+    return targets
+
+
+def snapshot_targets(client: GitHubClient, branch: str) -> List[RetryTarget]:
+    """
+    List the workflows run on the latest commit of a branch as targets.
+
+    Args:
+        client: Client of the repository, its cache keeps the snapshot
+            for the managers of the targets
+        branch: Branch name
+
+    Returns:
+        List of RetryTarget objects, one per workflow of the commit
+    """
+    commit_sha = client.api_get(f"repos/{client.repo}/commits/{branch}", jq_filter=".sha")
+    snapshot = CommitSnapshot.get(client, branch, commit_sha)
+    latest_runs = snapshot.latest_runs()
+    counts = {
+        conclusion: len(runs) for conclusion, runs in snapshot.by_conclusion.items()
+    }
+    logger.info(
+        f"Commit {commit_sha[:8]} on {branch}: {len(latest_runs)} workflows, runs by conclusion: "
+        + ", ".join(f"{conclusion}={count}" for conclusion, count in sorted(counts.items()))
+    )
+    return [RetryTarget(client.repo, branch, workflow) for workflow in sorted(latest_runs) if workflow]
+
+
+class BatchResult:
+    """Outcome of a batch of targets."""
+
+    def __init__(
+        self,
+        results: List[RetryResult],
+        runner_minutes_spent: int,
+        runner_minutes_saved: int
+    ):
+        """
+        Initialize batch result.
+
+        Args:
+            results: Result of each target, in target order
+            runner_minutes_spent: Estimated runner minutes of the reruns
+            runner_minutes_saved: Estimated runner minutes of the reruns
+                skipped by the budget
+        """
+        self.results = results
+        self.runner_minutes_spent = runner_minutes_spent
+        self.runner_minutes_saved = runner_minutes_saved
+
+
+class RetryBatch:
+    """Evaluates several targets and retries them under a runner-minute budget."""
+
+    def __init__(
+        self,
+        targets: List[RetryTarget],
+        runner_minutes_budget: Optional[int] = None,
+        results_sink: Optional[ResultsSink] = None,
+        **manager_options: Any
+    ):
+        """
+        Initialize retry batch.
+
+        Args:
+            targets: Targets to evaluate
+            runner_minutes_budget: Maximum estimated runner minutes to spend
+                on retries in this invocation (unlimited if None)
+            results_sink: Sink receiving each result as soon as it is decided
+                (optional)
+            **manager_options: Options passed to every WorkflowRetryManager
+        """
+        self.targets = targets
+        self.runner_minutes_budget = runner_minutes_budget
+        self.results_sink = results_sink
+        self.manager_options = manager_options
+        # Targets on the same commit or run share their GET responses
+        self.client_options = dict(manager_options.pop("client_options", None) or {})
+        self.client_options.setdefault("cache", ResponseCache())
+
+    def create_manager(self, target: RetryTarget) -> WorkflowRetryManager:
+        """
+        Create the retry manager of a target.
+
+        Args:
+            target: Target to manage
+
+        Returns:
+            WorkflowRetryManager instance
+        """
+        options = dict(
+            self.manager_options,
+            priority=target.priority,
+            client_options=self.client_options
+        )
+        return WorkflowRetryManager(
+            repo=target.repo,
+            branch=target.branch,
+            workflow_name=target.workflow,
+            **options
+        )
+
+    def decided(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send a final result to the results sink.
+
+        Args:
+            result: Result of a target
+
+        Returns:
+            The result
+        """
+        if self.results_sink:
+            self.results_sink.write(result)
+        return result
+
+    def check(self) -> BatchResult:
+        """
+        Evaluate and retry all targets, see execute.
+
+        Responses cached by a previous check of the batch are forgotten.
+
+        Returns:
+            Typed results of the batch
+        """
+        self.client_options["cache"].clear()
+        batch_result = self.execute()
+        return BatchResult(
+            [RetryResult.from_dict(r) for r in batch_result["results"]],
+            batch_result["runner_minutes_spent"],
+            batch_result["runner_minutes_saved"]
+        )
+
+    def execute(self) -> Dict[str, Any]:
+        """
+        Evaluate all targets, then retry candidates by priority and score.
+
+        Candidates are ordered by priority, then by likelihood of success per
+        estimated runner minute. Candidates that do not fit in the remaining
+        budget are skipped and counted as saved minutes. Without a budget,
+        the jobs of a candidate are not listed just for the estimate: only
+        candidates whose jobs were already listed are estimated.
+
+        Returns:
+            Dictionary with per-target results, runner_minutes_spent and
+            runner_minutes_saved
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(self.targets)
+        candidates = []
+        drained_repos: Set[str] = set()
+
+        for index, target in enumerate(self.targets):
+            logger.info(f"=== {target.repo} / {target.workflow} @ {target.branch} ===")
+            started = time.monotonic()
+            manager = self.create_manager(target)
+            # Give retries deferred by previous invocations a chance first,
+            # once per repository and not once per target
+            if target.repo not in drained_repos:
+                drained_repos.add(target.repo)
+                manager.process_deferred_retries()
+            result, workflow_run = manager.plan_retry(target.job_name, target.step_name)
+            result.update(repo=target.repo, branch=target.branch, workflow=target.workflow)
+            if workflow_run is None:
+                results[index] = self.decided(manager.annotate(result, started))
+                continue
+
+            cost = workflow_run.estimate_rerun_minutes(
+                manager.retry_mode, fetch=self.runner_minutes_budget is not None
+            )
+            likelihood = estimate_success_likelihood(result["retry_count"])
+            if cost is not None:
+                result["estimated_minutes"] = cost
+            candidates.append({
+                "index": index,
+                "started": started,
+                "manager": manager,
+                "run": workflow_run,
+                "result": result,
+                "priority": target.priority,
+                "cost": cost or 0,
+                "score": likelihood / max(cost or 0, 1)
+            })
+
+        candidates.sort(key=lambda c: (-c["priority"], -c["score"]))
+
+        spent = 0
+        saved = 0
+        for candidate in candidates:
+            result = candidate["result"]
+            cost = candidate["cost"]
+            budget = self.runner_minutes_budget
+            if budget is not None and spent + cost > budget:
+                logger.info(
+                    f"Not retrying run {result['run_id']}: needs ~{cost} runner minutes, "
+                    f"{budget - spent} left in budget"
+                )
+                result["reason"] = (
+                    f"Runner-minute budget exhausted (needs ~{cost} min, "
+                    f"{budget - spent} of {budget} min left)"
+                )
+                saved += cost
+            else:
+                result = candidate["manager"].issue_retry(candidate["run"], result)
+                if result["was_retried"]:
+                    spent += cost
+            results[candidate["index"]] = self.decided(
+                candidate["manager"].annotate(result, candidate["started"])
+            )
+
+        return {
+            "results": results,
+            "runner_minutes_spent": spent,
+            "runner_minutes_saved": saved
+        }
+
+
+def aggregate_status(statuses: List[str]) -> str:
+    """
+    Reduce the statuses of several targets to the one needing most attention.
+
+    Args:
+        statuses: Target statuses
+
+    Returns:
+        Most severe status ("success" if there are none)
+    """
+    def severity(status: str) -> int:
+        # The state of a target that could not be checked is unknown
+        if status == "error":
+            return 5
+        if status in FAILED_STATUSES:
+            return 4
+        if status == "deferred":
+            return 3
+        if status == "not_found":
+            return 1
+        if status == SUCCESS_STATUS:
+            return 0
+        return 2
+
+    worst = SUCCESS_STATUS
+    for status in statuses:
+        if severity(status) > severity(worst):
+            worst = status
+    return worst
+
+
+class OrgSweep:
+    """Checks selected workflows on the default branch of every repository of an organization."""
+
+    def __init__(
+        self,
+        org: str,
+        workflows: List[str],
+        max_workers: int = DEFAULT_MAX_CONCURRENCY,
+        shard: Optional[Tuple[int, int]] = None,
+        **manager_options: Any
+    ):
+        """
+        Initialize organization sweep.
+
+        Args:
+            org: Organization name
+            workflows: Workflow names or file names to check in each repository
+            max_workers: Maximum number of repositories processed concurrently
+            shard: Tuple of (index, count) to only process the repositories
+                of one shard (all if None)
+            **manager_options: Options passed to every WorkflowRetryManager
+        """
+        self.org = org
+        self.workflows = workflows
+        self.max_workers = max_workers
+        self.shard = shard
+        self.manager_options = manager_options
+        self.client_options = dict(manager_options.pop("client_options", None) or {})
+        # A cache shared by all repositories would grow with the organization,
+        # each repository gets its own instead
+        self.client_options.pop("cache", None)
+        self.client = GitHubClient(f"{org}/.github", **self.client_options)
+
+    def iter_repos(self) -> Iterator[Tuple[str, str]]:
+        """
+        List the active repositories of the organization (of the shard), page by page.
+
+        Yields:
+            Tuples of (repository in owner/repo format, default branch)
+        """
+        page = 1
+        while True:
+            output = self.client.api_get(
+                f"orgs/{self.org}/repos?per_page={PAGE_SIZE}&page={page}",
+                jq_filter="map({full_name, default_branch, archived, disabled})",
+                fresh=True
+            )
+            repos = json.loads(output) if output else []
+            for repo in repos:
+                if repo["archived"] or repo["disabled"]:
+                    continue
+                if self.shard and shard_of(repo["full_name"], self.shard[1]) != self.shard[0]:
+                    continue
+                yield repo["full_name"], repo["default_branch"]
+            if len(repos) < PAGE_SIZE:
+                return
+            page += 1
+
+    def process_repo(
+        self,
+        repo: str,
+        branch: str,
+        job_filter: Optional[str] = None,
+        step_filter: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Apply the retry logic to the selected workflows of a repository.
+
+        Args:
+            repo: Repository in owner/repo format
+            branch: Default branch of the repository
+            job_filter: Optional job name filter
+            step_filter: Optional step name filter
+
+        Returns:
+            One result per workflow, with repo, branch and workflow keys
+        """
+        # Workflows of the same repository share the commit and runs responses
+        client_options = dict(self.client_options, cache=ResponseCache())
+        results = []
+        for workflow in self.workflows:
+            started = time.monotonic()
+            try:
+                manager = WorkflowRetryManager(
+                    repo=repo,
+                    branch=branch,
+                    workflow_name=workflow,
+                    client_options=client_options,
+                    **self.manager_options
+                )
+                # Deferred retries are issued once per repository
+                if not results:
+                    manager.process_deferred_retries()
+                result = manager.annotate(manager.execute_retry_logic(job_filter, step_filter), started)
+            except (DeadlineExceededError, CircuitOpenError):
+                # Every remaining repository would fail the same way
+                raise
+            except Exception as e:
+                # Empty or inaccessible repositories must not stop the sweep
+                result = {"status": "error", "retry_count": 0, "was_retried": False, "run_id": None, "reason": str(e)}
+            result.update(repo=repo, branch=branch, workflow=workflow)
+            results.append(result)
+        return results
+
+    def execute(
+        self,
+        job_filter: Optional[str] = None,
+        step_filter: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Sweep the organization, yielding results as repositories complete.
+
+        Repositories are listed lazily and at most twice max_workers of them
+        are in flight, so memory does not grow with the organization size.
+
+        Args:
+            job_filter: Optional job name filter
+            step_filter: Optional step name filter
+
+        Yields:
+            Result of each workflow of each repository, in completion order
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = set()
+            try:
+                for repo, branch in self.iter_repos():
+                    pending.add(pool.submit(self.process_repo, repo, branch, job_filter, step_filter))
+                    if len(pending) >= self.max_workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield from future.result()
+                for future in as_completed(pending):
+                    yield from future.result()
+            except BaseException:
+                # Don't start the repositories still queued
+                pool.shutdown(cancel_futures=True)
+                raise
+
+
+def decide_nightly_trigger(
+    state: Dict[str, Any],
+    max_start_if_last_failed: int = 0,
+    commit_check_period: int = 1,
+    now: Optional[float] = None
+) -> Tuple[bool, str]:
+    """
+    Decide whether to start a nightly workflow.
+
+    Rules of actions-nightly-trigger, by priority: restart a failed run on
+    the last commit (up to max_start_if_last_failed runs on that commit),
+    start for a commit of the last commit_check_period days without
+    successful run, start a weekly health check every 7 days since the
+    last run.
+
+    Args:
+        state: State returned by NightlyTrigger.fetch_state
+        max_start_if_last_failed: Maximum runs on the last commit when
+            restarting failed runs (0 disables restarts)
+        commit_check_period: Time window in days for recent commits
+        now: Current time (epoch seconds, defaults to now)
+
+    Returns:
+        Tuple of (trigger, reason)
+    """
+    now = time.time() if now is None else now
+    time_diff = int(now) - state["last_commit_time"]
+    hours_ago = time_diff // 3600
+    days_ago = time_diff // 86400
+    last_run_conclusion = state["last_run_on_commit_conclusion"]
+    run_count = state["run_count"]
+    days_since = state["days_since_last_run"]
+
+    if max_start_if_last_failed > 0:
+        if last_run_conclusion in FAILED_STATUSES:
+            if run_count < max_start_if_last_failed:
+                return True, (
+                    f"Last run failed ({last_run_conclusion}), "
+                    f"restarting ({run_count}/{max_start_if_last_failed})"
+                )
+            logger.info(f"Max restarts reached ({run_count}/{max_start_if_last_failed}), last run: {last_run_conclusion}")
+        elif last_run_conclusion == SUCCESS_STATUS:
+            logger.info("Last run on commit succeeded, no restart needed")
+
+    ago = f"{hours_ago}h" if commit_check_period == 1 else f"{days_ago}d"
+    if state["last_commit_time"] > 0 and time_diff <= commit_check_period * 86400:
+        if last_run_conclusion != SUCCESS_STATUS:
+            period = "day" if commit_check_period == 1 else "days"
+            return True, f"Last commit was {ago} ago (within {commit_check_period} {period})"
+        logger.info(f"Last commit was {ago} ago but already has successful run")
+    elif state["status"] != "not_found" and days_since > 0 and days_since % 7 == 0:
+        return True, f"Weekly health check ({days_since} days since last run)"
+
+    return False, "No trigger conditions met"
+
+
+class WorkflowDispatch:
+    """
+    Starts a workflow with a workflow_dispatch event and finds the run it created.
+
+    The dispatch API does not return the created run. Runs of the workflow
+    dispatched on the ref are listed before dispatching, then polled until
+    a new one appears. With a correlation input, a unique marker is passed
+    in that input and the run is the one whose title contains it, which
+    requires the workflow to show the input in its run-name, e.g.
+    run-name: "Nightly ${{ inputs.correlation_id }}".
+    """
+
+    # Margin for the clock difference between this host and GitHub
+    CLOCK_SKEW = 120
+
+    def __init__(
+        self,
+        client: GitHubClient,
+        workflow: str,
+        ref: str,
+        inputs: Optional[Dict[str, str]] = None,
+        correlation_input: Optional[str] = None
+    ):
+        """
+        Initialize workflow dispatch.
+
+        Args:
+            client: Client of the repository
+            workflow: Workflow file name (e.g., "nightly.yaml")
+            ref: Branch or tag to run the workflow on
+            inputs: Inputs of the workflow (optional)
+            correlation_input: Workflow input receiving the correlation
+                marker (optional)
+        """
+        self.client = client
+        self.workflow = workflow
+        self.ref = ref
+        self.inputs = dict(inputs or {})
+        self.marker = None
+        if correlation_input:
+            self.marker = client.marker()
+            self.inputs[correlation_input] = self.marker
+
+    def runs_endpoint(self, since: float) -> str:
+        """
+        Get the endpoint listing the runs the dispatch may have created.
+
+        Args:
+            since: Earliest creation time of the runs (epoch seconds)
+
+        Returns:
+            Shaped endpoint of the first page of runs
+        """
+        created = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since - self.CLOCK_SKEW))
+        endpoint = RequestShaper.shape(
+            f"repos/{self.client.repo}/actions/workflows/{self.workflow}/runs"
+            f"?event=workflow_dispatch&branch={self.ref}&created=>={created}",
+            "workflow_runs"
+        )
+        return f"{endpoint}&page=1"
+
+    def find_run(
+        self,
+        endpoint: str,
+        known_ids: Set[int],
+        timeout: float,
+        poll_interval: float = 1,
+        max_poll_interval: float = 5
+    ) -> Optional[Dict]:
+        """
+        Poll the runs until the dispatched one appears.
+
+        Polls with conditional requests, at a short interval growing while
+        no run appears.
+
+        Args:
+            endpoint: Endpoint returned by runs_endpoint
+            known_ids: IDs of the runs listed before dispatching
+            timeout: Maximum time to wait in seconds
+            poll_interval: Initial polling interval in seconds
+            max_poll_interval: Maximum polling interval in seconds
+
+        Returns:
+            Projected run data, or None on timeout
+        """
+        deadline = self.client.monotonic() + timeout
+        interval = poll_interval
+        etag = None
+
+        while True:
+            body, etag = self.client.api_get_conditional(endpoint, etag)
+            if body is not None:
+                runs = [
+                    RequestShaper.project("workflow_runs", run)
+                    for run in json.loads(body).get("workflow_runs", [])
+                ]
+                new_runs = [run for run in runs if run["id"] not in known_ids]
+                if self.marker:
+                    new_runs = [run for run in new_runs if self.marker in (run.get("display_title") or "")]
+                if new_runs:
+                    if len(new_runs) > 1:
+                        logger.warning(
+                            f"{len(new_runs)} runs of {self.workflow} were dispatched on {self.ref} "
+                            f"meanwhile, assuming the first one (use a correlation input to tell them apart)"
+                        )
+                    return min(new_runs, key=lambda run: run["id"])
+
+            remaining = deadline - self.client.monotonic()
+            if remaining <= 0:
+                return None
+            self.client.sleep(min(interval, remaining))
+            interval = min(interval * 1.5, max_poll_interval)
+
+    def execute(self, track_timeout: float = DISPATCH_TRACK_TIMEOUT) -> Dict[str, Any]:
+        """
+        Dispatch the workflow and find the created run.
+
+        Args:
+            track_timeout: Maximum time to wait for the run in seconds
+                (the run is not looked for if 0)
+
+        Returns:
+            Dictionary with workflow, ref, dispatched, run_id (None if not
+            found) and seconds
+        """
+        start = time.monotonic()
+        result: Dict[str, Any] = {
+            "workflow": self.workflow,
+            "ref": self.ref,
+            "dispatched": False,
+            "run_id": None
+        }
+
+        endpoint = self.runs_endpoint(self.client.now())
+        known_ids: Set[int] = set()
+        if track_timeout > 0:
+            output = self.client.api_get(endpoint, fresh=True)
+            known_ids = {run["id"] for run in (json.loads(output) if output else {}).get("workflow_runs", [])}
+
+        result["dispatched"] = self.client.api_post(
+            f"repos/{self.client.repo}/actions/workflows/{self.workflow}/dispatches",
+            dict({"ref": self.ref}, **{f"inputs[{key}]": value for key, value in self.inputs.items()}),
+            scope="workflow"
+        )
+
+        if result["dispatched"] and track_timeout > 0:
+            run = self.find_run(endpoint, known_ids, track_timeout)
+            if run is None:
+                logger.warning(f"Run of {self.workflow} on {self.ref} not found after {track_timeout:.0f}s")
+            else:
+                result["run_id"] = run["id"]
+                logger.info(f"Dispatched run {run['id']} of {self.workflow} on {self.ref}")
+
+        result["seconds"] = round(time.monotonic() - start, 2)
+        return result
+
+
+def parse_workflow_list(value: str) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Parse a comma-separated list of workflows with their inputs.
+
+    Each entry is a workflow followed by inputs in gh workflow run syntax,
+    e.g. "test-1.yaml, test-2.yaml -f field_one=true". The words before the
+    first option are the workflow, so names may contain spaces unquoted
+    ("Nightly tests -f field_one=true").
+
+    Args:
+        value: List of workflows
+
+    Returns:
+        List of (workflow, inputs) tuples
+
+    Raises:
+        ValueError: If an entry cannot be parsed
+    """
+    workflows = []
+    for entry in value.split(","):
+        words = shlex.split(entry)
+        if not words:
+            continue
+        first_option = next((i for i, word in enumerate(words) if word.startswith("-")), len(words))
+        workflow, options = " ".join(words[:first_option]), words[first_option:]
+        if not workflow:
+            raise ValueError(f"Missing workflow before options: {entry.strip()!r}")
+        inputs = {}
+        while options:
+            option = options.pop(0)
+            if option in ("-f", "-F", "--field", "--raw-field") and options:
+                name, separator, field_value = options.pop(0).partition("=")
+            elif option.startswith(("--field=", "--raw-field=")):
+                name, separator, field_value = option.split("=", 1)[1].partition("=")
+            else:
+                raise ValueError(f"Unsupported option {option!r} for workflow {workflow}")
+            if not separator:
+                raise ValueError(f"Input of workflow {workflow} must be key=value: {name!r}")
+            inputs[name] = field_value
+        workflows.append((workflow, inputs))
+    return workflows
+
+
+class BulkDispatch:
+    """Starts several workflows on a ref concurrently."""
+
+    def __init__(
+        self,
+        client: GitHubClient,
+        ref: str,
+        workflows: List[Tuple[str, Dict[str, str]]],
+        correlation_input: Optional[str] = None,
+        max_workers: int = DEFAULT_MAX_CONCURRENCY
+    ):
+        """
+        Initialize bulk dispatch.
+
+        Args:
+            client: Client of the repository, shared by all dispatches
+            ref: Branch or tag to run the workflows on
+            workflows: List of (workflow, inputs) tuples
+            correlation_input: Workflow input receiving the correlation
+                marker (optional)
+            max_workers: Maximum number of concurrent dispatches
+        """
+        self.client = client
+        self.ref = ref
+        self.workflows = workflows
+        self.correlation_input = correlation_input
+        self.max_workers = max_workers
+        self._repo_workflows: Optional[List[Dict]] = None
+        self._lock = threading.Lock()
+
+    def resolve(self, workflow: str) -> str:
+        """
+        Find the file name of a workflow given by name, as gh workflow run does.
+
+        The dispatches endpoint only accepts a workflow file name or ID, the
+        workflows of the repository are listed once for the other entries.
+
+        Args:
+            workflow: Workflow file name, ID or name
+
+        Returns:
+            Workflow file name or ID
+
+        Raises:
+            ValueError: If no single workflow of the repository has that name
+        """
+        if workflow.endswith((".yml", ".yaml")) or workflow.isdigit():
+            return workflow
+        with self._lock:
+            if self._repo_workflows is None:
+                self._repo_workflows = self.client.api_get_pages(
+                    f"repos/{self.client.repo}/actions/workflows", "workflows"
+                )
+        matches = [w for w in self._repo_workflows if w["name"].lower() == workflow.lower()]
+        if len(matches) != 1:
+            found = "Several workflows" if matches else "No workflow"
+            raise ValueError(f"{found} named {workflow!r} in {self.client.repo}")
+        return os.path.basename(matches[0]["path"])
+
+    def dispatch(self, workflow: str, inputs: Dict[str, str], track_timeout: float) -> Dict[str, Any]:
+        """
+        Start one workflow, errors are reported in the result.
+
+        Args:
+            workflow: Workflow file name, ID or name
+            inputs: Inputs of the workflow
+            track_timeout: Maximum time to wait for the run in seconds
+
+        Returns:
+            Result of WorkflowDispatch.execute, with inputs and error
+        """
+        start = time.monotonic()
+        try:
+            result = WorkflowDispatch(
+                self.client, self.resolve(workflow), self.ref, inputs, self.correlation_input
+            ).execute(track_timeout)
+            result["workflow"] = workflow
+        except Exception as e:
+            logger.warning(f"Could not dispatch {workflow} on {self.ref}: {e}")
+            result = {
+                "workflow": workflow,
+                "ref": self.ref,
+                "dispatched": False,
+                "run_id": None,
+                "seconds": round(time.monotonic() - start, 2),
+                "error": str(e)
+            }
+        result["inputs"] = inputs
+        return result
+
+    def execute(self, track_timeout: float = DISPATCH_TRACK_TIMEOUT) -> List[Dict[str, Any]]:
+        """
+        Start all workflows, a failure does not stop the others.
+
+        Args:
+            track_timeout: Maximum time to wait for each run in seconds
+
+        Returns:
+            Result of each workflow, in list order
+        """
+        if not self.workflows:
+            return []
+        workers = min(len(self.workflows), self.max_workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(
+                lambda entry: self.dispatch(entry[0], entry[1], track_timeout),
+                self.workflows
+            ))
+
+
+class NightlyTrigger:
+    """Decides whether to start the nightly workflow of a branch, and starts it."""
+
+    def __init__(
+        self,
+        client: GitHubClient,
+        workflow: str,
+        branch: Optional[str] = None,
+        max_start_if_last_failed: int = 0,
+        commit_check_period: int = 1
+    ):
+        """
+        Initialize nightly trigger.
+
+        Args:
+            client: Client of the repository
+            workflow: Workflow file name (e.g., "nightly.yaml")
+            branch: Branch name (default branch of the repository if None)
+            max_start_if_last_failed: Maximum runs on the last commit when
+                restarting failed runs (0 disables restarts)
+            commit_check_period: Time window in days for recent commits
+        """
+        self.client = client
+        self.workflow = workflow
+        self._branch = branch
+        self.max_start_if_last_failed = max_start_if_last_failed
+        self.commit_check_period = commit_check_period
+
+    @property
+    def branch(self) -> str:
+        """Branch name, the default branch is fetched on first access."""
+        if self._branch is None:
+            self._branch = self.client.api_get(f"repos/{self.client.repo}", jq_filter=".default_branch")
+        return self._branch
+
+    def _list_runs(self, query: str) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        List the first page of runs of the workflow, most recent first.
+
+        Args:
+            query: Filter of the runs (e.g. "branch=main")
+
+        Returns:
+            Tuple of (total number of matching runs, runs of the first page)
+        """
+        endpoint = RequestShaper.shape(
+            f"repos/{self.client.repo}/actions/workflows/{self.workflow}/runs?{query}",
+            "workflow_runs"
+        )
+        output = self.client.api_get(f"{endpoint}&page=1")
+        data = json.loads(output) if output else {}
+        runs = [RequestShaper.project("workflow_runs", run) for run in data.get("workflow_runs", [])]
+        return data.get("total_count", len(runs)), runs
+
+    def fetch_state(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Fetch the last commit and the runs of the workflow on the branch.
+
+        The latest run is read from the runs of the branch, the runs on the
+        last commit from the runs of its SHA, which include the runs of
+        that commit on other branches.
+
+        Args:
+            now: Current time (epoch seconds, defaults to now)
+
+        Returns:
+            Dictionary with last_commit_sha, last_commit_time, status,
+            conclusion, run_id, days_since_last_run, run_count,
+            last_run_on_commit_conclusion and last_run_on_commit_status
+        """
+        now = self.client.now() if now is None else now
+        repo = self.client.repo
+        commit = json.loads(self.client.api_get(
+            f"repos/{repo}/commits/{self.branch}",
+            jq_filter="{sha: .sha, date: .commit.committer.date}"
+        ))
+        commit_date = parse_timestamp(commit["date"])
+
+        _, runs = self._list_runs(f"branch={self.branch}")
+        run_count, on_commit = self._list_runs(f"head_sha={commit['sha']}")
+
+        state: Dict[str, Any] = {
+            "last_commit_sha": commit["sha"],
+            "last_commit_time": int(commit_date.timestamp()) if commit_date else 0,
+            "status": "not_found",
+            "conclusion": None,
+            "run_id": None,
+            "days_since_last_run": 999,
+            "run_count": run_count,
+            "last_run_on_commit_conclusion": (on_commit[0].get("conclusion") or "null") if on_commit else "not_found",
+            "last_run_on_commit_status": on_commit[0].get("status") if on_commit else "not_found"
+        }
+        if runs:
+            latest = runs[0]
+            created_at = parse_timestamp(latest.get("created_at"))
+            state.update(
+                status=latest.get("status"),
+                conclusion=latest.get("conclusion"),
+                run_id=latest.get("id"),
+                days_since_last_run=int(now - created_at.timestamp()) // 86400 if created_at else 999
+            )
+        return state
+
+    def evaluate(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Decide whether the workflow should be started.
+
+        Args:
+            now: Current time (epoch seconds, defaults to now)
+
+        Returns:
+            State of fetch_state with trigger, reason, repo, branch and workflow
+        """
+        now = self.client.now() if now is None else now
+        state = self.fetch_state(now)
+        trigger, reason = decide_nightly_trigger(
+            state, self.max_start_if_last_failed, self.commit_check_period, now
+        )
+        logger.info(f"[{self.client.repo}] {self.workflow} on {self.branch}: trigger={str(trigger).lower()} ({reason})")
+        state.update(
+            trigger=trigger,
+            reason=reason,
+            repo=self.client.repo,
+            branch=self.branch,
+            workflow=self.workflow
+        )
+        return state
+
+    def dispatch(
+        self,
+        correlation_input: Optional[str] = None,
+        track_timeout: float = DISPATCH_TRACK_TIMEOUT
+    ) -> Dict[str, Any]:
+        """
+        Start the workflow on the branch and find the created run.
+
+        Args:
+            correlation_input: Workflow input receiving the correlation
+                marker (optional)
+            track_timeout: Maximum time to wait for the run in seconds
+
+        Returns:
+            Result of WorkflowDispatch.execute
+        """
+        dispatch = WorkflowDispatch(self.client, self.workflow, self.branch, correlation_input=correlation_input)
+        return dispatch.execute(track_timeout)
+
+
+class RetryOutputWriter:
+    """Handles writing outputs and summaries."""
+
+    @staticmethod
+    @profiled("output")
+    def write_github_output(
+        output_file: Optional[str],
+        status: str,
+        retry_count: int,
+        was_retried: bool,
+        extra: Optional[Dict[str, str]] = None
+    ) -> None:
+        """
+        Write output variables for GitHub Actions.
+
+        Args:
+            output_file: Path to output file (GITHUB_OUTPUT)
+            status: Workflow status
+            retry_count: Number of retries performed
+            was_retried: Whether retry was triggered
+            extra: Additional output variables (optional)
+        """
+        variables = {
+            "status": status,
+            "retry_count": str(retry_count),
+            "was_retried": "true" if was_retried else "false"
+        }
+        variables.update(extra or {})
+        RetryOutputWriter.write_variables(output_file, variables)
+
+    @staticmethod
+    def write_variables(output_file: Optional[str], variables: Dict[str, str]) -> None:
+        """
+        Write output variables for GitHub Actions and print them.
+
+        Args:
+            output_file: Path to output file (GITHUB_OUTPUT)
+            variables: Output variables
+        """
+        if output_file:
+            with open(output_file, "a") as f:
+                for key, value in variables.items():
+                    f.write(f"{key}={value}\n")
+
+        # Also print to stdout
+        logger.info("Output variables:")
+        for key, value in variables.items():
+            logger.info(f"  {key}={value}")
+
+    @staticmethod
+    @profiled("output")
+    def write_step_summary(
+        workflow_name: str,
+        branch: str,
+        status: str,
+        retry_count: int,
+        was_retried: bool,
+        max_retries: int,
+        retry_mode: str,
+        run_id: Optional[int] = None,
+        reason: Optional[str] = None,
+        timings: Optional[Dict[str, Any]] = None,
+        deferred: Optional[bool] = None
+    ) -> None:
+        """
+        Write a summary to GitHub Actions step summary.
 
         Args:
             workflow_name: Name of the workflow
@@ -651,6 +5246,10 @@ class RetryOutputWriter:
             max_retries: Maximum retries allowed
             retry_mode: Retry mode (all/failed-only)
             run_id: Workflow run ID (optional)
+            reason: Why no retry was triggered (optional)
+            timings: Aggregated timings of the run (optional, see
+                TimingsAggregate)
+            deferred: Whether a deferred retry was queued (optional)
         """
         summary_file = os.environ.get("GITHUB_STEP_SUMMARY")
         if not summary_file:
@@ -669,6 +5268,9 @@ class RetryOutputWriter:
         elif status == "in_progress":
             emoji = "🔄"
             status_msg = "Workflow is still in progress"
+        elif status == "deferred":
+            emoji = "⏸️"
+            status_msg = "Retry deferred"
         else:
             emoji = "ℹ️"
             status_msg = f"Workflow {status}"
@@ -677,12 +5279,15 @@ class RetryOutputWriter:
         if was_retried:
             retry_emoji = "🔄"
             retry_msg = f"**Retry triggered** (mode: `{retry_mode}`, attempt {retry_count}/{max_retries})"
+        elif status == "deferred":
+            retry_emoji = "⏸️"
+            retry_msg = f"**Retry deferred** ({reason or 'runner pool saturated'})"
         elif retry_count >= max_retries and status in FAILED_STATUSES:
             retry_emoji = "🛑"
             retry_msg = f"**Max retries reached** ({retry_count}/{max_retries})"
         elif status in FAILED_STATUSES:
             retry_emoji = "⏭️"
-            retry_msg = "**No retry** (max retries already reached)"
+            retry_msg = f"**No retry** ({reason or 'max retries already reached'})"
         else:
             retry_emoji = "ℹ️"
             retry_msg = "**No retry needed**"
@@ -724,6 +5329,16 @@ class RetryOutputWriter:
             summary += f"""
 ---
 ℹ️ **Note:** No workflow run found for `{workflow_name}` on the latest commit of branch `{branch}`.
+"""
+        elif status == "deferred" and deferred is False:
+            summary += f"""
+---
+⚠️ **Dropped:** {reason or 'The retry was deferred'}. Without a deferred queue file, it will not be issued later.
+"""
+        elif status == "deferred":
+            summary += f"""
+---
+⏸️ **Deferred:** {reason or 'The runner pool is saturated'}. The retry will be issued once capacity frees up.
 """
         elif status == "in_progress":
             summary += f"""
@@ -741,12 +5356,484 @@ class RetryOutputWriter:
 ✅ **Success:** The workflow completed successfully. No retry needed.
 """
 
+        summary += RetryOutputWriter.format_timings(timings)
+
         # Write to summary file
         try:
             with open(summary_file, "a") as f:
                 f.write(summary)
         except Exception as e:
-            print(f"Warning: Could not write to step summary: {e}", file=sys.stderr)
+            logger.warning(f"Could not write to step summary: {e}")
+
+    @staticmethod
+    @profiled("output")
+    def write_batch_summary(
+        batch_result: Dict[str, Any],
+        max_retries: int,
+        retry_mode: str,
+        runner_minutes_budget: Optional[int] = None,
+        timings: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        Write a summary of a batch of targets to GitHub Actions step summary.
+
+        Args:
+            batch_result: Result returned by RetryBatch.execute
+            max_retries: Maximum retries allowed
+            retry_mode: Retry mode (all/failed-only)
+            runner_minutes_budget: Runner-minute budget (optional)
+            timings: Aggregated timings of the runs (optional)
+        """
+        summary_file = os.environ.get("GITHUB_STEP_SUMMARY")
+        if not summary_file:
+            return
+
+        results = batch_result["results"]
+        retried = sum(1 for r in results if r["was_retried"])
+        budget = f"{runner_minutes_budget}" if runner_minutes_budget is not None else "unlimited"
+
+        summary = f"""## 🔁 Workflow Retry Action Summary ({len(results)} targets)
+
+| Repository | Workflow | Branch | Status | Retried | Est. minutes | Reason |
+|------------|----------|--------|--------|---------|--------------|--------|
+"""
+        for r in results:
+            summary += (
+                f"| `{r['repo']}` | `{r['workflow']}` | `{r['branch']}` | {r['status']} "
+                f"| {'✅ Yes' if r['was_retried'] else 'No'} "
+                f"| {r.get('estimated_minutes', '')} | {r.get('reason') or ''} |\n"
+            )
+
+        summary += f"""
+### Retry Information
+
+| Setting | Value |
+|---------|-------|
+| Retries Triggered | {retried} |
+| Max Retries | {max_retries} |
+| Retry Mode | `{retry_mode}` |
+| Runner Minutes Budget | {budget} |
+| Runner Minutes Spent | {batch_result['runner_minutes_spent']} |
+| Runner Minutes Saved | {batch_result['runner_minutes_saved']} |
+"""
+        summary += RetryOutputWriter.format_timings(timings)
+
+        try:
+            with open(summary_file, "a") as f:
+                f.write(summary)
+        except Exception as e:
+            logger.warning(f"Could not write to step summary: {e}")
+
+    @staticmethod
+    @profiled("output")
+    def write_sweep_summary(
+        org: str,
+        status_counts: Dict[str, int],
+        notable_results: List[Dict[str, Any]],
+        max_retries: int,
+        retry_mode: str,
+        timings: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        Write a summary of an organization sweep to GitHub Actions step summary.
+
+        Args:
+            org: Organization name
+            status_counts: Number of checked workflows per status
+            notable_results: Results of retried, failed, deferred or errored workflows
+            max_retries: Maximum retries allowed
+            retry_mode: Retry mode (all/failed-only)
+            timings: Aggregated timings of the runs (optional)
+        """
+        summary_file = os.environ.get("GITHUB_STEP_SUMMARY")
+        if not summary_file:
+            return
+
+        checked = sum(count for status, count in status_counts.items() if status != "not_found")
+        retried = sum(1 for r in notable_results if r["was_retried"])
+
+        summary = f"""## 🔁 Workflow Retry Action Summary (`{org}`, {checked} workflows)
+
+| Status | Workflows |
+|--------|-----------|
+"""
+        for status, count in sorted(status_counts.items()):
+            summary += f"| {status} | {count} |\n"
+
+        if notable_results:
+            summary += """
+| Repository | Workflow | Branch | Status | Retried | Reason |
+|------------|----------|--------|--------|---------|--------|
+"""
+            for r in notable_results:
+                summary += (
+                    f"| `{r['repo']}` | `{r['workflow']}` | `{r['branch']}` | {r['status']} "
+                    f"| {'✅ Yes' if r['was_retried'] else 'No'} | {r.get('reason') or ''} |\n"
+                )
+
+        summary += f"""
+### Retry Information
+
+| Setting | Value |
+|---------|-------|
+| Retries Triggered | {retried} |
+| Max Retries | {max_retries} |
+| Retry Mode | `{retry_mode}` |
+"""
+        summary += RetryOutputWriter.format_timings(timings)
+
+        try:
+            with open(summary_file, "a") as f:
+                f.write(summary)
+        except Exception as e:
+            logger.warning(f"Could not write to step summary: {e}")
+
+    @staticmethod
+    def format_timings(timings: Optional[Dict[str, Any]]) -> str:
+        """
+        Format aggregated timings as a step summary section.
+
+        Args:
+            timings: Aggregated timings (see TimingsAggregate.to_dict)
+
+        Returns:
+            Markdown section, empty if no run was measured
+        """
+        if not timings or not timings["runs"]:
+            return ""
+        return f"""
+### Timings
+
+| Metric | Value |
+|--------|-------|
+| Runs Measured | {timings['runs']} |
+| Job Queue Time | {format_duration(timings['queue_seconds'])} (avg {format_duration(timings['avg_queue_seconds'])}, max {format_duration(timings['max_queue_seconds'])} over {timings['jobs']} jobs) |
+| Job Execution Time | {format_duration(timings['execution_seconds'])} |
+| Retry Overhead | {format_duration(timings['retry_overhead_seconds'])} over {timings['retried_runs']} retried runs |
+| Avg Time to Green | {format_duration(timings['avg_time_to_green_seconds'])} over {timings['green_runs']} successful runs |
+"""
+
+    @staticmethod
+    def write_dispatch_summary(ref: str, results: List[Dict[str, Any]]) -> None:
+        """
+        Write the results of a bulk dispatch to GitHub Actions step summary.
+
+        Args:
+            ref: Ref the workflows were started on
+            results: Results returned by BulkDispatch.execute
+        """
+        summary_file = os.environ.get("GITHUB_STEP_SUMMARY")
+        if not summary_file:
+            return
+
+        dispatched = sum(1 for r in results if r["dispatched"])
+        summary = f"""## 🚀 Workflow Dispatch Summary (`{ref}`, {dispatched} of {len(results)} started)
+
+| Workflow | Inputs | Result | Run | Seconds |
+|----------|--------|--------|-----|---------|
+"""
+        for r in results:
+            inputs = ", ".join(f"`{key}={value}`" for key, value in r["inputs"].items())
+            summary += (
+                f"| `{r['workflow']}` | {inputs} | {'✅ Started' if r['dispatched'] else '❌ Failed'} "
+                f"| {r['run_id'] or ''} | {r['seconds']} |\n"
+            )
+
+        try:
+            with open(summary_file, "a") as f:
+                f.write(summary)
+        except Exception as e:
+            logger.warning(f"Could not write to step summary: {e}")
+
+    @staticmethod
+    def write_nightly_summary(results: List[Dict[str, Any]]) -> None:
+        """
+        Write the nightly trigger decisions to GitHub Actions step summary.
+
+        Args:
+            results: Results returned by NightlyTrigger.evaluate, with a
+                "dispatched" key when the workflow was started
+        """
+        summary_file = os.environ.get("GITHUB_STEP_SUMMARY")
+        if not summary_file:
+            return
+
+        triggered = sum(1 for r in results if r["trigger"])
+        summary = f"""## 🌙 Nightly Trigger Summary ({triggered} of {len(results)} workflows triggered)
+
+| Repository | Workflow | Branch | Trigger | Days Since Last Run | Reason |
+|------------|----------|--------|---------|---------------------|--------|
+"""
+        for r in results:
+            if r.get("error"):
+                trigger = "⚠️ Error"
+            elif not r["trigger"]:
+                trigger = "No"
+            elif r.get("dispatched") is False:
+                trigger = "❌ Dispatch failed"
+            elif r.get("triggered_run_id"):
+                trigger = f"✅ Run {r['triggered_run_id']}"
+            else:
+                trigger = "✅ Yes"
+            summary += (
+                f"| `{r['repo']}` | `{r['workflow']}` | `{r['branch']}` | {trigger} "
+                f"| {r.get('days_since_last_run', '')} | {r['reason']} |\n"
+            )
+
+        try:
+            with open(summary_file, "a") as f:
+                f.write(summary)
+        except Exception as e:
+            logger.warning(f"Could not write to step summary: {e}")
+
+    @staticmethod
+    @profiled("output")
+    def write_partial_results(
+        path: str,
+        batch_result: Dict[str, Any],
+        shard: Tuple[int, int],
+        max_retries: int,
+        retry_mode: str,
+        runner_minutes_budget: Optional[int] = None
+    ) -> None:
+        """
+        Write the result of a batch shard, to be merged with the other shards.
+
+        Args:
+            path: Partial result file
+            batch_result: Result returned by RetryBatch.execute
+            shard: Tuple of (index, count) of the shard
+            max_retries: Maximum retries allowed
+            retry_mode: Retry mode (all/failed-only)
+            runner_minutes_budget: Runner-minute budget (optional)
+        """
+        partial = dict(
+            batch_result,
+            shard=list(shard),
+            max_retries=max_retries,
+            retry_mode=retry_mode,
+            runner_minutes_budget=runner_minutes_budget
+        )
+        with open(path, "w") as f:
+            json.dump(partial, f, indent=2)
+
+
+class LogFormatter(logging.Formatter):
+    """Formats log records like the script output, prefixing warnings."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        if record.levelno == logging.WARNING:
+            return f"Warning: {message}"
+        return message
+
+
+def configure_logging() -> None:
+    """Send info messages to stdout, warnings and errors to stderr."""
+    formatter = LogFormatter("%(message)s")
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(formatter)
+    stdout_handler.addFilter(lambda record: record.levelno < logging.WARNING)
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setFormatter(formatter)
+    stderr_handler.setLevel(logging.WARNING)
+    logger.handlers = [stdout_handler, stderr_handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def parse_merge_arguments(argv: List[str]) -> argparse.Namespace:
+    """
+    Parse the arguments of the merge command.
+
+    Args:
+        argv: Arguments following "merge"
+
+    Returns:
+        Parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="retry_workflow.py merge",
+        description="Combine the partial result files of batch shards"
+    )
+    parser.add_argument(
+        "partial_files",
+        nargs="+",
+        help="Partial result files written with --results-file"
+    )
+    parser.add_argument(
+        "--output-file",
+        help="File to write output variables (for GitHub Actions)"
+    )
+    return parser.parse_args(argv)
+
+
+def parse_nightly_arguments(argv: List[str]) -> argparse.Namespace:
+    """
+    Parse the arguments of the nightly command.
+
+    Args:
+        argv: Arguments following "nightly"
+
+    Returns:
+        Parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="retry_workflow.py nightly",
+        description="Decide whether nightly workflows should be started"
+    )
+    parser.add_argument(
+        "--branch",
+        help="Branch to check (default branch of the repository if not set)"
+    )
+    parser.add_argument(
+        "--workflow",
+        help="Workflow file name (e.g., nightly.yaml)"
+    )
+    parser.add_argument(
+        "--targets-file",
+        help="JSON file listing several targets (repo, branch, workflow) to decide in one batch"
+    )
+    parser.add_argument(
+        "--max-start-if-last-failed",
+        type=int,
+        default=0,
+        help="Restart a failed run of the last commit until it has this many runs (default: 0, disabled)"
+    )
+    parser.add_argument(
+        "--commit-check-period",
+        type=int,
+        default=1,
+        help="Start the workflow for commits of the last N days without successful run (default: 1)"
+    )
+    parser.add_argument(
+        "--dispatch",
+        action="store_true",
+        help="Start the workflows that should be triggered"
+    )
+    parser.add_argument(
+        "--output-file",
+        help="File to write output variables (for GitHub Actions)"
+    )
+    add_dispatch_arguments(parser)
+    add_client_arguments(parser)
+
+    args = parser.parse_args(argv)
+    if not args.targets_file and not args.workflow:
+        parser.error("--workflow is required unless --targets-file is used")
+    return args
+
+
+def parse_dispatch_arguments(argv: List[str]) -> argparse.Namespace:
+    """
+    Parse the arguments of the dispatch command.
+
+    Args:
+        argv: Arguments following "dispatch"
+
+    Returns:
+        Parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="retry_workflow.py dispatch",
+        description="Start several workflows concurrently"
+    )
+    parser.add_argument(
+        "--workflows",
+        type=parse_workflow_list,
+        required=True,
+        help='Comma-separated workflows with their inputs, e.g. "test-1.yaml, test-2.yaml -f field_one=true"'
+    )
+    parser.add_argument(
+        "--ref",
+        required=True,
+        help="Branch or tag to run the workflows on"
+    )
+    parser.add_argument(
+        "--output-file",
+        help="File to write output variables (for GitHub Actions)"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only report the workflows that would be started, without calling the API"
+    )
+    add_dispatch_arguments(parser)
+    add_client_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_dispatch_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the arguments locating the runs created by workflow dispatches.
+
+    Args:
+        parser: Parser of a command
+    """
+    parser.add_argument(
+        "--correlation-input",
+        help="Workflow input receiving a unique marker, shown in the run-name of the workflow, "
+             "to find the dispatched run (optional)"
+    )
+    parser.add_argument(
+        "--track-timeout",
+        type=float,
+        default=DISPATCH_TRACK_TIMEOUT,
+        help=f"Maximum time to wait for dispatched runs in seconds, 0 to not look for them "
+             f"(default: {DISPATCH_TRACK_TIMEOUT})"
+    )
+
+
+def add_client_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the GitHub API client arguments shared by all commands.
+
+    Args:
+        parser: Parser of a command
+    """
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help=f"Maximum number of concurrent GitHub API requests (default: {DEFAULT_MAX_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        help="Overall time budget of the GitHub API requests in minutes (optional)"
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=int,
+        default=DEFAULT_REQUEST_TIMEOUT,
+        help=f"Maximum duration of a single GitHub API request in seconds (default: {DEFAULT_REQUEST_TIMEOUT})"
+    )
+    parser.add_argument(
+        "--tokens-file",
+        help="JSON file listing the credentials of a token pool (optional)"
+    )
+    parser.add_argument(
+        "--app-id",
+        help="Authenticate as this GitHub App, with the private key of the GITHUB_APP_PRIVATE_KEY environment variable (optional)"
+    )
+    parser.add_argument(
+        "--app-token-cache-file",
+        help="File caching GitHub App installation tokens between invocations (optional)"
+    )
+    parser.add_argument(
+        "--record",
+        help="Record every GitHub API request and response to this cassette file (.gz to compress), "
+             "and the state files to the same path with .state appended"
+    )
+    parser.add_argument(
+        "--replay",
+        help="Answer GitHub API requests from this cassette file instead of the network"
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        help="Replay requests at this speed relative to the recording, e.g. 1 or 10 (default: no delay)"
+    )
 
 
 def parse_arguments() -> argparse.Namespace:
@@ -761,13 +5848,25 @@ def parse_arguments() -> argparse.Namespace:
     )
     parser.add_argument(
         "--branch",
-        required=True,
-        help="Branch name to check"
+        help="Branch name to check (default branch of targets in batch mode)"
     )
     parser.add_argument(
         "--workflow",
-        required=True,
-        help="Workflow name to check"
+        help="Workflow name to check (required unless --targets-file is used)"
+    )
+    parser.add_argument(
+        "--targets-file",
+        help="JSON file listing several targets to check in one batch (optional)"
+    )
+    parser.add_argument(
+        "--all-workflows",
+        action="store_true",
+        help="Check every workflow run on the latest commit of --branch in one batch"
+    )
+    parser.add_argument(
+        "--runner-minutes-budget",
+        type=int,
+        help="Maximum estimated runner minutes spent on retries in batch mode (optional)"
     )
     parser.add_argument(
         "--max-retries",
@@ -791,75 +5890,903 @@ def parse_arguments() -> argparse.Namespace:
         default="",
         help="Only retry if this specific step failed (optional)"
     )
+    parser.add_argument(
+        "--skip-deterministic-failures",
+        action="store_true",
+        help="Do not retry if the latest attempt failed on the same jobs/steps as the previous one"
+    )
+    parser.add_argument(
+        "--max-queued-runs",
+        type=int,
+        help="Defer the retry while at least this many runs are queued (optional)"
+    )
+    parser.add_argument(
+        "--min-idle-runners",
+        type=int,
+        help="Defer the retry while fewer self-hosted runners are idle (optional)"
+    )
+    parser.add_argument(
+        "--runner-scope",
+        choices=["repo", "org"],
+        default="repo",
+        help="Where to look for self-hosted runners: 'repo' or 'org' (default: repo)"
+    )
+    parser.add_argument(
+        "--priority",
+        type=int,
+        default=0,
+        help="Priority of this retry when deferred, higher first (default: 0)"
+    )
+    parser.add_argument(
+        "--deferred-queue-file",
+        help="File persisting deferred retries between invocations (optional)"
+    )
+    parser.add_argument(
+        "--retry-lock-file",
+        help="File shared between invocations guaranteeing at most one rerun per run attempt (optional)"
+    )
+    parser.add_argument(
+        "--rerun-quota",
+        type=int,
+        help="Maximum number of reruns of all invocations sharing --rerun-quota-file within --rerun-quota-window, retries over it are deferred (optional, requires --rerun-quota-file)"
+    )
+    parser.add_argument(
+        "--rerun-quota-window",
+        type=int,
+        default=60,
+        help="Sliding window of --rerun-quota in minutes (default: 60)"
+    )
+    parser.add_argument(
+        "--rerun-quota-file",
+        help="File shared between invocations recording the reruns counted by --rerun-quota (optional, in-process if not set)"
+    )
+    parser.add_argument(
+        "--history-depth",
+        type=int,
+        default=1,
+        help="When the last commit has no run of the workflow, look at the runs of up to this many latest commits (default: 1)"
+    )
+    parser.add_argument(
+        "--history-memo-file",
+        help="File remembering the commits found with --history-depth between invocations (optional)"
+    )
+    parser.add_argument(
+        "--cancel-superseded",
+        action="store_true",
+        help="Before retrying, cancel queued and in-progress runs of the workflow on older commits of the branch"
+    )
+    parser.add_argument(
+        "--cancel-dry-run",
+        action="store_true",
+        help="Only report the superseded runs that --cancel-superseded would cancel"
+    )
+    parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="After retrying, wait for the new attempt and retry again if needed"
+    )
+    parser.add_argument(
+        "--wait-timeout",
+        type=int,
+        default=60,
+        help="Maximum time to wait for retried attempts in minutes (default: 60)"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=int,
+        default=15,
+        help="Initial polling interval while waiting in seconds (default: 15)"
+    )
+    parser.add_argument(
+        "--sweep-org",
+        help="Check the workflows of --workflow (comma-separated) on the default branch of every repository of this organization"
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Only process the targets (or swept repositories) of shard i/N (optional)"
+    )
+    parser.add_argument(
+        "--results-file",
+        help="File to write the batch results to, to be combined with the merge command (optional)"
+    )
     parser.add_argument(
         "--output-file",
         help="File to write output variables (for GitHub Actions)"
     )
+    parser.add_argument(
+        "--ndjson-file",
+        help="File receiving one JSON record per checked workflow as soon as it is decided (optional)"
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the run with cProfile and tracemalloc, writing a pstats file to this path and a report to this path with .txt appended (optional)"
+    )
 
-    return parser.parse_args()
+    add_client_arguments(parser)
 
+    args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record and --replay are mutually exclusive")
+    if args.sweep_org and not args.workflow:
+        parser.error("--workflow is required with --sweep-org")
+    if args.all_workflows and not args.branch:
+        parser.error("--branch is required with --all-workflows")
+    if args.rerun_quota is not None and not args.rerun_quota_file:
+        parser.error("--rerun-quota-file is required with --rerun-quota")
+    if not args.targets_file and not args.sweep_org and not args.all_workflows and not (args.branch and args.workflow):
+        parser.error("--branch and --workflow are required unless --targets-file, --sweep-org or --all-workflows is used")
+    return args
 
-def main() -> int:
+
+def build_token_pool(args: argparse.Namespace, transport: Optional[Any] = None) -> Optional[TokenPool]:
     """
-    Main entry point for the script.
+    Build the token pool from the tokens file and GitHub App arguments.
+
+    Args:
+        args: Parsed arguments
+        transport: Transport sending the API requests of GitHub Apps
+            (optional)
 
     Returns:
-        Exit code (0 for success, 1 for failure)
+        TokenPool, or None to use the token of the environment
+
+    Raises:
+        ValueError: If --app-id is set without a private key
+    """
+    if not args.tokens_file and not args.app_id:
+        return None
+
+    if args.tokens_file:
+        pool = TokenPool.from_file(args.tokens_file, args.app_token_cache_file, transport)
+    else:
+        pool = TokenPool([])
+
+    if args.app_id:
+        private_key = os.environ.get("GITHUB_APP_PRIVATE_KEY")
+        if not private_key:
+            raise ValueError("GITHUB_APP_PRIVATE_KEY environment variable not set")
+        pool.apps.append(GitHubAppAuth(args.app_id, private_key, args.app_token_cache_file, transport=transport))
+    return pool
+
+
+def build_rerun_quota(args: argparse.Namespace) -> Optional[RerunQuota]:
+    """
+    Build the rerun quota from the command line arguments.
+
+    Args:
+        args: Parsed arguments
+
+    Returns:
+        RerunQuota, or None if --rerun-quota is not set
+
+    Raises:
+        ValueError: If the quota is configured without its state file
+    """
+    if args.rerun_quota is None:
+        return None
+    if not args.rerun_quota_file:
+        # An in-process quota would not limit the other invocations
+        raise ValueError("Rerun quota configured without state file, set --rerun-quota-file")
+    return RerunQuota(args.rerun_quota, args.rerun_quota_window * 60, JsonStateFile(args.rerun_quota_file))
+
+
+def build_client_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Build the GitHubClient options shared by all clients of a command.
+
+    Args:
+        args: Parsed arguments, see add_client_arguments
+
+    Returns:
+        Dictionary with the policy, tokens and transport options
+    """
+    transport: Optional[Any] = None
+    if args.record:
+        transport = RecordingTransport(args.record)
+    elif args.replay:
+        transport = ReplayTransport(args.replay, args.replay_speed)
+
+    return {
+        "policy": RequestPolicy(
+            timeout=args.timeout * 60 if args.timeout else None,
+            request_timeout=args.request_timeout,
+            # Duplicated requests would make cassettes ambiguous
+            hedge=transport is None,
+            clock=transport.monotonic if transport is not None else time.monotonic
+        ),
+        "tokens": None if args.replay else build_token_pool(args, transport),
+        "transport": transport
+    }
+
+
+def report_batch_result(
+    output_file: Optional[str],
+    batch_result: Dict[str, Any],
+    max_retries: int,
+    retry_mode: str,
+    runner_minutes_budget: Optional[int] = None
+) -> None:
+    """
+    Write the outputs and step summary of a batch.
+
+    Args:
+        output_file: Path to output file (GITHUB_OUTPUT)
+        batch_result: Result returned by RetryBatch.execute
+        max_retries: Maximum retries allowed
+        retry_mode: Retry mode (all/failed-only)
+        runner_minutes_budget: Runner-minute budget (optional)
+    """
+    results = batch_result["results"]
+    retried = sum(1 for r in results if r["was_retried"])
+    timings = TimingsAggregate()
+    for r in results:
+        timings.add(r.get("timings"))
+    RetryOutputWriter.write_github_output(
+        output_file,
+        aggregate_status([r["status"] for r in results]),
+        retried,
+        retried > 0,
+        {
+            "runner_minutes_spent": str(batch_result["runner_minutes_spent"]),
+            "runner_minutes_saved": str(batch_result["runner_minutes_saved"]),
+            "results": json.dumps(results, separators=(",", ":")),
+            "timings": json.dumps(timings.to_dict(), separators=(",", ":"))
+        }
+    )
+
+    RetryOutputWriter.write_batch_summary(
+        batch_result,
+        max_retries,
+        retry_mode,
+        runner_minutes_budget,
+        timings.to_dict()
+    )
+
+
+def run_batch(
+    args: argparse.Namespace,
+    repo: str,
+    manager_options: Dict[str, Any],
+    targets: Optional[List[RetryTarget]] = None,
+    results_sink: Optional[ResultsSink] = None
+) -> int:
+    """
+    Check and retry all targets of a targets file (or of one shard of it).
+
+    Args:
+        args: Parsed arguments
+        repo: Default repository in owner/repo format
+        manager_options: Options passed to every WorkflowRetryManager
+        targets: Targets to check instead of those of the targets file
+        results_sink: Sink receiving each result as soon as it is decided
+
+    Returns:
+        Exit code (0 for success)
+    """
+    if targets is None:
+        targets = load_targets(args.targets_file, repo, args.branch)
+    if args.shard:
+        index, count = args.shard
+        targets = [t for t in targets if shard_of(t.key, count) == index]
+        logger.info(f"Shard {index}/{count}: {len(targets)} targets")
+
+    batch = RetryBatch(targets, args.runner_minutes_budget, results_sink, **manager_options)
+    batch_result = batch.execute()
+
+    if args.results_file:
+        RetryOutputWriter.write_partial_results(
+            args.results_file,
+            batch_result,
+            args.shard or (1, 1),
+            args.max_retries,
+            args.retry_mode,
+            args.runner_minutes_budget
+        )
+
+    report_batch_result(
+        args.output_file,
+        batch_result,
+        args.max_retries,
+        args.retry_mode,
+        args.runner_minutes_budget
+    )
+
+    return 0
+
+
+def merge_partial_results(paths: List[str]) -> Dict[str, Any]:
+    """
+    Combine the partial result files of the shards of a batch.
+
+    Args:
+        paths: Partial result files
+
+    Returns:
+        Dictionary with the combined batch result under "batch_result",
+        and the max_retries, retry_mode and runner_minutes_budget of the shards
+
+    Raises:
+        ValueError: If a file cannot be read, is not a partial result, or the
+            files do not cover each shard of the same count exactly once
+    """
+    merged: Dict[str, Any] = {
+        "batch_result": {"results": [], "runner_minutes_spent": 0, "runner_minutes_saved": 0},
+        "max_retries": 0,
+        "retry_mode": "",
+        "runner_minutes_budget": None
+    }
+    seen: Dict[int, str] = {}
+    shard_count = None
+    for path in paths:
+        try:
+            with open(path) as f:
+                partial = json.load(f)
+            index, count = partial["shard"]
+            results = partial["results"]
+            spent = partial["runner_minutes_spent"]
+            saved = partial["runner_minutes_saved"]
+            max_retries = partial["max_retries"]
+            retry_mode = partial["retry_mode"]
+            budget = partial["runner_minutes_budget"]
+        except OSError as e:
+            raise ValueError(f"Cannot read partial results {path}: {e}") from e
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid partial results {path}: {e!r}") from e
+
+        if not isinstance(index, int) or not isinstance(count, int) or not 1 <= index <= count:
+            raise ValueError(f"Invalid shard {index}/{count} in {path}")
+        if shard_count is None:
+            shard_count = count
+        elif count != shard_count:
+            raise ValueError(f"Shard {index}/{count} of {path} does not match {shard_count} shards")
+        if index in seen:
+            raise ValueError(f"Shard {index}/{count} found in both {seen[index]} and {path}")
+        seen[index] = path
+
+        batch_result = merged["batch_result"]
+        batch_result["results"].extend(results)
+        batch_result["runner_minutes_spent"] += spent
+        batch_result["runner_minutes_saved"] += saved
+        merged["max_retries"] = max_retries
+        merged["retry_mode"] = retry_mode
+        if budget is not None:
+            merged["runner_minutes_budget"] = (merged["runner_minutes_budget"] or 0) + budget
+
+    if shard_count is None:
+        raise ValueError("No partial results to merge")
+    missing = sorted(set(range(1, shard_count + 1)) - set(seen))
+    if missing:
+        raise ValueError(
+            "Missing partial results of shards "
+            + ", ".join(f"{i}/{shard_count}" for i in missing)
+        )
+    return merged
+
+
+def run_merge(args: argparse.Namespace) -> int:
     """
-    args = parse_arguments()
+    Combine the partial result files of shards into one output set and summary.
+
+    Args:
+        args: Parsed merge arguments
 
+    Returns:
+        Exit code (0 for success, 1 if the partial results cannot be merged)
+    """
+    try:
+        merged = merge_partial_results(args.partial_files)
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+    report_batch_result(
+        args.output_file,
+        merged["batch_result"],
+        merged["max_retries"],
+        merged["retry_mode"],
+        merged["runner_minutes_budget"]
+    )
+    return 0
+
+
+def run_sweep(
+    args: argparse.Namespace,
+    manager_options: Dict[str, Any],
+    results_sink: Optional[ResultsSink] = None
+) -> int:
+    """
+    Check and retry the selected workflows of every repository of an organization.
+
+    Results are reported as they come and only aggregated, except for the
+    workflows needing attention.
+
+    Args:
+        args: Parsed arguments
+        manager_options: Options passed to every WorkflowRetryManager
+        results_sink: Sink receiving each result as soon as it is decided
+
+    Returns:
+        Exit code (0 for success)
+    """
+    workflows = [w.strip() for w in args.workflow.split(",") if w.strip()]
+    sweep = OrgSweep(args.sweep_org, workflows, args.max_concurrency, args.shard, **manager_options)
+
+    status_counts: Dict[str, int] = {}
+    notable_results = []
+    timings = TimingsAggregate()
+    worst = SUCCESS_STATUS
+    for result in sweep.execute(args.job_name or None, args.step_name or None):
+        if results_sink:
+            results_sink.write(result)
+        timings.add(result.get("timings"))
+        status = result["status"]
+        status_counts[status] = status_counts.get(status, 0) + 1
+        worst = aggregate_status([worst, status])
+        if status == "not_found":
+            continue
+        logger.info(
+            f"[{result['repo']}] {result['workflow']}: {status}"
+            + (" (retried)" if result["was_retried"] else "")
+            + (f" - {result['reason']}" if result.get("reason") else "")
+        )
+        if result["was_retried"] or status in FAILED_STATUSES or status in ("deferred", "error"):
+            notable_results.append(result)
+
+    retried = sum(1 for r in notable_results if r["was_retried"])
+    RetryOutputWriter.write_github_output(
+        args.output_file,
+        worst,
+        retried,
+        retried > 0,
+        {
+            "results": json.dumps(notable_results, separators=(",", ":")),
+            "timings": json.dumps(timings.to_dict(), separators=(",", ":"))
+        }
+    )
+    RetryOutputWriter.write_sweep_summary(
+        args.sweep_org,
+        status_counts,
+        notable_results,
+        args.max_retries,
+        args.retry_mode,
+        timings.to_dict()
+    )
+
+    return 0
+
+
+def run_dispatch(args: argparse.Namespace) -> int:
+    """
+    Start several workflows concurrently and report each of them.
+
+    Args:
+        args: Parsed dispatch arguments
+
+    Returns:
+        Exit code (0 if all workflows were started, 1 otherwise)
+    """
+    if args.dry_run:
+        for workflow, inputs in args.workflows:
+            logger.info(
+                f"Would start {workflow} on {args.ref}"
+                + "".join(f" -f {key}={value}" for key, value in inputs.items())
+            )
+        RetryOutputWriter.write_variables(args.output_file, {
+            "dispatched_count": "0",
+            "failed_count": "0",
+            "failed_workflows": "",
+            "run_ids": ""
+        })
+        return 0
+
+    GitHubClient.set_max_concurrency(args.max_concurrency)
+
+    transport = None
     try:
-        # Get repository from environment
         repo = os.environ.get("GITHUB_REPOSITORY")
         if not repo:
-            print(
-                "Error: GITHUB_REPOSITORY environment variable not set",
-                file=sys.stderr
-            )
+            logger.error("GITHUB_REPOSITORY environment variable not set")
             return 1
 
-        # Create manager
-        manager = WorkflowRetryManager(
-            repo=repo,
-            branch=args.branch,
-            workflow_name=args.workflow,
-            max_retries=args.max_retries,
-            retry_mode=args.retry_mode
-        )
+        client_options = build_client_options(args)
+        transport = client_options["transport"]
 
-        # Execute retry logic
-        result = manager.execute_retry_logic(
-            job_filter=args.job_name or None,
-            step_filter=args.step_name or None
+        bulk = BulkDispatch(
+            GitHubClient(repo, **client_options),
+            args.ref,
+            args.workflows,
+            args.correlation_input,
+            args.max_concurrency
         )
+        results = bulk.execute(args.track_timeout)
 
-        # Write outputs
-        RetryOutputWriter.write_github_output(
-            args.output_file,
-            result["status"],
-            result["retry_count"],
-            result["was_retried"]
-        )
+        for r in results:
+            logger.info(
+                f"{r['workflow']} on {args.ref}: {'started' if r['dispatched'] else 'failed'}"
+                + (f", run {r['run_id']}" if r["run_id"] else "")
+                + f" ({r['seconds']}s)"
+            )
 
-        RetryOutputWriter.write_step_summary(
-            args.workflow,
-            args.branch,
-            result["status"],
-            result["retry_count"],
-            result["was_retried"],
-            args.max_retries,
-            args.retry_mode,
-            result.get("run_id")
-        )
+        failed = [r["workflow"] for r in results if not r["dispatched"]]
+        RetryOutputWriter.write_variables(args.output_file, {
+            "dispatched_count": str(len(results) - len(failed)),
+            "failed_count": str(len(failed)),
+            "failed_workflows": ",".join(failed),
+            "run_ids": ",".join(str(r["run_id"]) for r in results if r["run_id"])
+        })
+        RetryOutputWriter.write_dispatch_summary(args.ref, results)
+        return 1 if failed else 0
 
-        return 0
+    except subprocess.CalledProcessError as e:
+        logger.error(f"GitHub CLI error: {e.stderr}")
+        return 1
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return 1
+    finally:
+        if isinstance(transport, RecordingTransport):
+            transport.close()
+
+
+def run_nightly(args: argparse.Namespace) -> int:
+    """
+    Decide whether nightly workflows should be started, and start them.
+
+    Decisions of a targets file are made concurrently, with one client per
+    repository and one response cache for all of them.
+
+    Args:
+        args: Parsed nightly arguments
+
+    Returns:
+        Exit code (0 for success, 1 if a decision failed or a dispatch
+        was not started)
+    """
+    GitHubClient.set_max_concurrency(args.max_concurrency)
+
+    transport = None
+    try:
+        repo = os.environ.get("GITHUB_REPOSITORY")
+        if not repo:
+            logger.error("GITHUB_REPOSITORY environment variable not set")
+            return 1
+
+        client_options = build_client_options(args)
+        transport = client_options["transport"]
+        client_options["cache"] = ResponseCache()
+        clients: Dict[str, GitHubClient] = {}
+
+        def create_trigger(target_repo: str, branch: Optional[str], workflow: str) -> NightlyTrigger:
+            if target_repo not in clients:
+                clients[target_repo] = GitHubClient(target_repo, **client_options)
+            return NightlyTrigger(
+                clients[target_repo],
+                workflow,
+                branch,
+                args.max_start_if_last_failed,
+                args.commit_check_period
+            )
+
+        def evaluate(trigger: NightlyTrigger) -> Dict[str, Any]:
+            result = trigger.evaluate()
+            if args.dispatch and result["trigger"]:
+                dispatch = trigger.dispatch(args.correlation_input, args.track_timeout)
+                result.update(dispatched=dispatch["dispatched"], triggered_run_id=dispatch["run_id"])
+            return result
+
+        if not args.targets_file:
+            result = evaluate(create_trigger(repo, args.branch, args.workflow))
+            variables = {
+                "trigger": "true" if result["trigger"] else "false",
+                "reason": result["reason"],
+                "last_commit_time": str(result["last_commit_time"]),
+                "days_since_last_run": str(result["days_since_last_run"]),
+                "conclusion": result["conclusion"] or "",
+                "branch": result["branch"]
+            }
+            if "dispatched" in result:
+                variables["dispatched"] = "true" if result["dispatched"] else "false"
+                variables["triggered_run_id"] = str(result["triggered_run_id"] or "")
+            RetryOutputWriter.write_variables(args.output_file, variables)
+            return 0 if result.get("dispatched", True) else 1
+
+        triggers = [
+            create_trigger(t.repo, t.branch, t.workflow)
+            for t in load_targets(args.targets_file, repo, args.branch)
+        ]
+        results: List[Dict[str, Any]] = []
+        with ThreadPoolExecutor(max_workers=args.max_concurrency) as executor:
+            futures = [executor.submit(evaluate, trigger) for trigger in triggers]
+            for trigger, future in zip(triggers, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.warning(f"[{trigger.client.repo}] {trigger.workflow}: {e}")
+                    results.append({
+                        "repo": trigger.client.repo,
+                        "branch": trigger.branch,
+                        "workflow": trigger.workflow,
+                        "trigger": False,
+                        "reason": f"Error: {e}",
+                        "error": True
+                    })
+
+        triggered = sum(1 for r in results if r["trigger"])
+        RetryOutputWriter.write_variables(args.output_file, {
+            "trigger": "true" if triggered else "false",
+            "reason": f"{triggered} of {len(results)} workflows to trigger",
+            "triggered_count": str(triggered)
+        })
+        RetryOutputWriter.write_nightly_summary(results)
+        failed = [r for r in results if r.get("error") or not r.get("dispatched", True)]
+        for r in failed:
+            logger.error(f"[{r['repo']}] {r['workflow']} on {r['branch']}: {r['reason'] if r.get('error') else 'dispatch failed'}")
+        return 1 if failed else 0
 
     except subprocess.CalledProcessError as e:
-        print(f"GitHub CLI error: {e.stderr}", file=sys.stderr)
+        logger.error(f"GitHub CLI error: {e.stderr}")
         return 1
     except Exception as e:
-        print(f"Unexpected error: {e}", file=sys.stderr)
+        logger.error(f"Unexpected error: {e}")
         return 1
+    finally:
+        if isinstance(transport, RecordingTransport):
+            transport.close()
+
+
+def state_snapshot_directory(cassette: str) -> str:
+    """
+    Get the directory holding the state files of a recorded invocation.
+
+    Args:
+        cassette: Path of the cassette
+
+    Returns:
+        Directory next to the cassette
+    """
+    return cassette + ".state"
+
+
+def snapshot_state_files(args: argparse.Namespace, directory: str) -> None:
+    """
+    Copy the state files before recording, so that replays start from them.
+
+    Args:
+        args: Parsed arguments
+        directory: Directory receiving the snapshot
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in STATE_FILE_ARGUMENTS:
+        path = getattr(args, name)
+        snapshot = os.path.join(directory, f"{name}.json")
+        if path and os.path.exists(path):
+            shutil.copyfile(path, snapshot)
+        elif os.path.exists(snapshot):
+            # Left by a previous recording to the same cassette
+            os.remove(snapshot)
+
+
+def isolate_state_files(args: argparse.Namespace, snapshot: str, directory: str) -> None:
+    """
+    Point the state file arguments to copies, so that a replay leaves them alone.
+
+    The copies start from the state snapshot taken when the cassette was
+    recorded, so a replay sees the same locks, deferred retries, quota and
+    memoized commits as the recorded run. State files missing from the
+    snapshot start empty.
+
+    Args:
+        args: Parsed arguments, updated in place
+        snapshot: Directory of the snapshot, see snapshot_state_files
+        directory: Directory receiving the copies
+    """
+    if not os.path.isdir(snapshot):
+        logger.warning(f"No state snapshot in {snapshot}, replaying with empty state files")
+    for name in STATE_FILE_ARGUMENTS:
+        if not getattr(args, name):
+            continue
+        copy = os.path.join(directory, f"{name}.json")
+        recorded = os.path.join(snapshot, f"{name}.json")
+        if os.path.exists(recorded):
+            shutil.copyfile(recorded, copy)
+        setattr(args, name, copy)
+
+
+def build_manager_options(args: argparse.Namespace, client_options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the WorkflowRetryManager options from the command line arguments.
+
+    Args:
+        args: Parsed arguments
+        client_options: GitHubClient options, see build_client_options
+
+    Returns:
+        Options passed to every WorkflowRetryManager of the invocation
+    """
+    return {
+        "max_retries": args.max_retries,
+        "retry_mode": args.retry_mode,
+        "skip_deterministic_failures": args.skip_deterministic_failures,
+        "max_queued_runs": args.max_queued_runs,
+        "min_idle_runners": args.min_idle_runners,
+        "runner_scope": args.runner_scope,
+        "deferred_queue_file": args.deferred_queue_file,
+        "retry_lock_file": args.retry_lock_file,
+        "cancel_superseded": args.cancel_superseded,
+        "cancel_dry_run": args.cancel_dry_run,
+        "history_depth": args.history_depth,
+        "history_memo_file": args.history_memo_file,
+        "rerun_quota": build_rerun_quota(args),
+        "client_options": client_options
+    }
+
+
+def run_single(
+    args: argparse.Namespace,
+    repo: str,
+    manager_options: Dict[str, Any],
+    results_sink: Optional[ResultsSink] = None
+) -> int:
+    """
+    Check and retry the workflow of the command line.
+
+    Args:
+        args: Parsed arguments
+        repo: Repository in owner/repo format
+        manager_options: Options passed to the WorkflowRetryManager
+        results_sink: Sink receiving the result (optional)
+
+    Returns:
+        Exit code (0 for success)
+    """
+    manager = WorkflowRetryManager(
+        repo=repo,
+        branch=args.branch,
+        workflow_name=args.workflow,
+        priority=args.priority,
+        **manager_options
+    )
+
+    wait_timeout = args.wait_timeout * 60
+    if args.timeout:
+        # Keep time for the final requests within the overall budget
+        wait_timeout = min(wait_timeout, args.timeout * 60 * 0.9)
+    started = time.monotonic()
+    result = manager.check(
+        job_filter=args.job_name or None,
+        step_filter=args.step_name or None,
+        wait=args.wait,
+        wait_timeout=wait_timeout,
+        poll_interval=args.poll_interval
+    )
+    if results_sink:
+        record = dict(result.to_dict(), repo=repo, branch=args.branch, workflow=args.workflow)
+        results_sink.write(manager.annotate(record, started))
+
+    timings = TimingsAggregate()
+    if manager.last_run is not None and manager.last_run.id == result.run_id:
+        timings.add(manager.last_run.timings())
+
+    # Write outputs
+    extra = {"timings": json.dumps(timings.to_dict(), separators=(",", ":"))}
+    if result.superseded_runs:
+        extra["freed_runner_slots"] = str(result.superseded_runs["freed_runner_slots"])
+    RetryOutputWriter.write_github_output(
+        args.output_file,
+        result.status,
+        result.retry_count,
+        result.was_retried,
+        extra
+    )
+
+    logger.info(f"GitHub API: {manager.client.stats}, {manager.client.cache.hits} cache hits")
+
+    RetryOutputWriter.write_step_summary(
+        args.workflow,
+        args.branch,
+        result.status,
+        result.retry_count,
+        result.was_retried,
+        args.max_retries,
+        args.retry_mode,
+        result.run_id,
+        result.reason,
+        timings.to_dict(),
+        result.deferred
+    )
+    return 0
+
+
+def run_retry(args: argparse.Namespace) -> int:
+    """
+    Check and retry workflows: one workflow, a batch or an organization.
+
+    Args:
+        args: Parsed arguments
+
+    Returns:
+        Exit code (0 for success, 1 for failure)
+    """
+    GitHubClient.set_max_concurrency(args.max_concurrency)
+
+    profiler = Profiler(args.profile) if args.profile else None
+    if profiler:
+        profiler.start()
+
+    transport = None
+    results_sink = None
+    state_directory = tempfile.TemporaryDirectory() if args.replay else None
+    try:
+        if args.record:
+            snapshot_state_files(args, state_snapshot_directory(args.record))
+        if state_directory:
+            isolate_state_files(args, state_snapshot_directory(args.replay), state_directory.name)
+
+        # Get repository from environment
+        repo = os.environ.get("GITHUB_REPOSITORY")
+        if not repo:
+            logger.error("GITHUB_REPOSITORY environment variable not set")
+            return 1
+
+        client_options = build_client_options(args)
+        transport = client_options["transport"]
+        if args.ndjson_file:
+            results_sink = ResultsSink(args.ndjson_file)
+        manager_options = build_manager_options(args, client_options)
+
+        if args.sweep_org:
+            return run_sweep(args, manager_options, results_sink)
+        if args.targets_file:
+            return run_batch(args, repo, manager_options, results_sink=results_sink)
+        if args.all_workflows:
+            # The snapshot listing the workflows is reused by their managers
+            client_options["cache"] = ResponseCache()
+            targets = snapshot_targets(GitHubClient(repo, **client_options), args.branch)
+            return run_batch(args, repo, manager_options, targets, results_sink)
+        return run_single(args, repo, manager_options, results_sink)
+
+    except subprocess.CalledProcessError as e:
+        logger.error(f"GitHub CLI error: {e.stderr}")
+        return 1
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return 1
+    finally:
+        if isinstance(transport, RecordingTransport):
+            transport.close()
+        if results_sink:
+            results_sink.close()
+        if state_directory:
+            state_directory.cleanup()
+        if profiler:
+            try:
+                profiler.stop()
+            except Exception as e:
+                # Must not replace the exit code or the error of the command
+                logger.error(f"Could not write profile: {e}")
+
+
+# Subcommands, with their argument parser and runner
+COMMANDS: Dict[str, Tuple[Callable[[List[str]], argparse.Namespace], Callable[[argparse.Namespace], int]]] = {
+    "merge": (parse_merge_arguments, run_merge),
+    "nightly": (parse_nightly_arguments, run_nightly),
+    "dispatch": (parse_dispatch_arguments, run_dispatch),
+}
+
+
+def main() -> int:
+    """
+    Main entry point for the script.
+
+    Returns:
+        Exit code (0 for success, 1 for failure)
+    """
+    configure_logging()
+
+    if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+        parse, run = COMMANDS[sys.argv[1]]
+        return run(parse(sys.argv[2:]))
+    return run_retry(parse_arguments())
 
 
 if __name__ == "__main__":
@@ -3,9 +3,16 @@
 Unit tests for retry_workflow.py
 """
 
+import argparse
 import json
+import os
+import pstats
+import re
 import subprocess
+import tempfile
+import threading
 import unittest
+import urllib.error
 from unittest.mock import Mock, patch, MagicMock
 
 import retry_workflow
@@ -31,9 +38,12 @@ class TestGitHubClient(unittest.TestCase):
             capture_output=True,
             text=True,
             check=True,
-            env={'GH_REPO': 'test-owner/test-repo'}
+            env={'GH_REPO': 'test-owner/test-repo'},
+            timeout=retry_workflow.DEFAULT_REQUEST_TIMEOUT
         )
         self.assertEqual(result, "test output")
+        self.assertEqual(client.stats.requests, 1)
+        self.assertEqual(client.stats.bytes_received, len("test output\n"))
 
     @patch('subprocess.run')
     @patch.dict('os.environ', {}, clear=True)
@@ -47,6 +57,96 @@ class TestGitHubClient(unittest.TestCase):
         with self.assertRaises(subprocess.CalledProcessError):
             client.run_command(["api", "test"])
 
+    @patch('subprocess.run')
+    def test_run_command_bounded_by_deadline(self, mock_run):
+        """Test request timeout never exceeds the remaining time budget"""
+        mock_run.return_value = Mock(stdout="ok")
+        policy = retry_workflow.RequestPolicy(timeout=5)
+
+        client = retry_workflow.GitHubClient("test-owner/test-repo", policy=policy)
+        client.run_command(["api", "test"])
+
+        self.assertLessEqual(mock_run.call_args[1]["timeout"], 5)
+
+    def test_run_command_deadline_exceeded(self):
+        """Test no request is issued once the deadline has passed"""
+        policy = retry_workflow.RequestPolicy(timeout=5)
+        policy.deadline.expires_at = 0
+
+        client = retry_workflow.GitHubClient("test-owner/test-repo", policy=policy)
+        with self.assertRaises(retry_workflow.DeadlineExceededError):
+            client.run_command(["api", "test"])
+
+    @patch('time.sleep')
+    @patch('subprocess.run')
+    def test_api_get_retries_transient_errors(self, mock_run, mock_sleep):
+        """Test GETs are retried on server errors and timeouts"""
+        mock_run.side_effect = [
+            subprocess.CalledProcessError(1, ["gh"], stderr="gh: Bad Gateway (HTTP 502)"),
+            subprocess.TimeoutExpired(["gh"], 60),
+            Mock(stdout="abc123\n"),
+        ]
+
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+        result = client.api_get("repos/test-owner/test-repo/commits/main", jq_filter=".sha")
+
+        self.assertEqual(result, "abc123")
+        self.assertEqual(mock_run.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @patch('time.sleep')
+    @patch('subprocess.run')
+    def test_api_get_no_retry_on_client_errors(self, mock_run, mock_sleep):
+        """Test GETs are not retried on client errors"""
+        mock_run.side_effect = subprocess.CalledProcessError(1, ["gh"], stderr="gh: Not Found (HTTP 404)")
+
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+        with self.assertRaises(subprocess.CalledProcessError):
+            client.api_get("repos/test-owner/test-repo/commits/main")
+
+        mock_run.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    @patch('subprocess.run')
+    def test_circuit_breaker_opens(self, mock_run):
+        """Test requests stop after consecutive transient failures"""
+        mock_run.side_effect = subprocess.CalledProcessError(1, ["gh"], stderr="HTTP 503")
+        policy = retry_workflow.RequestPolicy(
+            max_attempts=1, breaker=retry_workflow.CircuitBreaker(threshold=2, cooldown=60)
+        )
+        client = retry_workflow.GitHubClient("test-owner/test-repo", policy=policy)
+
+        for _ in range(2):
+            with self.assertRaises(subprocess.CalledProcessError):
+                client.run_command(["api", "test"])
+        with self.assertRaises(retry_workflow.CircuitOpenError):
+            client.run_command(["api", "test"])
+
+        self.assertEqual(mock_run.call_count, 2)
+
+    def test_hedged_request(self):
+        """Test a GET slower than the p95 latency is duplicated, first response wins"""
+        policy = retry_workflow.RequestPolicy(min_hedge_delay=0.05)
+        for _ in range(20):
+            policy.latency.record(0.01)
+        client = retry_workflow.GitHubClient("test-owner/test-repo", policy=policy)
+        slow = threading.Event()
+        calls = []
+
+        def run_command(args):
+            calls.append(args)
+            if len(calls) == 1:
+                slow.wait(5)
+                return "slow"
+            return "fast"
+
+        with patch.object(client, 'run_command', side_effect=run_command):
+            result = client.api_get("repos/test-owner/test-repo/commits/main")
+        slow.set()
+
+        self.assertEqual(result, "fast")
+        self.assertEqual(len(calls), 2)
+
     @patch.object(retry_workflow.GitHubClient, 'run_command')
     def test_api_get(self, mock_run_command):
         """Test API GET request"""
@@ -62,15 +162,97 @@ class TestGitHubClient(unittest.TestCase):
         ])
         self.assertEqual(result, "result")
 
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_api_get_pages_single_page(self, mock_api_get):
+        """Test a single page listing costs one request"""
+        mock_api_get.return_value = json.dumps({"total_count": 2, "jobs": [{"id": 1}, {"id": 2}]})
+
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+        items = client.api_get_pages("repos/test-owner/test-repo/actions/runs/1/jobs", "jobs")
+
+        self.assertEqual(items, [{"id": 1}, {"id": 2}])
+        mock_api_get.assert_called_once_with(
+            "repos/test-owner/test-repo/actions/runs/1/jobs?filter=latest&per_page=100&page=1", fresh=False
+        )
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_api_get_pages_fan_out(self, mock_api_get):
+        """Test remaining pages are computed from total_count and merged in order"""
+        def api_get(endpoint, fresh=False):
+            page = int(endpoint.rsplit("page=", 1)[1])
+            first = (page - 1) * 100
+            count = 100 if page < 3 else 50
+            return json.dumps({
+                "total_count": 250,
+                "workflow_runs": [{"id": i} for i in range(first, first + count)]
+            })
+        mock_api_get.side_effect = api_get
+
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+        items = client.api_get_pages("repos/test-owner/test-repo/actions/runs?head_sha=abc", "workflow_runs")
+
+        self.assertEqual([item["id"] for item in items], list(range(250)))
+        self.assertEqual(mock_api_get.call_count, 3)
+        self.assertEqual(
+            sorted(c[0][0] for c in mock_api_get.call_args_list),
+            [
+                f"repos/test-owner/test-repo/actions/runs?head_sha=abc&exclude_pull_requests=true&per_page=100&page={p}"
+                for p in (1, 2, 3)
+            ]
+        )
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    def test_api_get_conditional_modified(self, mock_run_command):
+        """Test conditional GET returning a new response"""
+        mock_run_command.return_value = (
+            'HTTP/2.0 200 OK\r\nEtag: W/"abc"\r\nContent-Type: application/json\r\n\r\n{"id": 1}'
+        )
+
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+        body, etag = client.api_get_conditional("repos/test-owner/test-repo/actions/runs/1", 'W/"old"')
+
+        self.assertEqual(body, '{"id": 1}')
+        self.assertEqual(etag, 'W/"abc"')
+        mock_run_command.assert_called_once_with([
+            "api", "repos/test-owner/test-repo/actions/runs/1", "--include",
+            "-H", 'If-None-Match: W/"old"'
+        ])
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    def test_api_get_conditional_not_modified(self, mock_run_command):
+        """Test conditional GET answered with 304"""
+        mock_run_command.side_effect = subprocess.CalledProcessError(
+            1, ["gh"], output='HTTP/2.0 304 Not Modified\r\nEtag: W/"abc"\r\n\r\n', stderr="gh: HTTP 304"
+        )
+
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+        body, etag = client.api_get_conditional("repos/test-owner/test-repo/actions/runs/1", 'W/"abc"')
+
+        self.assertIsNone(body)
+        self.assertEqual(etag, 'W/"abc"')
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    def test_api_get_conditional_error(self, mock_run_command):
+        """Test conditional GET errors other than 304 are raised"""
+        mock_run_command.side_effect = subprocess.CalledProcessError(
+            1, ["gh"], output='HTTP/2.0 404 Not Found\r\n\r\n', stderr="gh: HTTP 404"
+        )
+
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+        with self.assertRaises(subprocess.CalledProcessError):
+            client.api_get_conditional("repos/test-owner/test-repo/actions/runs/1")
+
     @patch.object(retry_workflow.GitHubClient, 'run_command')
     def test_api_post_success(self, mock_run_command):
         """Test successful API POST request"""
         mock_run_command.return_value = ""
 
         client = retry_workflow.GitHubClient("test-owner/test-repo")
-        result = client.api_post("repos/test-owner/test-repo/actions/runs/123/rerun")
+        result = client.api_post("repos/test-owner/test-repo/actions/runs/123/rerun", scope="workflow")
+        client.api_post("repos/test-owner/test-repo/actions/runs/123/cancel")
 
         self.assertTrue(result)
+        self.assertEqual([c[1]["scope"] for c in mock_run_command.call_args_list], ["workflow", None])
 
     @patch.object(retry_workflow.GitHubClient, 'run_command')
     def test_api_post_failure(self, mock_run_command):
@@ -85,6 +267,644 @@ class TestGitHubClient(unittest.TestCase):
         self.assertFalse(result)
 
 
+class TestResponseCache(unittest.TestCase):
+    """Test ResponseCache class and GET memoization"""
+
+    def test_normalize_endpoint(self):
+        """Test equivalent endpoints are normalized the same way"""
+        self.assertEqual(
+            retry_workflow.normalize_endpoint("/repos/o/r/actions/runs?head_sha=abc&branch=main"),
+            retry_workflow.normalize_endpoint("repos/o/r/actions/runs?branch=main&head_sha=abc")
+        )
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    def test_api_get_memoized(self, mock_run_command):
+        """Test identical GETs are issued once, fresh GETs always"""
+        mock_run_command.return_value = "abc123"
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+
+        client.api_get("repos/test-owner/test-repo/commits/main", jq_filter=".sha")
+        result = client.api_get("/repos/test-owner/test-repo/commits/main", jq_filter=".sha")
+        client.api_get("repos/test-owner/test-repo/commits/main", jq_filter=".sha", fresh=True)
+
+        self.assertEqual(result, "abc123")
+        self.assertEqual(mock_run_command.call_count, 2)
+        self.assertEqual(client.cache.hits, 1)
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    def test_api_get_shared_between_clients(self, mock_run_command):
+        """Test clients sharing a cache share their responses"""
+        mock_run_command.return_value = "abc123"
+        cache = retry_workflow.ResponseCache()
+
+        retry_workflow.GitHubClient("o/r", cache).api_get("repos/o/r/commits/main")
+        retry_workflow.GitHubClient("o/r", cache).api_get("repos/o/r/commits/main")
+
+        mock_run_command.assert_called_once()
+
+    def test_concurrent_requests_coalesced(self):
+        """Test concurrent identical requests share one in-flight call"""
+        cache = retry_workflow.ResponseCache()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_fetch(("key",), fetch)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for _ in range(500):
+            if cache.hits == 4:
+                break
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 5)
+
+    def test_failure_not_cached(self):
+        """Test failed fetches are raised and retried on next call"""
+        cache = retry_workflow.ResponseCache()
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            cache.get_or_fetch(("key",), Mock(side_effect=subprocess.CalledProcessError(1, ["gh"])))
+
+        self.assertEqual(cache.get_or_fetch(("key",), lambda: "value"), "value")
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    def test_post_invalidates_run(self, mock_run_command):
+        """Test a POST on a run drops the cached responses about that run only"""
+        mock_run_command.return_value = "{}"
+        client = retry_workflow.GitHubClient("o/r")
+        client.api_get("repos/o/r/actions/runs/12/jobs?page=1")
+        client.api_get("repos/o/r/actions/runs/123/jobs?page=1")
+        client.api_get("repos/o/r/actions/runs/12")
+
+        client.api_post("repos/o/r/actions/runs/12/rerun-failed-jobs")
+        client.api_get("repos/o/r/actions/runs/12/jobs?page=1")
+        client.api_get("repos/o/r/actions/runs/123/jobs?page=1")
+        client.api_get("repos/o/r/actions/runs/12")
+
+        # 3 initial GETs, 1 POST, 2 GETs about run 12 again
+        self.assertEqual(mock_run_command.call_count, 6)
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    def test_post_invalidates_snapshot(self, mock_run_command):
+        """Test a rerun drops the snapshot of the commit of the run, not the other ones"""
+        def run_command(args, scope=None):
+            if "POST" in args:
+                return ""
+            run_id = 12 if "head_sha=abc" in args[-1] else 13
+            return json.dumps({"total_count": 1, "workflow_runs": [
+                {"id": run_id, "name": "CI", "status": "completed", "conclusion": "failure"}
+            ]})
+        mock_run_command.side_effect = run_command
+        client = retry_workflow.GitHubClient("o/r")
+        retry_workflow.CommitSnapshot.get(client, "main", "abc")
+        retry_workflow.CommitSnapshot.get(client, "main", "def")
+
+        client.api_post("repos/o/r/actions/runs/12/rerun-failed-jobs", scope="workflow")
+        retry_workflow.CommitSnapshot.get(client, "main", "abc")
+        retry_workflow.CommitSnapshot.get(client, "main", "def")
+
+        listed = [c[0][0][-1] for c in mock_run_command.call_args_list if "POST" not in c[0][0]]
+        self.assertEqual(len(listed), 3)
+        self.assertIn("head_sha=abc", listed[-1])
+
+
+class TestCassette(unittest.TestCase):
+    """Test RecordingTransport and ReplayTransport classes"""
+
+    class FakeGitHub(retry_workflow.SubprocessTransport):
+        """Answers the requests of a failed run to retry, like gh would"""
+
+        def __init__(self):
+            self.commands = []
+
+        def run(self, cmd, env, timeout):
+            self.commands.append(cmd)
+            command = " ".join(cmd)
+            if "POST" in command:
+                return ""
+            if "/commits/main" in command:
+                return "abc123\n"
+            if "/jobs?" in command:
+                return json.dumps({"total_count": 1, "jobs": [
+                    {"id": 1, "name": "Build", "status": "completed", "conclusion": "failure", "steps": []}
+                ]})
+            if "actions/runs?" in command:
+                return json.dumps({"total_count": 1, "workflow_runs": [
+                    {"id": 42, "name": "Test Workflow", "path": ".github/workflows/test.yaml",
+                     "status": "completed", "conclusion": "failure", "run_attempt": 1, "head_sha": "abc123"}
+                ]})
+            if "actions/runs/42" in command:
+                return "1\n"
+            raise subprocess.CalledProcessError(1, cmd, output="", stderr="gh: Not Found (HTTP 404)")
+
+    def _execute(self, transport):
+        manager = retry_workflow.WorkflowRetryManager(
+            repo="test-owner/test-repo",
+            branch="main",
+            workflow_name="Test Workflow",
+            client_options={"transport": transport, "policy": retry_workflow.RequestPolicy(hedge=False)}
+        )
+        return manager.execute_retry_logic()
+
+    def test_record_and_replay(self):
+        """Test a recorded decision is replayed identically without running gh"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cassette = os.path.join(tmpdir, "incident.jsonl.gz")
+            fake = self.FakeGitHub()
+            recorder = retry_workflow.RecordingTransport(cassette, fake)
+            recorded = self._execute(recorder)
+            recorder.close()
+
+            with patch('subprocess.run') as mock_run:
+                replayed = self._execute(retry_workflow.ReplayTransport(cassette))
+
+            with retry_workflow.gzip.open(cassette, "rt") as f:
+                entries = [json.loads(line) for line in f]
+
+        self.assertTrue(recorded["was_retried"])
+        self.assertEqual(replayed, recorded)
+        mock_run.assert_not_called()
+        self.assertEqual(len(entries), len(fake.commands))
+        self.assertEqual(entries[0]["repo"], "test-owner/test-repo")
+        self.assertIn("seconds", entries[0])
+        self.assertTrue(entries[-1]["cmd"][-1].endswith("/rerun-failed-jobs"))
+
+    def test_replay_errors_and_repeats(self):
+        """Test recorded errors are raised again and the last response is repeated"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cassette = os.path.join(tmpdir, "cassette.jsonl")
+            with open(cassette, "w") as f:
+                for entry in (
+                    {"repo": "o/r", "cmd": ["gh", "api", "a"], "returncode": 1, "stdout": "", "stderr": "HTTP 502", "seconds": 0.1},
+                    {"repo": "o/r", "cmd": ["gh", "api", "a"], "returncode": 0, "stdout": "ok", "seconds": 0.2},
+                ):
+                    f.write(json.dumps(entry) + "\n")
+
+            replay = retry_workflow.ReplayTransport(cassette, speed=10)
+            env = {"GH_REPO": "o/r"}
+            with patch('time.sleep') as mock_sleep:
+                with self.assertRaises(subprocess.CalledProcessError) as error:
+                    replay.run(["gh", "api", "a"], env, 60)
+                self.assertEqual(replay.run(["gh", "api", "a"], env, 60), "ok")
+                self.assertEqual(replay.run(["gh", "api", "a"], env, 60), "ok")
+
+        self.assertEqual(error.exception.stderr, "HTTP 502")
+        self.assertAlmostEqual(mock_sleep.call_args_list[0][0][0], 0.01)
+        with self.assertRaises(KeyError):
+            replay.run(["gh", "api", "b"], env, 60)
+
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get_conditional')
+    def test_replay_clock(self, mock_get):
+        """Test replayed waits move the client clock without waiting, or faster with a speed"""
+        mock_get.return_value = (json.dumps({"run_attempt": 2, "status": "in_progress"}), None)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cassette = os.path.join(tmpdir, "cassette.jsonl")
+            with open(cassette, "w") as f:
+                f.write(json.dumps({"now": 1700000000.0}) + "\n")
+            client = retry_workflow.GitHubClient("o/r", transport=retry_workflow.ReplayTransport(cassette))
+            fast = retry_workflow.ReplayTransport(cassette, speed=10)
+
+        with patch('time.sleep') as mock_sleep:
+            started = client.monotonic()
+            run_data = retry_workflow.WorkflowRun(client, {"id": 1}).wait_for_attempt(2, timeout=600, poll_interval=10)
+            mock_sleep.assert_not_called()
+            fast.sleep(30)
+
+        self.assertIsNone(run_data)
+        self.assertGreaterEqual(client.monotonic() - started, 600)
+        self.assertEqual(client.now(), 1700000000.0)
+        mock_sleep.assert_called_once_with(3.0)
+
+    def test_record_and_replay_dispatch_marker(self):
+        """Test a replayed dispatch sends the recorded marker and finds the recorded run"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cassette = os.path.join(tmpdir, "cassette.jsonl")
+            recorder = retry_workflow.RecordingTransport(cassette, retry_workflow.SubprocessTransport())
+            recorded = retry_workflow.WorkflowDispatch(
+                retry_workflow.GitHubClient("o/r", transport=recorder), "nightly.yaml", "main",
+                correlation_input="correlation_id"
+            )
+            recorder.close()
+
+            replay = retry_workflow.ReplayTransport(cassette)
+            client = retry_workflow.GitHubClient("o/r", transport=replay)
+            replayed = retry_workflow.WorkflowDispatch(client, "nightly.yaml", "main", correlation_input="correlation_id")
+            other = retry_workflow.WorkflowDispatch(client, "nightly.yaml", "main", correlation_input="correlation_id")
+
+        self.assertEqual(replayed.inputs, {"correlation_id": recorded.marker})
+        self.assertNotEqual(other.marker, recorded.marker)
+        self.assertRegex(other.marker, r"^[0-9a-f]{12}$")
+
+    def test_replay_clock_policy(self):
+        """Test skipped replay waits expire the deadline and close the circuit breaker"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cassette = os.path.join(tmpdir, "cassette.jsonl")
+            open(cassette, "w").close()
+            replay = retry_workflow.ReplayTransport(cassette)
+        policy = retry_workflow.RequestPolicy(timeout=60, clock=replay.monotonic)
+        policy.breaker = retry_workflow.CircuitBreaker(threshold=1, cooldown=30, clock=replay.monotonic)
+
+        policy.breaker.record_failure()
+        with self.assertRaises(retry_workflow.CircuitOpenError):
+            policy.breaker.check()
+        with patch('time.sleep') as mock_sleep:
+            replay.sleep(45)
+        policy.breaker.check()
+        self.assertLessEqual(policy.timeout_for_request(), 15)
+        replay.sleep(15)
+        with self.assertRaises(retry_workflow.DeadlineExceededError):
+            policy.timeout_for_request()
+        mock_sleep.assert_not_called()
+
+    def test_record_and_replay_app_requests(self):
+        """Test App requests are recorded without tokens and replayed with their errors"""
+        class FakeHttp(retry_workflow.SubprocessTransport):
+            def request(self, method, url, headers, timeout):
+                if "/orgs/" in url:
+                    raise urllib.error.HTTPError(url, 404, "Not Found", None, None)
+                return json.dumps({"token": "ghs_secret", "expires_at": "2030-01-01T00:00:00Z"})
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cassette = os.path.join(tmpdir, "cassette.jsonl")
+            recorder = retry_workflow.RecordingTransport(cassette, FakeHttp())
+            with self.assertRaises(urllib.error.HTTPError):
+                recorder.request("GET", "https://api.github.com/orgs/o/installation", {"Authorization": "Bearer jwt"}, 60)
+            body = recorder.request("POST", "https://api.github.com/app/installations/1/access_tokens", {}, 60)
+            recorder.close()
+            with open(cassette) as f:
+                content = f.read()
+
+            replay = retry_workflow.ReplayTransport(cassette)
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                replay.request("GET", "https://api.github.com/orgs/o/installation", {}, 60)
+            replayed = replay.request("POST", "https://api.github.com/app/installations/1/access_tokens", {}, 60)
+
+        self.assertIn("ghs_secret", body)
+        self.assertNotIn("ghs_secret", content)
+        self.assertNotIn("jwt", content)
+        self.assertEqual(error.exception.code, 404)
+        self.assertEqual(json.loads(replayed)["token"], "***")
+
+    def test_record_and_replay_app_request_failures(self):
+        """Test App requests failing without an HTTP status are replayed with their error"""
+        class FailingHttp(retry_workflow.SubprocessTransport):
+            def request(self, method, url, headers, timeout):
+                if "/orgs/" in url:
+                    raise urllib.error.URLError("connection refused")
+                if "/users/" in url:
+                    raise TimeoutError("timed out")
+                return "<html>"
+
+        urls = [f"https://api.github.com/{path}" for path in ("orgs/o/installation", "users/o/installation", "app")]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cassette = os.path.join(tmpdir, "cassette.jsonl")
+            recorder = retry_workflow.RecordingTransport(cassette, FailingHttp())
+            for url, error in zip(urls, (urllib.error.URLError, TimeoutError, ValueError)):
+                with self.assertRaises(error):
+                    recorder.request("GET", url, {}, 60)
+            recorder.close()
+
+            replay = retry_workflow.ReplayTransport(cassette)
+            with self.assertRaises(urllib.error.URLError) as error:
+                replay.request("GET", urls[0], {}, 60)
+            with self.assertRaises(TimeoutError):
+                replay.request("GET", urls[1], {}, 60)
+            with self.assertRaises(ValueError):
+                replay.request("GET", urls[2], {}, 60)
+
+        self.assertIn("connection refused", str(error.exception))
+
+    def test_isolate_state_files(self):
+        """Test replays work on copies of the state files recorded with the cassette"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lock_file = os.path.join(tmpdir, "locks.json")
+            state = {"locks": {"o/r#1#1": retry_workflow.time.time()}}
+            with open(lock_file, "w") as f:
+                json.dump(state, f)
+            args = argparse.Namespace(
+                deferred_queue_file=os.path.join(tmpdir, "queue.json"), retry_lock_file=lock_file,
+                rerun_quota_file=None, history_memo_file=None
+            )
+            snapshot = retry_workflow.state_snapshot_directory(os.path.join(tmpdir, "cassette.jsonl"))
+            retry_workflow.snapshot_state_files(args, snapshot)
+
+            # The state changes between the recording and the replay
+            with open(lock_file, "w") as f:
+                json.dump({"locks": {"o/r#2#1": retry_workflow.time.time()}}, f)
+            copies = os.path.join(tmpdir, "copies")
+            os.mkdir(copies)
+            retry_workflow.isolate_state_files(args, snapshot, copies)
+            lock = retry_workflow.FileRetryLock(args.retry_lock_file)
+            self.assertFalse(lock.acquire("o/r#1#1"))
+            self.assertTrue(lock.acquire("o/r#2#1"))
+            retry_workflow.DeferredRetryQueue(args.deferred_queue_file).add("o/r", 2, 1, "all")
+
+            with open(lock_file) as f:
+                self.assertEqual(list(json.load(f)["locks"]), ["o/r#2#1"])
+            self.assertEqual(os.listdir(snapshot), ["retry_lock_file.json"])
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, "queue.json")))
+            self.assertTrue(args.retry_lock_file.startswith(copies))
+            self.assertIsNone(args.rerun_quota_file)
+
+
+class TestTokenPool(unittest.TestCase):
+    """Test TokenPool class"""
+
+    @staticmethod
+    def _rate_limit_response(remaining, scopes=None):
+        headers = "HTTP/2.0 200 OK\r\nContent-Type: application/json"
+        if scopes is not None:
+            headers += f"\r\nX-Oauth-Scopes: {scopes}"
+        body = json.dumps({"resources": {"core": {"remaining": remaining, "reset": 2000000000}}})
+        return Mock(stdout=f"{headers}\r\n\r\n{body}")
+
+    def _pool(self, *credentials):
+        pool = retry_workflow.TokenPool(list(credentials))
+        for credential in credentials:
+            credential.checked_at = retry_workflow.time.time()
+        return pool
+
+    def test_select_most_headroom(self):
+        """Test the credential with the most remaining requests is selected"""
+        low = retry_workflow.Credential("token-a", "a")
+        high = retry_workflow.Credential("token-b", "b")
+        low.remaining, high.remaining = 10, 4000
+        pool = self._pool(low, high)
+
+        self.assertIs(pool.select("owner/repo"), high)
+        self.assertEqual(high.remaining, 3999)
+
+    def test_select_repo_access(self):
+        """Test credentials without access to the repository are skipped"""
+        other = retry_workflow.Credential("token-a", "a", repos=["other-org/*"])
+        owner = retry_workflow.Credential("token-b", "b", repos=["owner/*"])
+        other.remaining, owner.remaining = 5000, 100
+        pool = self._pool(other, owner)
+
+        self.assertIs(pool.select("owner/repo"), owner)
+        with self.assertRaises(retry_workflow.NoCredentialError):
+            pool.select("third/repo")
+
+    def test_select_scope(self):
+        """Test requests requiring a scope are pinned to credentials having it"""
+        read_only = retry_workflow.Credential("token-a", "a", scopes=frozenset({"repo"}))
+        workflow = retry_workflow.Credential("token-b", "b", scopes=frozenset({"repo", "workflow"}))
+        read_only.remaining, workflow.remaining = 5000, 100
+        pool = self._pool(read_only, workflow)
+
+        self.assertIs(pool.select("owner/repo", scope="workflow"), workflow)
+        self.assertIs(pool.select("owner/repo"), read_only)
+
+    def test_select_all_rate_limited(self):
+        """Test an error is raised when all credentials are exhausted"""
+        credential = retry_workflow.Credential("token-a", "a")
+        credential.remaining = 0
+        credential.reset_at = retry_workflow.time.time() + 600
+        pool = self._pool(credential)
+
+        with self.assertRaises(retry_workflow.NoCredentialError):
+            pool.select("owner/repo")
+
+    @patch('subprocess.run')
+    def test_refresh(self, mock_run):
+        """Test rate limit and scopes are read with the credential token"""
+        mock_run.return_value = self._rate_limit_response(4200, "repo, workflow")
+        credential = retry_workflow.Credential("token-a", "a")
+        pool = retry_workflow.TokenPool([credential])
+
+        self.assertIs(pool.select("owner/repo", scope="workflow"), credential)
+
+        self.assertEqual(mock_run.call_args[0][0], ["gh", "api", "--include", "rate_limit"])
+        self.assertEqual(mock_run.call_args[1]["env"]["GH_TOKEN"], "token-a")
+        self.assertEqual(credential.remaining, 4199)
+        self.assertEqual(credential.scopes, frozenset({"repo", "workflow"}))
+
+    def test_refresh_through_client(self):
+        """Test rate limits are read through the transport and policy of the client"""
+        credential = retry_workflow.Credential("token-a", "a")
+        pool = retry_workflow.TokenPool([credential])
+        transport = Mock()
+        transport.run.side_effect = [self._rate_limit_response(4200).stdout, "ok"]
+        transport.monotonic.return_value = 0.0
+        client = retry_workflow.GitHubClient("owner/repo", tokens=pool, transport=transport)
+
+        self.assertEqual(client.api_get("repos/owner/repo"), "ok")
+
+        cmd, env, _ = transport.run.call_args_list[0][0]
+        self.assertEqual(cmd, ["gh", "api", "--include", "rate_limit"])
+        self.assertEqual(env["GH_TOKEN"], "token-a")
+        self.assertEqual(client.stats.requests, 2)
+        self.assertEqual(credential.remaining, 4199)
+
+    @patch('subprocess.run')
+    def test_refresh_rate_limiting_disabled(self, mock_run):
+        """Test credentials are unlimited when the rate_limit endpoint does not exist"""
+        mock_run.side_effect = subprocess.CalledProcessError(
+            1, ["gh"], output="HTTP/2.0 404 Not Found\r\n\r\n{}", stderr="gh: Not Found (HTTP 404)"
+        )
+        credential = retry_workflow.Credential("token-a", "a")
+        pool = retry_workflow.TokenPool([credential])
+
+        self.assertIs(pool.select("owner/repo"), credential)
+        self.assertGreater(credential.headroom(), 1000000)
+
+    @patch.dict(os.environ, {"TOKEN_A": "secret-a"})
+    def test_from_file(self):
+        """Test loading credentials from a tokens file"""
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump([
+                {"token_env": "TOKEN_A", "repos": ["owner/*"], "scopes": ["workflow"]},
+                {"name": "bot", "token": "secret-b"}
+            ], f)
+        self.addCleanup(os.unlink, f.name)
+
+        pool = retry_workflow.TokenPool.from_file(f.name)
+
+        first, second = pool.credentials
+        self.assertEqual((first.name, first.token, first.repos), ("TOKEN_A", "secret-a", ["owner/*"]))
+        self.assertEqual(first.scopes, frozenset({"workflow"}))
+        self.assertEqual((second.name, second.token, second.repos, second.scopes), ("bot", "secret-b", None, None))
+
+    @patch('subprocess.run')
+    def test_client_switches_rate_limited_credential(self, mock_run):
+        """Test a request rejected by the rate limit is sent with another credential"""
+        mock_run.side_effect = [
+            subprocess.CalledProcessError(1, ["gh"], stderr="gh: API rate limit exceeded (HTTP 403)"),
+            Mock(stdout="ok"),
+        ]
+        first = retry_workflow.Credential("token-a", "a")
+        second = retry_workflow.Credential("token-b", "b")
+        first.remaining, second.remaining = 5000, 4000
+        pool = self._pool(first, second)
+
+        client = retry_workflow.GitHubClient("owner/repo", tokens=pool)
+        self.assertTrue(client.api_post("repos/owner/repo/actions/runs/1/rerun"))
+
+        tokens = [c[1]["env"]["GH_TOKEN"] for c in mock_run.call_args_list]
+        self.assertEqual(tokens, ["token-a", "token-b"])
+        self.assertEqual(first.remaining, 0)
+
+
+class TestGitHubAppAuth(unittest.TestCase):
+    """Test GitHubAppAuth class"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache_file = os.path.join(self.tmpdir.name, "app-tokens.json")
+
+    @staticmethod
+    def _token_response(token, expires_at="2099-01-01T00:00:00Z", actions="write"):
+        return {"token": token, "expires_at": expires_at, "permissions": {"actions": actions}}
+
+    @patch('subprocess.run')
+    def test_create_jwt(self, mock_run):
+        """Test the JWT is signed with openssl using the App private key"""
+        mock_run.return_value = Mock(stdout=b"signature")
+        auth = retry_workflow.GitHubAppAuth("12345", "PRIVATE KEY")
+
+        jwt = auth.create_jwt()
+
+        header, payload, signature = jwt.split(".")
+        claims = json.loads(retry_workflow.base64.urlsafe_b64decode(payload + "=="))
+        self.assertEqual(claims["iss"], "12345")
+        self.assertLessEqual(claims["exp"] - claims["iat"], 600)
+        self.assertEqual(signature, "c2lnbmF0dXJl")
+        cmd = mock_run.call_args[0][0]
+        self.assertEqual(cmd[:4], ["openssl", "dgst", "-sha256", "-sign"])
+        self.assertEqual(mock_run.call_args[1]["input"], f"{header}.{payload}".encode())
+        self.assertFalse(os.path.exists(cmd[4]))
+
+    @patch.object(retry_workflow.GitHubAppAuth, 'create_jwt', return_value="jwt")
+    @patch.object(retry_workflow.GitHubAppAuth, '_request')
+    def test_installation_token_looked_up_and_cached(self, mock_request, mock_jwt):
+        """Test the installation is found by owner and its token reused across invocations"""
+        mock_request.side_effect = [
+            urllib.error.HTTPError("url", 404, "Not Found", {}, None),
+            {"id": 2, "account": {"login": "owner"}},
+            self._token_response("ghs_1"),
+        ]
+
+        auth = retry_workflow.GitHubAppAuth("12345", "key", self.cache_file)
+        entry = auth.installation_token("owner")
+        self.assertEqual(entry["token"], "ghs_1")
+        self.assertEqual(
+            [c[0][:2] for c in mock_request.call_args_list],
+            [("GET", "/orgs/owner/installation"), ("GET", "/users/owner/installation"),
+             ("POST", "/app/installations/2/access_tokens")]
+        )
+        self.assertEqual(os.stat(self.cache_file).st_mode & 0o777, 0o600)
+
+        # Another invocation reads the token from the cache file
+        other = retry_workflow.GitHubAppAuth("12345", "key", self.cache_file)
+        self.assertEqual(other.installation_token("owner")["token"], "ghs_1")
+        self.assertEqual(mock_request.call_count, 3)
+        mock_jwt.assert_called_once()
+
+    @patch.object(retry_workflow.GitHubAppAuth, 'create_jwt', return_value="jwt")
+    @patch.object(retry_workflow.GitHubAppAuth, '_request')
+    def test_installation_token_renewed_before_expiry(self, mock_request, mock_jwt):
+        """Test a token about to expire is replaced"""
+        soon = retry_workflow.time.strftime("%Y-%m-%dT%H:%M:%SZ", retry_workflow.time.gmtime(retry_workflow.time.time() + 60))
+        mock_request.side_effect = [
+            self._token_response("ghs_1", soon),
+            self._token_response("ghs_2"),
+        ]
+
+        auth = retry_workflow.GitHubAppAuth("12345", "key", expiry_margin=300)
+        self.assertEqual(auth.installation_token("owner", installation_id=7)["token"], "ghs_1")
+        self.assertEqual(auth.installation_token("owner", installation_id=7)["token"], "ghs_2")
+
+    @patch.object(retry_workflow.GitHubAppAuth, 'installation_token')
+    def test_installation_credential(self, mock_token):
+        """Test App installations are scoped to their owner and actions permission"""
+        mock_token.return_value = self._token_response("ghs_1", actions="read")
+        auth = retry_workflow.GitHubAppAuth("12345", "key")
+        credential = retry_workflow.AppInstallationCredential(auth, "owner")
+        mock_token.assert_not_called()
+
+        self.assertEqual(credential.current_token(), "ghs_1")
+        self.assertEqual(credential.token, "ghs_1")
+        self.assertTrue(credential.can_access("owner/repo"))
+        self.assertFalse(credential.can_access("other/repo"))
+        self.assertFalse(credential.has_scope("workflow"))
+
+    def test_pool_adds_installation_per_owner(self):
+        """Test the pool adds the App installation of each repository owner once"""
+        auth = retry_workflow.GitHubAppAuth("12345", "key")
+        pool = retry_workflow.TokenPool([], apps=[auth])
+
+        with patch.object(pool, 'refresh') as mock_refresh:
+            mock_refresh.side_effect = lambda c, run=None: setattr(c, "remaining", 100)
+            first = pool.select("owner/repo")
+            second = pool.select("owner/other-repo")
+            third = pool.select("other/repo")
+
+        self.assertIs(first, second)
+        self.assertEqual(third.owner, "other")
+        self.assertEqual(len(pool.credentials), 2)
+
+
+class TestRequestShaper(unittest.TestCase):
+    """Test RequestShaper class"""
+
+    def test_shape_jobs(self):
+        """Test jobs listings only return the latest attempt, 100 per page"""
+        self.assertEqual(
+            retry_workflow.RequestShaper.shape("repos/o/r/actions/runs/1/jobs", "jobs"),
+            "repos/o/r/actions/runs/1/jobs?filter=latest&per_page=100"
+        )
+
+    def test_shape_attempt_jobs(self):
+        """Test jobs of a given attempt are not filtered"""
+        self.assertEqual(
+            retry_workflow.RequestShaper.shape("repos/o/r/actions/runs/1/attempts/2/jobs", "jobs"),
+            "repos/o/r/actions/runs/1/attempts/2/jobs?per_page=100"
+        )
+
+    def test_shape_keeps_existing_parameters(self):
+        """Test parameters of the caller are kept"""
+        self.assertEqual(
+            retry_workflow.RequestShaper.shape(
+                "repos/o/r/actions/runs?branch=feature/x&exclude_pull_requests=false&per_page=5",
+                "workflow_runs"
+            ),
+            "repos/o/r/actions/runs?branch=feature/x&exclude_pull_requests=false&per_page=100"
+        )
+
+    def test_project_job(self):
+        """Test jobs and their steps are trimmed to used fields"""
+        job = {
+            "id": 1, "name": "Build", "status": "completed", "conclusion": "failure",
+            "runner_name": "runner-1", "labels": ["self-hosted"], "html_url": "https://...",
+            "steps": [{"name": "Test", "status": "completed", "conclusion": "failure", "number": 3}]
+        }
+
+        self.assertEqual(retry_workflow.RequestShaper.project("jobs", job), {
+            "id": 1, "name": "Build", "status": "completed", "conclusion": "failure",
+            "steps": [{"name": "Test", "status": "completed", "conclusion": "failure"}]
+        })
+
+    def test_project_unknown(self):
+        """Test unknown lists are not projected"""
+        item = {"id": 1, "anything": True}
+        self.assertEqual(retry_workflow.RequestShaper.project("repositories", item), item)
+
+
 class TestWorkflowStep(unittest.TestCase):
     """Test WorkflowStep class"""
 
@@ -132,6 +952,39 @@ class TestWorkflowJob(unittest.TestCase):
         })
         self.assertFalse(job.is_failed())
 
+    def test_duration_minutes(self):
+        """Test job duration is rounded up to whole minutes"""
+        job = retry_workflow.WorkflowJob({
+            "id": 123,
+            "name": "Test Job",
+            "started_at": "2025-12-05T10:00:00Z",
+            "completed_at": "2025-12-05T10:04:01Z",
+            "steps": []
+        })
+        self.assertEqual(job.duration_minutes(), 5)
+
+    def test_duration_minutes_not_started(self):
+        """Test job without timestamps has no duration"""
+        job = retry_workflow.WorkflowJob({"id": 123, "name": "Test Job", "steps": []})
+        self.assertEqual(job.duration_minutes(), 0)
+
+    def test_queue_and_execution_seconds(self):
+        """Test job queue and execution times"""
+        job = retry_workflow.WorkflowJob({
+            "id": 123,
+            "name": "Test Job",
+            "created_at": "2025-12-05T10:00:00Z",
+            "started_at": "2025-12-05T10:02:30Z",
+            "completed_at": "2025-12-05T10:04:00Z",
+            "steps": []
+        })
+        self.assertEqual(job.queue_seconds(), 150)
+        self.assertEqual(job.execution_seconds(), 90)
+
+        queued = retry_workflow.WorkflowJob({"id": 124, "created_at": "2025-12-05T10:00:00Z"})
+        self.assertIsNone(queued.queue_seconds())
+        self.assertIsNone(queued.execution_seconds())
+
     def test_has_failed_step_found(self):
         """Test finding a failed step"""
         job = retry_workflow.WorkflowJob({
@@ -163,6 +1016,38 @@ class TestWorkflowJob(unittest.TestCase):
         self.assertIsNone(result)
 
 
+class TestFailureFingerprint(unittest.TestCase):
+    """Test failure_fingerprint function"""
+
+    def test_fingerprint_failed_steps_and_jobs(self):
+        """Test fingerprint includes failed steps and step-less job failures"""
+        jobs = [
+            retry_workflow.WorkflowJob({
+                "id": 1, "name": "Build", "conclusion": "failure", "status": "completed",
+                "steps": [
+                    {"name": "Compile", "conclusion": "success", "status": "completed"},
+                    {"name": "Test", "conclusion": "failure", "status": "completed"}
+                ]
+            }),
+            retry_workflow.WorkflowJob({
+                "id": 2, "name": "Lint", "conclusion": "timed_out", "status": "completed",
+                "steps": []
+            }),
+            retry_workflow.WorkflowJob({
+                "id": 3, "name": "Docs", "conclusion": "success", "status": "completed",
+                "steps": []
+            })
+        ]
+
+        result = retry_workflow.failure_fingerprint(jobs)
+
+        self.assertEqual(result, frozenset({("Build", "Test"), ("Lint", None)}))
+
+    def test_fingerprint_no_failures(self):
+        """Test fingerprint is empty when nothing failed"""
+        self.assertEqual(retry_workflow.failure_fingerprint([]), frozenset())
+
+
 class TestWorkflowRun(unittest.TestCase):
     """Test WorkflowRun class"""
 
@@ -178,6 +1063,58 @@ class TestWorkflowRun(unittest.TestCase):
             "path": ".github/workflows/test.yaml"
         }
 
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_describe(self, mock_api_get):
+        """Test the description only uses data already fetched"""
+        workflow_run = retry_workflow.WorkflowRun(self.client, dict(self.run_data, run_attempt=2))
+        self.assertEqual(workflow_run.describe(), {"attempt": 2})
+
+        mock_api_get.return_value = json.dumps({"total_count": 2, "jobs": [
+            {"id": 1, "name": "Build", "status": "completed", "conclusion": "success", "steps": []},
+            {"id": 2, "name": "Test", "status": "completed", "conclusion": "failure", "steps": [
+                {"name": "Unit", "status": "completed", "conclusion": "failure"}
+            ]},
+        ]})
+        workflow_run.jobs
+
+        self.assertEqual(workflow_run.describe(), {"attempt": 2, "failures": [{"job": "Test", "step": "Unit"}]})
+        mock_api_get.assert_called_once()
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_timings(self, mock_api_get):
+        """Test run timings come from the data already fetched"""
+        workflow_run = retry_workflow.WorkflowRun(self.client, dict(
+            self.run_data,
+            conclusion="success",
+            run_attempt=2,
+            run_started_at="2025-12-05T10:30:00Z",
+            updated_at="2025-12-05T10:45:00Z"
+        ))
+        self.assertEqual(workflow_run.timings(), {
+            "retry_overhead_seconds": 1800,
+            "time_to_green_seconds": 2700
+        })
+
+        mock_api_get.return_value = json.dumps({"total_count": 3, "jobs": [
+            {"id": 1, "name": "Build", "created_at": "2025-12-05T10:30:00Z",
+             "started_at": "2025-12-05T10:30:10Z", "completed_at": "2025-12-05T10:35:10Z"},
+            {"id": 2, "name": "Test", "created_at": "2025-12-05T10:35:10Z",
+             "started_at": "2025-12-05T10:36:10Z", "completed_at": "2025-12-05T10:44:10Z"},
+            {"id": 3, "name": "Skipped", "conclusion": "skipped"},
+        ]})
+        workflow_run.jobs
+        timings = workflow_run.timings()
+
+        mock_api_get.assert_called_once()
+        self.assertEqual(timings["queue_seconds"], 70)
+        self.assertEqual(timings["max_queue_seconds"], 60)
+        self.assertEqual(timings["execution_seconds"], 780)
+        self.assertEqual(timings["jobs"], [
+            {"name": "Build", "queue_seconds": 10, "execution_seconds": 300},
+            {"name": "Test", "queue_seconds": 60, "execution_seconds": 480},
+        ])
+        self.assertEqual(workflow_run.describe()["timings"], timings)
+
     def test_is_failed_true(self):
         """Test workflow run that failed"""
         workflow_run = retry_workflow.WorkflowRun(self.client, self.run_data)
@@ -215,7 +1152,7 @@ class TestWorkflowRun(unittest.TestCase):
         """Test fetching jobs"""
         job1 = {"id": 1, "name": "Job 1", "conclusion": "success", "status": "completed", "steps": []}
         job2 = {"id": 2, "name": "Job 2", "conclusion": "failure", "status": "completed", "steps": []}
-        mock_api_get.return_value = f"{json.dumps(job1)}\n{json.dumps(job2)}"
+        mock_api_get.return_value = json.dumps({"total_count": 2, "jobs": [job1, job2]})
 
         workflow_run = retry_workflow.WorkflowRun(self.client, self.run_data)
         jobs = workflow_run.jobs
@@ -234,7 +1171,7 @@ class TestWorkflowRun(unittest.TestCase):
 
         self.assertTrue(result)
         mock_api_post.assert_called_once_with(
-            "repos/test-owner/test-repo/actions/runs/123/rerun"
+            "repos/test-owner/test-repo/actions/runs/123/rerun", scope="workflow"
         )
 
     @patch.object(retry_workflow.GitHubClient, 'api_post')
@@ -247,9 +1184,109 @@ class TestWorkflowRun(unittest.TestCase):
 
         self.assertTrue(result)
         mock_api_post.assert_called_once_with(
-            "repos/test-owner/test-repo/actions/runs/123/rerun-failed-jobs"
+            "repos/test-owner/test-repo/actions/runs/123/rerun-failed-jobs", scope="workflow"
+        )
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_get_attempt_jobs(self, mock_api_get):
+        """Test fetching jobs of a specific attempt is cached"""
+        job = {"id": 1, "name": "Job 1", "conclusion": "failure", "status": "completed", "steps": []}
+        mock_api_get.return_value = json.dumps({"total_count": 1, "jobs": [job]})
+
+        workflow_run = retry_workflow.WorkflowRun(self.client, self.run_data)
+        workflow_run.get_attempt_jobs(1)
+        jobs = workflow_run.get_attempt_jobs(1)
+
+        self.assertEqual(len(jobs), 1)
+        mock_api_get.assert_called_once_with(
+            "repos/test-owner/test-repo/actions/runs/123/attempts/1/jobs?per_page=100&page=1", fresh=False
         )
 
+    def test_estimate_rerun_minutes(self):
+        """Test rerun cost only counts failed jobs in failed-only mode"""
+        workflow_run = retry_workflow.WorkflowRun(self.client, self.run_data)
+        workflow_run._jobs = [
+            retry_workflow.WorkflowJob({
+                "id": 1, "name": "Build", "conclusion": "success",
+                "started_at": "2025-12-05T10:00:00Z", "completed_at": "2025-12-05T10:10:00Z"
+            }),
+            retry_workflow.WorkflowJob({
+                "id": 2, "name": "Test", "conclusion": "failure",
+                "started_at": "2025-12-05T10:10:00Z", "completed_at": "2025-12-05T10:40:00Z"
+            })
+        ]
+
+        self.assertEqual(workflow_run.estimate_rerun_minutes("failed-only"), 30)
+        self.assertEqual(workflow_run.estimate_rerun_minutes("all"), 40)
+
+    @patch('time.sleep')
+    @patch.object(retry_workflow.GitHubClient, 'api_get_conditional')
+    def test_wait_for_attempt(self, mock_get, mock_sleep):
+        """Test waiting until the new attempt completes with growing intervals"""
+        mock_get.side_effect = [
+            (json.dumps({"id": 123, "run_attempt": 1, "status": "completed"}), "e1"),
+            (json.dumps({"id": 123, "run_attempt": 2, "status": "queued"}), "e2"),
+            (None, "e2"),
+            (json.dumps({"id": 123, "run_attempt": 2, "status": "completed", "conclusion": "success"}), "e3"),
+        ]
+
+        workflow_run = retry_workflow.WorkflowRun(self.client, self.run_data)
+        run_data = workflow_run.wait_for_attempt(2, timeout=600, poll_interval=10)
+
+        self.assertEqual(run_data["conclusion"], "success")
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [10, 10, 15])
+        self.assertEqual(mock_get.call_args_list[2][0][1], "e2")
+
+    @patch('time.sleep')
+    @patch.object(retry_workflow.GitHubClient, 'api_get_conditional')
+    def test_wait_for_attempt_timeout(self, mock_get, mock_sleep):
+        """Test waiting gives up after the timeout"""
+        mock_get.return_value = (json.dumps({"id": 123, "run_attempt": 2, "status": "in_progress"}), "e1")
+
+        workflow_run = retry_workflow.WorkflowRun(self.client, self.run_data)
+
+        self.assertIsNone(workflow_run.wait_for_attempt(2, timeout=0))
+
+    def _failed_job(self, job_name, step_name):
+        return retry_workflow.WorkflowJob({
+            "id": 1, "name": job_name, "conclusion": "failure", "status": "completed",
+            "steps": [{"name": step_name, "conclusion": "failure", "status": "completed"}]
+        })
+
+    def test_has_deterministic_failure_first_attempt(self):
+        """Test first attempt is never considered deterministic"""
+        workflow_run = retry_workflow.WorkflowRun(self.client, self.run_data)
+        workflow_run._retry_count = 0
+
+        is_deterministic, reason = workflow_run.has_deterministic_failure()
+
+        self.assertFalse(is_deterministic)
+        self.assertIn("No previous attempt", reason)
+
+    def test_has_deterministic_failure_identical(self):
+        """Test identical failures across attempts are deterministic"""
+        workflow_run = retry_workflow.WorkflowRun(self.client, self.run_data)
+        workflow_run._retry_count = 1
+        workflow_run._jobs = [self._failed_job("Build", "Test")]
+        workflow_run._attempt_jobs[1] = [self._failed_job("Build", "Test")]
+
+        is_deterministic, reason = workflow_run.has_deterministic_failure()
+
+        self.assertTrue(is_deterministic)
+        self.assertIn("Attempts 1 and 2 failed identically (Build/Test)", reason)
+
+    def test_has_deterministic_failure_different(self):
+        """Test different failures across attempts are not deterministic"""
+        workflow_run = retry_workflow.WorkflowRun(self.client, self.run_data)
+        workflow_run._retry_count = 1
+        workflow_run._jobs = [self._failed_job("Build", "Test")]
+        workflow_run._attempt_jobs[1] = [self._failed_job("Build", "Setup")]
+
+        is_deterministic, reason = workflow_run.has_deterministic_failure()
+
+        self.assertFalse(is_deterministic)
+        self.assertIn("differ from attempt 1", reason)
+
     def test_should_retry_success(self):
         """Test should not retry successful workflow"""
         self.run_data["conclusion"] = "success"
@@ -348,6 +1385,316 @@ class TestWorkflowRun(unittest.TestCase):
         self.assertIn("Step 'Test' in job 'Build' failed", reason)
 
 
+class TestCommitSnapshot(unittest.TestCase):
+    """Test CommitSnapshot class"""
+
+    RUNS = [
+        {"id": 1, "name": "CI", "path": ".github/workflows/ci.yaml", "conclusion": "failure",
+         "status": "completed", "created_at": "2025-12-05T10:00:00Z"},
+        {"id": 3, "name": "CI", "path": ".github/workflows/ci.yaml", "conclusion": None,
+         "status": "in_progress", "created_at": "2025-12-05T12:00:00Z"},
+        {"id": 2, "name": "Lint", "path": ".github/workflows/lint.yaml", "conclusion": "success",
+         "status": "completed", "created_at": "2025-12-05T11:00:00Z"},
+    ]
+
+    def test_index(self):
+        """Test runs are indexed by workflow name and file, latest first, and by conclusion"""
+        snapshot = retry_workflow.CommitSnapshot("abc", self.RUNS)
+
+        self.assertEqual([r["id"] for r in snapshot.runs_of("ci.yaml")], [3, 1])
+        self.assertEqual([r["id"] for r in snapshot.runs_of("CI")], [3, 1])
+        self.assertEqual(snapshot.runs_of("other.yaml"), [])
+        self.assertEqual({k: len(v) for k, v in snapshot.by_conclusion.items()},
+                         {"failure": 1, "success": 1, "in_progress": 1})
+        self.assertEqual({k: v["id"] for k, v in snapshot.latest_runs().items()}, {"ci.yaml": 3, "lint.yaml": 2})
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_snapshot_targets(self, mock_api_get):
+        """Test every workflow of the latest commit becomes a target"""
+        mock_api_get.side_effect = ["abc", json.dumps({"total_count": 3, "workflow_runs": self.RUNS})]
+        client = retry_workflow.GitHubClient("owner/repo")
+
+        targets = retry_workflow.snapshot_targets(client, "main")
+
+        self.assertEqual([t.key for t in targets], ["owner/repo/ci.yaml/main", "owner/repo/lint.yaml/main"])
+        self.assertEqual(retry_workflow.CommitSnapshot.get(client, "main", "abc").runs[0]["id"], 3)
+        self.assertEqual(mock_api_get.call_count, 2)
+
+
+class TestJsonStateFile(unittest.TestCase):
+    """Test JsonStateFile class"""
+
+    def test_update_and_read(self):
+        """Test state survives between updates"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state = retry_workflow.JsonStateFile(os.path.join(tmpdir, "state.json"))
+            self.assertEqual(state.read(), {})
+
+            with state.update() as data:
+                data["count"] = 1
+            with state.update() as data:
+                data["count"] += 1
+
+            self.assertEqual(state.read(), {"count": 2})
+
+    def test_update_not_written_on_error(self):
+        """Test state is left untouched when the update fails"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state = retry_workflow.JsonStateFile(os.path.join(tmpdir, "state.json"))
+            with state.update() as data:
+                data["count"] = 1
+
+            with self.assertRaises(RuntimeError):
+                with state.update() as data:
+                    data["count"] = 5
+                    raise RuntimeError("boom")
+
+            self.assertEqual(state.read(), {"count": 1})
+
+
+class TestRetryLock(unittest.TestCase):
+    """Test FileRetryLock and MemoryRetryLock classes"""
+
+    def test_file_lock_acquired_once(self):
+        """Test a key can only be acquired once until released"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "locks.json")
+            key = retry_workflow.retry_lock_key("owner/repo", 123, 1)
+
+            self.assertTrue(retry_workflow.FileRetryLock(path).acquire(key))
+            self.assertFalse(retry_workflow.FileRetryLock(path).acquire(key))
+
+            retry_workflow.FileRetryLock(path).release(key)
+            self.assertTrue(retry_workflow.FileRetryLock(path).acquire(key))
+
+    def test_file_lock_expired(self):
+        """Test old locks are forgotten"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "locks.json")
+            lock = retry_workflow.FileRetryLock(path, max_age=0)
+
+            self.assertTrue(lock.acquire("key"))
+            self.assertTrue(lock.acquire("key"))
+
+    def test_memory_lock(self):
+        """Test memory lock behaves like the file lock"""
+        lock = retry_workflow.MemoryRetryLock()
+
+        self.assertTrue(lock.acquire("key"))
+        self.assertFalse(lock.acquire("key"))
+        lock.release("key")
+        self.assertTrue(lock.acquire("key"))
+
+
+class TestRerunQuota(unittest.TestCase):
+    """Test RerunQuota class"""
+
+    def test_file_quota_shared(self):
+        """Test invocations sharing the state file share the quota"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "quota.json")
+
+            def quota():
+                return retry_workflow.RerunQuota(2, 3600, retry_workflow.JsonStateFile(path))
+
+            self.assertTrue(quota().acquire("a")[0])
+            self.assertTrue(quota().acquire("b")[0])
+            acquired, reason = quota().acquire("c")
+
+            self.assertFalse(acquired)
+            self.assertIn("2 reruns in the last 60 min", reason)
+
+            quota().release("b")
+            self.assertTrue(quota().acquire("c")[0])
+
+    def test_window_slides(self):
+        """Test reruns older than the window are not counted"""
+        quota = retry_workflow.RerunQuota(1, 60)
+
+        with patch.object(retry_workflow.time, 'time', return_value=1000):
+            self.assertTrue(quota.acquire("a")[0])
+            self.assertFalse(quota.acquire("b")[0])
+        with patch.object(retry_workflow.time, 'time', return_value=1061):
+            self.assertTrue(quota.acquire("b")[0])
+
+
+    def test_check_does_not_record(self):
+        """Test checking the quota leaves the reruns to acquire"""
+        quota = retry_workflow.RerunQuota(1, 60)
+
+        self.assertEqual(quota.check(), (True, "0/1 reruns in the last 1 min"))
+        self.assertTrue(quota.check()[0])
+        self.assertTrue(quota.acquire("a")[0])
+        available, reason = quota.check()
+
+        self.assertFalse(available)
+        self.assertIn("quota reached", reason)
+
+    def test_quota_requires_state_file(self):
+        """Test a quota without state file is refused instead of limiting one invocation"""
+        args = argparse.Namespace(rerun_quota=5, rerun_quota_window=60, rerun_quota_file=None)
+
+        with self.assertRaisesRegex(ValueError, "without state file"):
+            retry_workflow.build_rerun_quota(args)
+        argv = ['retry_workflow.py', '--branch', 'main', '--workflow', 'ci.yaml', '--rerun-quota', '5']
+        with patch('sys.argv', argv), patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                retry_workflow.parse_arguments()
+
+
+class TestRunnerCapacityChecker(unittest.TestCase):
+    """Test RunnerCapacityChecker class"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.client = retry_workflow.GitHubClient("test-owner/test-repo")
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_check_saturated_queue(self, mock_api_get):
+        """Test pool is saturated when too many runs are queued"""
+        mock_api_get.side_effect = ["25", "10"]
+        checker = retry_workflow.RunnerCapacityChecker(self.client, max_queued_runs=20)
+
+        has_capacity, reason = checker.check()
+
+        self.assertFalse(has_capacity)
+        self.assertIn("25 queued, 10 in progress", reason)
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_check_idle_runners(self, mock_api_get):
+        """Test pool is saturated when not enough runners are idle"""
+        mock_api_get.side_effect = ["0", "4", "1"]
+        checker = retry_workflow.RunnerCapacityChecker(
+            self.client, min_idle_runners=2, runner_scope="org"
+        )
+
+        has_capacity, reason = checker.check()
+
+        self.assertFalse(has_capacity)
+        self.assertIn("1 idle, 2 required", reason)
+        self.assertEqual(
+            mock_api_get.call_args_list[2][0][0],
+            "orgs/test-owner/actions/runners?per_page=100"
+        )
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_check_runners_not_accessible(self, mock_api_get):
+        """Test runner listing errors do not block retries"""
+        mock_api_get.side_effect = [
+            "0", "0", subprocess.CalledProcessError(1, ["gh"], stderr="HTTP 403")
+        ]
+        checker = retry_workflow.RunnerCapacityChecker(self.client, min_idle_runners=1)
+
+        has_capacity, _ = checker.check()
+
+        self.assertTrue(has_capacity)
+
+
+class TestSupersededRunCanceller(unittest.TestCase):
+    """Test SupersededRunCanceller class"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.client = retry_workflow.GitHubClient("owner/repo")
+        head = json.dumps({"sha": "head", "date": "2025-12-05T12:00:00Z"})
+        run = {"path": ".github/workflows/ci.yaml", "name": "CI"}
+        queued = [
+            dict(run, id=1, status="queued", head_sha="old", created_at="2025-12-05T11:00:00Z"),
+            dict(run, id=2, status="queued", head_sha="head", created_at="2025-12-05T12:01:00Z"),
+            dict(run, id=3, status="queued", head_sha="newer", created_at="2025-12-05T12:02:00Z"),
+            dict(run, id=4, status="queued", head_sha="old", created_at="2025-12-05T11:00:00Z",
+                 name="Lint", path=".github/workflows/lint.yaml"),
+        ]
+        in_progress = [dict(run, id=5, status="in_progress", head_sha="older", created_at="2025-12-05T10:00:00Z")]
+        waiting = [dict(run, id=6, status="waiting", head_sha="old", created_at="2025-12-05T11:00:00Z")]
+        self.responses = {
+            "commits/main": head,
+            "status=queued": json.dumps({"total_count": 4, "workflow_runs": queued}),
+            "status=waiting": json.dumps({"total_count": 1, "workflow_runs": waiting}),
+            "runs/6/jobs": json.dumps({"total_count": 1, "jobs": [{"id": 14, "status": "waiting"}]}),
+            "status=in_progress": json.dumps({"total_count": 1, "workflow_runs": in_progress}),
+            "runs/1/jobs": json.dumps({"total_count": 1, "jobs": [{"id": 10, "status": "queued"}]}),
+            "runs/5/jobs": json.dumps({"total_count": 3, "jobs": [
+                {"id": 11, "status": "in_progress"}, {"id": 12, "status": "queued"}, {"id": 13, "status": "completed"}
+            ]}),
+        }
+
+    def _api_get(self, endpoint, jq_filter=None, paginate=False, fresh=False):
+        return next(value for key, value in self.responses.items() if key in endpoint)
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_execute(self, mock_api_get, mock_run):
+        """Test only active runs of the workflow on older commits are cancelled, waiting runs free no runner"""
+        mock_api_get.side_effect = self._api_get
+        canceller = retry_workflow.SupersededRunCanceller(self.client, "main", "ci.yaml")
+
+        report = canceller.execute()
+
+        self.assertEqual(sorted(r["run_id"] for r in report["runs"]), [1, 5, 6])
+        self.assertEqual(report["freed_runner_slots"], 3)
+        cancelled = sorted(c[0][0][3] for c in mock_run.call_args_list)
+        self.assertEqual(cancelled, [f"repos/owner/repo/actions/runs/{i}/cancel" for i in (1, 5, 6)])
+        endpoints = [c[0][0] for c in mock_api_get.call_args_list]
+        self.assertTrue(endpoints[1].startswith("repos/owner/repo/actions/workflows/ci.yaml/runs?branch=main&status="))
+        self.assertFalse(any("runs/6/jobs" in e for e in endpoints))
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_find_superseded_runs_pages(self, mock_api_get):
+        """Test every page of the active runs is read"""
+        run = {"path": ".github/workflows/ci.yaml", "name": "CI", "status": "queued",
+               "head_sha": "old", "created_at": "2025-12-05T11:00:00Z"}
+
+        def api_get(endpoint, jq_filter=None, paginate=False, fresh=False):
+            if "commits/main" in endpoint:
+                return self.responses["commits/main"]
+            if "status=queued" not in endpoint:
+                return json.dumps({"total_count": 0, "workflow_runs": []})
+            page = int(re.search(r"page=(\d+)$", endpoint).group(1))
+            runs = [dict(run, id=page * 1000 + i) for i in range(100 if page == 1 else 20)]
+            return json.dumps({"total_count": 120, "workflow_runs": runs})
+        mock_api_get.side_effect = api_get
+
+        runs = retry_workflow.SupersededRunCanceller(self.client, "main", "ci.yaml").find_superseded_runs()
+
+        self.assertEqual(len(runs), 120)
+        self.assertTrue(all(c[1]["fresh"] for c in mock_api_get.call_args_list[1:]))
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_execute_dry_run(self, mock_api_get, mock_run):
+        """Test dry run reports the runs without cancelling them"""
+        mock_api_get.side_effect = self._api_get
+        canceller = retry_workflow.SupersededRunCanceller(self.client, "main", "CI", dry_run=True)
+
+        report = canceller.execute()
+
+        self.assertTrue(report["dry_run"])
+        self.assertEqual(report["freed_runner_slots"], 3)
+        mock_run.assert_not_called()
+
+
+class TestDeferredRetryQueue(unittest.TestCase):
+    """Test DeferredRetryQueue class"""
+
+    def test_entries_ordered_by_priority(self):
+        """Test entries are returned highest priority first"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = retry_workflow.DeferredRetryQueue(os.path.join(tmpdir, "queue.json"))
+            queue.add("owner/repo", 1, 1, "failed-only", priority=0)
+            queue.add("owner/repo", 2, 1, "all", priority=5)
+            queue.add("owner/other", 3, 1, "all", priority=9)
+            queue.add("owner/repo", 1, 2, "failed-only", priority=1)
+
+            entries = queue.entries("owner/repo")
+
+            self.assertEqual([e["run_id"] for e in entries], [2, 1])
+            self.assertEqual(entries[1]["attempt"], 2)
+
+            queue.remove("owner/repo", 2)
+            self.assertEqual([e["run_id"] for e in queue.entries("owner/repo")], [1])
+
+
 class TestWorkflowRetryManager(unittest.TestCase):
     """Test WorkflowRetryManager class"""
 
@@ -390,7 +1737,7 @@ class TestWorkflowRetryManager(unittest.TestCase):
             "status": "completed"
         }
 
-        mock_api_get.return_value = f"{json.dumps(run1)}\n{json.dumps(run2)}"
+        mock_api_get.return_value = json.dumps({"total_count": 2, "workflow_runs": [run1, run2]})
 
         result = self.manager.get_workflow_runs("abc123")
 
@@ -410,13 +1757,103 @@ class TestWorkflowRetryManager(unittest.TestCase):
             "status": "completed"
         }
 
-        mock_api_get.return_value = json.dumps(run1)
+        mock_api_get.return_value = json.dumps({"total_count": 1, "workflow_runs": [run1]})
 
         result = self.manager.get_workflow_runs("abc123")
 
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0].id, 123)
 
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_get_workflow_runs_shared_snapshot(self, mock_api_get):
+        """Test managers sharing a cache list the runs of a commit once"""
+        mock_api_get.return_value = json.dumps({"total_count": 2, "workflow_runs": [
+            {"id": 1, "name": "A", "path": ".github/workflows/a.yaml", "created_at": "2025-12-05T10:00:00Z"},
+            {"id": 2, "name": "B", "path": ".github/workflows/b.yaml", "created_at": "2025-12-05T10:00:00Z"},
+        ]})
+        client_options = {"cache": retry_workflow.ResponseCache()}
+
+        runs = [
+            retry_workflow.WorkflowRetryManager(
+                "owner/repo", "main", workflow, client_options=client_options
+            ).get_workflow_runs("abc123")
+            for workflow in ("a.yaml", "B", "c.yaml")
+        ]
+
+        self.assertEqual([[run.id for run in r] for r in runs], [[1], [2], []])
+        mock_api_get.assert_called_once()
+
+    def _history_api_get(self, endpoint, jq_filter=None, paginate=False, fresh=False):
+        """Answer a branch whose head and previous commit have no run of the workflow"""
+        if endpoint.startswith("repos/test-owner/test-repo/commits?"):
+            return json.dumps(["c0", "c1", "c2", "c3"])
+        if endpoint.endswith("/commits/main"):
+            return "c0"
+        sha = re.search(r"head_sha=(\w+)", endpoint).group(1)
+        runs = {
+            "c2": [{"id": 2, "name": "Test Workflow", "path": ".github/workflows/test.yaml",
+                    "conclusion": "failure", "status": "completed"}],
+            "c3": [{"id": 3, "name": "Test Workflow", "path": ".github/workflows/test.yaml",
+                    "conclusion": "success", "status": "completed"}],
+        }.get(sha, [{"id": 9, "name": "Other", "path": ".github/workflows/other.yaml"}])
+        return json.dumps({"total_count": len(runs), "workflow_runs": runs})
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_get_latest_workflow_run_history(self, mock_api_get):
+        """Test the first previous commit with a run is used, and the walk is memoized"""
+        mock_api_get.side_effect = self._history_api_get
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            memo_file = os.path.join(tmpdir, "history.json")
+            options = dict(history_depth=4, history_memo_file=memo_file)
+
+            run = retry_workflow.WorkflowRetryManager(
+                "test-owner/test-repo", "main", "test.yaml", **options
+            ).get_latest_workflow_run()
+            self.assertEqual(run.id, 2)
+
+            mock_api_get.reset_mock()
+            run = retry_workflow.WorkflowRetryManager(
+                "test-owner/test-repo", "main", "test.yaml", **options
+            ).get_latest_workflow_run()
+            self.assertEqual(run.id, 2)
+
+        endpoints = [c[0][0] for c in mock_api_get.call_args_list]
+        self.assertEqual(len(endpoints), 3)
+        self.assertFalse(any("commits?" in e for e in endpoints))
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_get_latest_workflow_run_history_not_memoized_on_error(self, mock_api_get):
+        """Test a walk where a commit could not be fetched is not memoized"""
+        def api_get(endpoint, jq_filter=None, paginate=False, fresh=False):
+            if "head_sha=c1" in endpoint:
+                raise subprocess.CalledProcessError(1, ["gh"], stderr="HTTP 502")
+            if "head_sha=c2" in endpoint:
+                return json.dumps({"total_count": 0, "workflow_runs": []})
+            return self._history_api_get(endpoint, jq_filter, paginate, fresh)
+        mock_api_get.side_effect = api_get
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            memo_file = os.path.join(tmpdir, "history.json")
+            manager = retry_workflow.WorkflowRetryManager(
+                "test-owner/test-repo", "main", "test.yaml", history_depth=3, history_memo_file=memo_file
+            )
+            with self.assertLogs("retry_workflow", level="WARNING"):
+                self.assertIsNone(manager.get_latest_workflow_run())
+
+            self.assertEqual(manager.history_memo.get("test-owner/test-repo/test.yaml/main", "c0"), (False, None))
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_get_latest_workflow_run_history_depth(self, mock_api_get):
+        """Test commits beyond the history depth are not looked at"""
+        mock_api_get.side_effect = self._history_api_get
+
+        manager = retry_workflow.WorkflowRetryManager("test-owner/test-repo", "main", "test.yaml", history_depth=2)
+
+        self.assertIsNone(manager.get_latest_workflow_run())
+        self.assertIn("per_page=2", mock_api_get.call_args_list[2][0][0])
+        self.assertFalse(any("head_sha=c2" in c[0][0] for c in mock_api_get.call_args_list))
+
     @patch.object(retry_workflow.GitHubClient, 'api_get')
     def test_get_workflow_runs_empty(self, mock_api_get):
         """Test getting workflow runs with no results"""
@@ -496,6 +1933,7 @@ class TestWorkflowRetryManager(unittest.TestCase):
         workflow_run.retry_count = 0
         workflow_run.succeeded.return_value = False
         workflow_run.should_retry.return_value = (True, "Workflow has failures")
+        workflow_run.fetch_run_attempt.return_value = 1
         workflow_run.retry.return_value = True
 
         mock_get_run.return_value = workflow_run
@@ -527,6 +1965,1002 @@ class TestWorkflowRetryManager(unittest.TestCase):
         workflow_run.retry.assert_not_called()
 
 
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_execute_retry_logic_deterministic_failure(self, mock_get_run):
+        """Test execute retry logic skips failures that reproduce identically"""
+        self.manager.skip_deterministic_failures = True
+        workflow_run = Mock()
+        workflow_run.id = 123
+        workflow_run.conclusion = "failure"
+        workflow_run.retry_count = 1
+        workflow_run.succeeded.return_value = False
+        workflow_run.should_retry.return_value = (True, "Workflow has failures")
+        workflow_run.has_deterministic_failure.return_value = (True, "Attempts 1 and 2 failed identically")
+
+        mock_get_run.return_value = workflow_run
+
+        result = self.manager.execute_retry_logic()
+
+        self.assertEqual(result["status"], "failure")
+        self.assertEqual(result["retry_count"], 1)
+        self.assertFalse(result["was_retried"])
+        self.assertIn("failed identically", result["reason"])
+        workflow_run.retry.assert_not_called()
+
+
+    def test_client_reused(self):
+        """Test a manager uses the client it is given, for the same repository only"""
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+        manager = retry_workflow.WorkflowRetryManager(
+            repo="test-owner/test-repo", branch="main", workflow_name="Test Workflow", client=client
+        )
+        self.assertIs(manager.client, client)
+
+        with self.assertRaises(ValueError):
+            retry_workflow.WorkflowRetryManager(
+                repo="test-owner/other", branch="main", workflow_name="Test Workflow", client=client
+            )
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_check_not_found(self, mock_get_run):
+        """Test check returns a typed result with the reason, logged not printed"""
+        mock_get_run.return_value = None
+
+        with self.assertLogs("retry_workflow", level="INFO") as logs, patch('builtins.print') as mock_print:
+            result = self.manager.check()
+
+        self.assertIsInstance(result, retry_workflow.RetryResult)
+        self.assertEqual((result.status, result.was_retried, result.run_id), ("not_found", False, None))
+        self.assertEqual((result.repo, result.branch, result.workflow), ("test-owner/test-repo", "main", "Test Workflow"))
+        self.assertIn("No workflow run found", result.reason)
+        self.assertTrue(any("No workflow run found" in line for line in logs.output))
+        mock_print.assert_not_called()
+
+    @patch.object(retry_workflow.GitHubClient, '_run_idempotent')
+    def test_check_reused_client(self, mock_run):
+        """Test a client reused by a second check does not answer it from the first one"""
+        head = {"sha": "c1"}
+
+        def run(args):
+            if "/commits/main" in args[1]:
+                return head["sha"]
+            sha = re.search(r"head_sha=(\w+)", args[1]).group(1)
+            return json.dumps({"total_count": 1, "workflow_runs": [{
+                "id": int(sha[1:]), "name": "CI", "path": ".github/workflows/ci.yaml",
+                "status": "completed", "conclusion": "success", "run_attempt": 1
+            }]})
+        mock_run.side_effect = run
+        client = retry_workflow.GitHubClient("test-owner/test-repo")
+        manager = retry_workflow.WorkflowRetryManager("test-owner/test-repo", "main", "ci.yaml", client=client)
+
+        first = manager.check()
+        head["sha"] = "c2"
+        second = manager.check()
+
+        self.assertEqual((first.run_id, second.run_id), (1, 2))
+        self.assertEqual(mock_run.call_count, 4)
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_check_retried_reason(self, mock_get_run):
+        """Test the decision reason is kept when the run is retried"""
+        workflow_run = self._failed_run_to_retry()
+        workflow_run.fetch_run_attempt.return_value = 1
+        mock_get_run.return_value = workflow_run
+
+        result = self.manager.check()
+
+        self.assertTrue(result.was_retried)
+        self.assertEqual(result.retry_count, 1)
+        self.assertEqual(result.reason, "Workflow has failures")
+        self.assertEqual(
+            retry_workflow.RetryResult.from_dict(result.to_dict()).to_dict(),
+            result.to_dict()
+        )
+
+    def _failed_run_to_retry(self):
+        workflow_run = Mock()
+        workflow_run.id = 123
+        workflow_run.conclusion = "failure"
+        workflow_run.retry_count = 0
+        workflow_run.succeeded.return_value = False
+        workflow_run.should_retry.return_value = (True, "Workflow has failures")
+        workflow_run.retry.return_value = True
+        return workflow_run
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_execute_retry_logic_already_retried_elsewhere(self, mock_get_run):
+        """Test no rerun when the run attempt moved since it was evaluated"""
+        workflow_run = self._failed_run_to_retry()
+        workflow_run.fetch_run_attempt.return_value = 2
+        mock_get_run.return_value = workflow_run
+
+        result = self.manager.execute_retry_logic()
+
+        self.assertFalse(result["was_retried"])
+        self.assertIn("already at attempt 2", result["reason"])
+        workflow_run.retry.assert_not_called()
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_execute_retry_logic_lock_held(self, mock_get_run):
+        """Test only one of two concurrent invocations reruns the attempt"""
+        workflow_run = self._failed_run_to_retry()
+        workflow_run.fetch_run_attempt.return_value = 1
+        mock_get_run.return_value = workflow_run
+        self.manager.retry_lock = retry_workflow.MemoryRetryLock()
+        other = retry_workflow.WorkflowRetryManager(
+            repo="test-owner/test-repo", branch="main", workflow_name="Test Workflow"
+        )
+        other.retry_lock = self.manager.retry_lock
+
+        first = self.manager.execute_retry_logic()
+        second = other.execute_retry_logic()
+
+        self.assertTrue(first["was_retried"])
+        self.assertFalse(second["was_retried"])
+        self.assertIn("already claimed", second["reason"])
+        workflow_run.retry.assert_called_once()
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_execute_retry_logic_lock_released_on_failure(self, mock_get_run):
+        """Test the lock is released when the rerun request fails"""
+        workflow_run = self._failed_run_to_retry()
+        workflow_run.fetch_run_attempt.return_value = 1
+        workflow_run.retry.return_value = False
+        mock_get_run.return_value = workflow_run
+        self.manager.retry_lock = retry_workflow.MemoryRetryLock()
+
+        result = self.manager.execute_retry_logic()
+
+        self.assertFalse(result["was_retried"])
+        self.assertTrue(self.manager.retry_lock.acquire("test-owner/test-repo#123#1"))
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_execute_retry_logic_over_quota(self, mock_get_run):
+        """Test retries over the fleet quota are deferred and queued"""
+        workflow_run = self._failed_run_to_retry()
+        workflow_run.fetch_run_attempt.return_value = 1
+        mock_get_run.return_value = workflow_run
+        quota = retry_workflow.RerunQuota(1)
+        quota.acquire("other-owner/other-repo#9#1")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manager = retry_workflow.WorkflowRetryManager(
+                repo="test-owner/test-repo",
+                branch="main",
+                workflow_name="Test Workflow",
+                priority=2,
+                deferred_queue_file=os.path.join(tmpdir, "queue.json"),
+                retry_lock_file=os.path.join(tmpdir, "locks.json"),
+                rerun_quota=quota
+            )
+
+            result = manager.execute_retry_logic()
+
+            self.assertEqual(result["status"], "deferred")
+            self.assertTrue(result["deferred"])
+            self.assertIn("quota reached", result["reason"])
+            workflow_run.retry.assert_not_called()
+            # The exhausted quota is known before any request for the run
+            workflow_run.fetch_run_attempt.assert_not_called()
+            entries = manager.deferred_queue.entries("test-owner/test-repo")
+            self.assertEqual([(e["run_id"], e["priority"]) for e in entries], [(123, 2)])
+            # The deferred retry can claim the attempt later
+            self.assertTrue(manager.retry_lock.acquire("test-owner/test-repo#123#1"))
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_execute_retry_logic_over_quota_without_queue(self, mock_get_run):
+        """Test retries over the quota are reported as dropped without a deferred queue"""
+        workflow_run = self._failed_run_to_retry()
+        mock_get_run.return_value = workflow_run
+        self.manager.rerun_quota = retry_workflow.RerunQuota(1)
+        self.manager.rerun_quota.acquire("other-owner/other-repo#9#1")
+
+        result = self.manager.execute_retry_logic()
+
+        self.assertEqual(result["status"], "deferred")
+        self.assertFalse(result["deferred"])
+        self.assertIn("quota reached", result["reason"])
+        self.assertFalse(retry_workflow.RetryResult.from_dict(result).to_dict()["deferred"])
+        workflow_run.fetch_run_attempt.assert_not_called()
+        workflow_run.retry.assert_not_called()
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_execute_retry_logic_quota_released_on_failure(self, mock_get_run):
+        """Test failed rerun requests do not count in the quota"""
+        workflow_run = self._failed_run_to_retry()
+        workflow_run.fetch_run_attempt.return_value = 1
+        workflow_run.retry.return_value = False
+        mock_get_run.return_value = workflow_run
+        self.manager.rerun_quota = retry_workflow.RerunQuota(1)
+
+        result = self.manager.execute_retry_logic()
+
+        self.assertFalse(result["was_retried"])
+        self.assertTrue(self.manager.rerun_quota.acquire("key")[0])
+
+    @patch.object(retry_workflow.WorkflowRun, 'jobs', new_callable=lambda: property(lambda self: []))
+    @patch.object(retry_workflow.WorkflowRun, 'wait_for_attempt')
+    @patch.object(retry_workflow.WorkflowRun, 'retry')
+    @patch.object(retry_workflow.WorkflowRun, 'fetch_run_attempt')
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_supervise_until_success(self, mock_get_run, mock_fetch_attempt, mock_retry, mock_wait, mock_jobs):
+        """Test supervisor retries again until the run succeeds"""
+        workflow_run = self._failed_run_to_retry()
+        workflow_run.fetch_run_attempt.return_value = 1
+        workflow_run.wait_for_attempt.return_value = {
+            "id": 123, "run_attempt": 2, "status": "completed", "conclusion": "failure"
+        }
+        mock_get_run.return_value = workflow_run
+        mock_fetch_attempt.return_value = 2
+        mock_retry.return_value = True
+        mock_wait.return_value = {
+            "id": 123, "run_attempt": 3, "status": "completed", "conclusion": "success"
+        }
+
+        result = self.manager.supervise(timeout=600)
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(result["retry_count"], 2)
+        self.assertTrue(result["was_retried"])
+        workflow_run.retry.assert_called_once_with(mode="failed-only")
+        mock_retry.assert_called_once_with(mode="failed-only")
+        self.assertEqual(mock_wait.call_args[0][0], 3)
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_supervise_timeout(self, mock_get_run):
+        """Test supervisor reports in_progress when the attempt does not complete"""
+        workflow_run = self._failed_run_to_retry()
+        workflow_run.fetch_run_attempt.return_value = 1
+        workflow_run.wait_for_attempt.return_value = None
+        mock_get_run.return_value = workflow_run
+
+        result = self.manager.supervise(timeout=60)
+
+        self.assertEqual(result["status"], "in_progress")
+        self.assertTrue(result["was_retried"])
+        self.assertEqual(result["retry_count"], 1)
+
+    @patch.object(retry_workflow.RunnerCapacityChecker, 'check')
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_execute_retry_logic_deferred(self, mock_get_run, mock_check):
+        """Test retry is deferred and queued when the runner pool is saturated"""
+        mock_check.return_value = (False, "Runner pool saturated")
+        workflow_run = Mock()
+        workflow_run.id = 123
+        workflow_run.conclusion = "failure"
+        workflow_run.retry_count = 0
+        workflow_run.succeeded.return_value = False
+        workflow_run.should_retry.return_value = (True, "Workflow has failures")
+
+        mock_get_run.return_value = workflow_run
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue_file = os.path.join(tmpdir, "queue.json")
+            manager = retry_workflow.WorkflowRetryManager(
+                repo="test-owner/test-repo",
+                branch="main",
+                workflow_name="Test Workflow",
+                max_queued_runs=10,
+                priority=3,
+                deferred_queue_file=queue_file
+            )
+
+            result = manager.execute_retry_logic()
+
+            self.assertEqual(result["status"], "deferred")
+            self.assertFalse(result["was_retried"])
+            workflow_run.retry.assert_not_called()
+            entries = manager.deferred_queue.entries("test-owner/test-repo")
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(entries[0]["run_id"], 123)
+            self.assertEqual(entries[0]["attempt"], 1)
+            self.assertEqual(entries[0]["priority"], 3)
+
+    @patch.object(retry_workflow.RunnerCapacityChecker, 'check')
+    @patch.object(retry_workflow.SupersededRunCanceller, 'execute')
+    @patch.object(retry_workflow.WorkflowRetryManager, 'get_latest_workflow_run')
+    def test_execute_retry_logic_cancels_superseded_first(self, mock_get_run, mock_cancel, mock_check):
+        """Test superseded runs are cancelled before capacity is measured"""
+        calls = []
+        mock_cancel.side_effect = lambda: calls.append("cancel") or {"runs": [], "freed_runner_slots": 2}
+        mock_check.side_effect = lambda: calls.append("check") or (False, "Runner pool saturated")
+        workflow_run = Mock()
+        workflow_run.id = 123
+        workflow_run.conclusion = "failure"
+        workflow_run.retry_count = 0
+        workflow_run.succeeded.return_value = False
+        workflow_run.should_retry.return_value = (True, "Workflow has failures")
+        mock_get_run.return_value = workflow_run
+
+        manager = retry_workflow.WorkflowRetryManager(
+            repo="test-owner/test-repo",
+            branch="main",
+            workflow_name="Test Workflow",
+            max_queued_runs=10,
+            cancel_superseded=True
+        )
+        result = manager.check()
+
+        self.assertEqual(calls, ["cancel", "check"])
+        self.assertEqual(result.status, "deferred")
+        self.assertEqual(result.superseded_runs["freed_runner_slots"], 2)
+
+    @patch.object(retry_workflow.GitHubClient, 'api_post')
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_process_deferred_retries(self, mock_api_get, mock_api_post):
+        """Test deferred retries are issued, stale ones dropped"""
+        mock_api_post.return_value = True
+        mock_api_get.side_effect = [
+            json.dumps({"id": 2, "conclusion": "failure", "status": "completed", "run_attempt": 1}),
+            "1",
+            json.dumps({"id": 1, "conclusion": "failure", "status": "completed", "run_attempt": 2}),
+        ]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manager = retry_workflow.WorkflowRetryManager(
+                repo="test-owner/test-repo",
+                branch="main",
+                workflow_name="Test Workflow",
+                deferred_queue_file=os.path.join(tmpdir, "queue.json")
+            )
+            manager.deferred_queue.add("test-owner/test-repo", 1, 1, "failed-only", priority=0)
+            manager.deferred_queue.add("test-owner/test-repo", 2, 1, "all", priority=1)
+
+            retried = manager.process_deferred_retries()
+
+            self.assertEqual(retried, [2])
+            mock_api_post.assert_called_once_with(
+                "repos/test-owner/test-repo/actions/runs/2/rerun", scope="workflow"
+            )
+            self.assertEqual(manager.deferred_queue.entries("test-owner/test-repo"), [])
+
+    @patch.object(retry_workflow.GitHubClient, 'api_post')
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_process_deferred_retries_quota(self, mock_api_get, mock_api_post):
+        """Test deferred retries stay queued once the quota is exhausted"""
+        mock_api_post.return_value = True
+        mock_api_get.side_effect = [
+            json.dumps({"id": 2, "conclusion": "failure", "status": "completed", "run_attempt": 1}),
+            "1",
+            json.dumps({"id": 1, "conclusion": "failure", "status": "completed", "run_attempt": 1}),
+            "1",
+        ]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manager = retry_workflow.WorkflowRetryManager(
+                repo="test-owner/test-repo",
+                branch="main",
+                workflow_name="Test Workflow",
+                deferred_queue_file=os.path.join(tmpdir, "queue.json"),
+                rerun_quota=retry_workflow.RerunQuota(1)
+            )
+            manager.deferred_queue.add("test-owner/test-repo", 1, 1, "failed-only", priority=0)
+            manager.deferred_queue.add("test-owner/test-repo", 2, 1, "failed-only", priority=1)
+
+            retried = manager.process_deferred_retries()
+
+            self.assertEqual(retried, [2])
+            entries = manager.deferred_queue.entries("test-owner/test-repo")
+            self.assertEqual([e["run_id"] for e in entries], [1])
+
+
+class TestRetryBatch(unittest.TestCase):
+    """Test RetryBatch class and batch helpers"""
+
+    def test_estimate_success_likelihood(self):
+        """Test likelihood of success decreases with failed attempts"""
+        self.assertAlmostEqual(retry_workflow.estimate_success_likelihood(0), 1 / 3)
+        self.assertAlmostEqual(retry_workflow.estimate_success_likelihood(1), 1 / 4)
+
+    def test_load_targets(self):
+        """Test loading targets with defaults"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "targets.json")
+            with open(path, "w") as f:
+                json.dump([
+                    {"workflow": "ci.yaml", "priority": 2},
+                    {"repo": "owner/other", "branch": "dev", "workflow": "e2e.yaml", "job_name": "E2E"}
+                ], f)
+
+            targets = retry_workflow.load_targets(path, "owner/repo", "main")
+
+        self.assertEqual(len(targets), 2)
+        self.assertEqual((targets[0].repo, targets[0].branch, targets[0].priority), ("owner/repo", "main", 2))
+        self.assertEqual((targets[1].repo, targets[1].branch, targets[1].job_name), ("owner/other", "dev", "E2E"))
+
+    def test_load_targets_missing_branch(self):
+        """Test a target without branch and no default is rejected"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "targets.json")
+            with open(path, "w") as f:
+                json.dump([{"workflow": "ci.yaml"}], f)
+
+            with self.assertRaises(ValueError):
+                retry_workflow.load_targets(path, "owner/repo", None)
+
+    def test_aggregate_status(self):
+        """Test the status needing most attention wins"""
+        self.assertEqual(retry_workflow.aggregate_status([]), "success")
+        self.assertEqual(retry_workflow.aggregate_status(["success", "not_found"]), "not_found")
+        self.assertEqual(retry_workflow.aggregate_status(["deferred", "failure", "success"]), "failure")
+        self.assertEqual(retry_workflow.aggregate_status(["failure", "error", "deferred"]), "error")
+
+    def test_parse_shard(self):
+        """Test shard specifications are validated"""
+        self.assertEqual(retry_workflow.parse_shard("2/4"), (2, 4))
+        for value in ("0/4", "5/4", "2", "a/b"):
+            with self.assertRaises(retry_workflow.argparse.ArgumentTypeError):
+                retry_workflow.parse_shard(value)
+
+    def test_shard_of(self):
+        """Test shards are stable, cover all shards and balance targets"""
+        keys = [f"owner/repo-{i}/ci.yaml/main" for i in range(400)]
+        shards = [retry_workflow.shard_of(key, 4) for key in keys]
+
+        self.assertEqual(shards, [retry_workflow.shard_of(key, 4) for key in keys])
+        self.assertEqual(set(shards), {1, 2, 3, 4})
+        self.assertTrue(all(60 < shards.count(i) < 140 for i in range(1, 5)))
+        # Shards must not change between versions, or reruns could be duplicated during upgrades
+        self.assertEqual(retry_workflow.shard_of("owner/repo/ci.yaml/main", 4), 4)
+        self.assertEqual(retry_workflow.shard_of("owner/repo/ci.yaml/main", 7), 4)
+
+    def _write_partial(self, tmpdir, index, count, spent):
+        path = os.path.join(tmpdir, f"shard-{index}.json")
+        retry_workflow.RetryOutputWriter.write_partial_results(
+            path,
+            {
+                "results": [{"repo": f"owner/repo-{index}", "status": "failure", "was_retried": True}],
+                "runner_minutes_spent": spent,
+                "runner_minutes_saved": 1
+            },
+            (index, count),
+            2,
+            "all",
+            20
+        )
+        return path
+
+    def test_merge_partial_results(self):
+        """Test shard results are combined"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = [self._write_partial(tmpdir, index, 2, spent) for index, spent in ((1, 10), (2, 5))]
+            merged = retry_workflow.merge_partial_results(paths)
+
+        batch_result = merged["batch_result"]
+        self.assertEqual([r["repo"] for r in batch_result["results"]], ["owner/repo-1", "owner/repo-2"])
+        self.assertEqual(batch_result["runner_minutes_spent"], 15)
+        self.assertEqual(batch_result["runner_minutes_saved"], 2)
+        self.assertEqual((merged["max_retries"], merged["retry_mode"], merged["runner_minutes_budget"]), (2, "all", 40))
+
+    def test_merge_partial_results_invalid(self):
+        """Test unreadable, inconsistent, duplicated or missing shards are rejected"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            first = self._write_partial(tmpdir, 1, 3, 10)
+            third = self._write_partial(tmpdir, 3, 3, 5)
+            other_count = os.path.join(tmpdir, "other", "shard-2.json")
+            os.mkdir(os.path.dirname(other_count))
+            other_count = self._write_partial(os.path.dirname(other_count), 2, 4, 5)
+            out_of_range = os.path.join(tmpdir, "range", "shard-4.json")
+            os.mkdir(os.path.dirname(out_of_range))
+            out_of_range = self._write_partial(os.path.dirname(out_of_range), 4, 3, 5)
+            garbage = os.path.join(tmpdir, "garbage.json")
+            with open(garbage, "w") as f:
+                f.write("{not json")
+            no_shard = os.path.join(tmpdir, "no-shard.json")
+            with open(no_shard, "w") as f:
+                json.dump({"results": []}, f)
+
+            cases = {
+                "missing": ([first, third], "Missing partial results of shards 2/3"),
+                "duplicate": ([first, first, third], "found in both"),
+                "count": ([first, other_count, third], "does not match 3 shards"),
+                "range": ([first, out_of_range], "Invalid shard 4/3"),
+                "unreadable": ([first, os.path.join(tmpdir, "absent.json")], "Cannot read"),
+                "json": ([garbage], "Invalid partial results"),
+                "keys": ([no_shard], "Invalid partial results"),
+                "empty": ([], "No partial results"),
+            }
+            for name, (paths, message) in cases.items():
+                with self.subTest(name):
+                    with self.assertRaisesRegex(ValueError, message):
+                        retry_workflow.merge_partial_results(paths)
+
+    def _candidate(self, run_id, retry_count, cost):
+        workflow_run = Mock()
+        workflow_run.id = run_id
+        workflow_run.estimate_rerun_minutes.return_value = cost
+        result = {"status": "failure", "retry_count": retry_count, "was_retried": False, "run_id": run_id}
+        return result, workflow_run
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'issue_retry')
+    @patch.object(retry_workflow.WorkflowRetryManager, 'plan_retry')
+    def test_execute_orders_by_score_under_budget(self, mock_plan, mock_issue):
+        """Test cheapest likely-to-succeed retries are issued first within budget"""
+        mock_plan.side_effect = [
+            self._candidate(1, 0, 60),
+            self._candidate(2, 0, 10),
+            ({"status": "success", "retry_count": 0, "was_retried": False, "run_id": 3}, None),
+            self._candidate(4, 1, 20),
+        ]
+        issued = []
+
+        def issue(workflow_run, result):
+            issued.append(workflow_run.id)
+            return dict(result, was_retried=True, retry_count=result["retry_count"] + 1)
+        mock_issue.side_effect = issue
+
+        targets = [
+            retry_workflow.RetryTarget("owner/repo", "main", f"wf{i}.yaml") for i in range(4)
+        ]
+        batch = retry_workflow.RetryBatch(targets, runner_minutes_budget=40)
+
+        batch_result = batch.execute()
+
+        self.assertEqual(issued, [2, 4])
+        self.assertEqual(batch_result["runner_minutes_spent"], 30)
+        self.assertEqual(batch_result["runner_minutes_saved"], 60)
+        results = batch_result["results"]
+        self.assertEqual([r["run_id"] for r in results], [1, 2, 3, 4])
+        self.assertFalse(results[0]["was_retried"])
+        self.assertIn("budget exhausted", results[0]["reason"])
+        self.assertEqual(results[2]["workflow"], "wf2.yaml")
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'issue_retry')
+    @patch.object(retry_workflow.WorkflowRetryManager, 'plan_retry')
+    def test_execute_priority_first(self, mock_plan, mock_issue):
+        """Test target priority takes precedence over the score"""
+        mock_plan.side_effect = [self._candidate(1, 0, 10), self._candidate(2, 0, 60)]
+        mock_issue.side_effect = lambda run, result: dict(result, was_retried=True)
+
+        targets = [
+            retry_workflow.RetryTarget("owner/repo", "main", "cheap.yaml"),
+            retry_workflow.RetryTarget("owner/repo", "main", "important.yaml", priority=1),
+        ]
+        batch = retry_workflow.RetryBatch(targets, runner_minutes_budget=60)
+
+        batch_result = batch.execute()
+
+        self.assertEqual(mock_issue.call_args_list[0][0][0].id, 2)
+        self.assertEqual(batch_result["runner_minutes_spent"], 60)
+        self.assertEqual(batch_result["runner_minutes_saved"], 10)
+
+
+    @patch.object(retry_workflow.WorkflowRun, '_fetch_jobs')
+    @patch.object(retry_workflow.WorkflowRetryManager, 'issue_retry')
+    @patch.object(retry_workflow.WorkflowRetryManager, 'plan_retry')
+    def test_execute_estimates_only_with_budget(self, mock_plan, mock_issue, mock_fetch_jobs):
+        """Test jobs are not listed just to estimate costs nobody compares to a budget"""
+        client = retry_workflow.GitHubClient("owner/repo")
+        listed = retry_workflow.WorkflowRun(client, {"id": 2, "run_attempt": 1})
+        listed._jobs = []
+        mock_plan.side_effect = lambda *args: (
+            {"status": "failure", "retry_count": 0, "was_retried": False, "run_id": 1},
+            retry_workflow.WorkflowRun(client, {"id": 1, "run_attempt": 1})
+        )
+        mock_issue.side_effect = lambda run, result: dict(result, was_retried=True)
+        mock_fetch_jobs.return_value = []
+        targets = [retry_workflow.RetryTarget("owner/repo", "main", "wf.yaml")]
+
+        batch_result = retry_workflow.RetryBatch(targets).execute()
+        mock_fetch_jobs.assert_not_called()
+        retry_workflow.RetryBatch(targets, runner_minutes_budget=60).execute()
+
+        self.assertTrue(batch_result["results"][0]["was_retried"])
+        self.assertNotIn("estimated_minutes", batch_result["results"][0])
+        self.assertEqual(batch_result["runner_minutes_spent"], 0)
+        mock_fetch_jobs.assert_called_once()
+        self.assertEqual(listed.estimate_rerun_minutes("all", fetch=False), 0)
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'issue_retry')
+    @patch.object(retry_workflow.WorkflowRetryManager, 'plan_retry')
+    def test_execute_results_sink(self, mock_plan, mock_issue):
+        """Test results are streamed as they are decided, with their details"""
+        mock_plan.side_effect = [
+            self._candidate(1, 0, 10),
+            ({"status": "success", "retry_count": 0, "was_retried": False, "run_id": 2}, None),
+        ]
+        mock_issue.side_effect = lambda run, result: dict(result, was_retried=True)
+        targets = [retry_workflow.RetryTarget("owner/repo", "main", f"wf{i}.yaml") for i in range(2)]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "results.ndjson")
+            sink = retry_workflow.ResultsSink(path)
+            retry_workflow.RetryBatch(targets, results_sink=sink).execute()
+            sink.close()
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual([r["run_id"] for r in records], [2, 1])
+        self.assertTrue(records[1]["was_retried"])
+        self.assertEqual(records[1]["workflow"], "wf0.yaml")
+        for record in records:
+            self.assertIn("requests", record)
+            self.assertIn("seconds", record)
+            self.assertIn("decided_at", record)
+
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'process_deferred_retries')
+    @patch.object(retry_workflow.WorkflowRetryManager, 'plan_retry')
+    def test_execute_drains_deferred_once_per_repo(self, mock_plan, mock_drain):
+        """Test deferred retries are issued once per repository, not per target"""
+        mock_plan.return_value = ({"status": "success", "retry_count": 0, "was_retried": False, "run_id": 1}, None)
+        targets = [
+            retry_workflow.RetryTarget("owner/a", "main", "ci.yaml"),
+            retry_workflow.RetryTarget("owner/a", "main", "lint.yaml"),
+            retry_workflow.RetryTarget("owner/b", "main", "ci.yaml"),
+        ]
+
+        retry_workflow.RetryBatch(targets).execute()
+
+        self.assertEqual(mock_plan.call_count, 3)
+        self.assertEqual(mock_drain.call_count, 2)
+
+class TestOrgSweep(unittest.TestCase):
+    """Test OrgSweep class"""
+
+    @staticmethod
+    def _repos(start, count, archived=()):
+        return json.dumps([
+            {"full_name": f"org/repo-{i}", "default_branch": "main", "archived": i in archived, "disabled": False}
+            for i in range(start, start + count)
+        ])
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_iter_repos(self, mock_api_get):
+        """Test repositories are listed page by page, skipping archived ones"""
+        mock_api_get.side_effect = [self._repos(0, 100, archived={3}), self._repos(100, 2)]
+
+        sweep = retry_workflow.OrgSweep("org", ["ci.yaml"])
+        repos = list(sweep.iter_repos())
+
+        self.assertEqual(len(repos), 101)
+        self.assertNotIn(("org/repo-3", "main"), repos)
+        self.assertEqual(mock_api_get.call_count, 2)
+        self.assertIn("orgs/org/repos?per_page=100&page=2", mock_api_get.call_args[0][0])
+        self.assertTrue(mock_api_get.call_args[1]["fresh"])
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_iter_repos_shard(self, mock_api_get):
+        """Test shards of a sweep partition the repositories"""
+        repos = []
+        for index in (1, 2, 3):
+            mock_api_get.side_effect = [self._repos(0, 30)]
+            sweep = retry_workflow.OrgSweep("org", ["ci.yaml"], shard=(index, 3))
+            repos.extend(name for name, _ in sweep.iter_repos())
+
+        self.assertEqual(sorted(repos), sorted(f"org/repo-{i}" for i in range(30)))
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'execute_retry_logic')
+    def test_process_repo(self, mock_execute):
+        """Test each workflow is checked and errors don't stop the sweep"""
+        mock_execute.side_effect = [
+            {"status": "failure", "retry_count": 1, "was_retried": True, "run_id": 1},
+            subprocess.CalledProcessError(1, ["gh"], stderr="Git Repository is empty."),
+        ]
+
+        sweep = retry_workflow.OrgSweep("org", ["ci.yaml", "nightly.yaml"], max_retries=2)
+        results = sweep.process_repo("org/repo", "main")
+
+        self.assertEqual([r["workflow"] for r in results], ["ci.yaml", "nightly.yaml"])
+        self.assertTrue(results[0]["was_retried"])
+        self.assertEqual(results[1]["status"], "error")
+        self.assertEqual(results[1]["repo"], "org/repo")
+
+    @patch.object(retry_workflow.WorkflowRetryManager, 'execute_retry_logic')
+    def test_process_repo_deadline(self, mock_execute):
+        """Test the sweep stops once the deadline has passed or the API is down"""
+        for error in (retry_workflow.DeadlineExceededError("late"), retry_workflow.CircuitOpenError("down")):
+            mock_execute.side_effect = error
+            sweep = retry_workflow.OrgSweep("org", ["ci.yaml"])
+            with self.assertRaises(type(error)):
+                sweep.process_repo("org/repo", "main")
+
+    def test_execute_bounded(self):
+        """Test results are yielded while repositories are still being listed"""
+        sweep = retry_workflow.OrgSweep("org", ["ci.yaml"], max_workers=2)
+        listed = []
+        in_flight_when_listed = []
+
+        def iter_repos():
+            for i in range(20):
+                in_flight_when_listed.append(len(listed) - len(yielded))
+                listed.append(i)
+                yield f"org/repo-{i}", "main"
+
+        def process_repo(repo, branch, job_filter, step_filter):
+            return [{"repo": repo, "status": "success", "was_retried": False}]
+
+        yielded = []
+        with patch.object(sweep, 'iter_repos', side_effect=iter_repos), \
+                patch.object(sweep, 'process_repo', side_effect=process_repo):
+            for result in sweep.execute():
+                yielded.append(result)
+
+        self.assertEqual(sorted(r["repo"] for r in yielded), sorted(f"org/repo-{i}" for i in range(20)))
+        self.assertLessEqual(max(in_flight_when_listed), 4)
+
+
+class TestNightlyTrigger(unittest.TestCase):
+    """Test nightly trigger decisions of the nightly command"""
+
+    NOW = 1700000000
+
+    def _state(self, hours_ago=24 * 30, status="completed", days_since=5, run_count=0,
+               last_run_conclusion="not_found"):
+        return {
+            "last_commit_time": self.NOW - hours_ago * 3600,
+            "status": status,
+            "days_since_last_run": days_since,
+            "run_count": run_count,
+            "last_run_on_commit_conclusion": last_run_conclusion
+        }
+
+    def _decide(self, state, max_start=0, period=1):
+        return retry_workflow.decide_nightly_trigger(state, max_start, period, now=self.NOW)
+
+    def test_recent_commit(self):
+        """Test a commit of the period without successful run triggers"""
+        self.assertEqual(self._decide(self._state(hours_ago=5)), (True, "Last commit was 5h ago (within 1 day)"))
+        self.assertEqual(
+            self._decide(self._state(hours_ago=50), period=3),
+            (True, "Last commit was 2d ago (within 3 days)")
+        )
+
+    def test_commit_check_period(self):
+        """Test commits trigger within the check period only"""
+        for hours, period, expected in ((30, 2, True), (30, 1, False), (50, 3, True), (50, 2, False)):
+            with self.subTest(hours=hours, period=period):
+                state = self._state(hours_ago=hours, status="not_found", days_since=999)
+                self.assertEqual(self._decide(state, period=period)[0], expected)
+
+    def test_recent_commit_already_succeeded(self):
+        """Test a recent commit with a successful run does not trigger, even on weekly checks"""
+        state = self._state(hours_ago=5, days_since=7, run_count=1, last_run_conclusion="success")
+        self.assertEqual(self._decide(state), (False, "No trigger conditions met"))
+
+    def test_weekly_health_check(self):
+        """Test old commits trigger every 7 days since the last run"""
+        for days, expected in ((7, True), (14, True), (5, False), (3, False), (0, False)):
+            with self.subTest(days=days):
+                trigger, reason = self._decide(self._state(days_since=days))
+                self.assertEqual(trigger, expected)
+                if expected:
+                    self.assertEqual(reason, f"Weekly health check ({days} days since last run)")
+
+    def test_no_run(self):
+        """Test an old commit of a never run workflow does not trigger"""
+        self.assertEqual(self._decide(self._state(status="not_found", days_since=999))[0], False)
+
+    def test_restart_failed(self):
+        """Test failed runs of the last commit are restarted up to the maximum"""
+        state = self._state(run_count=1, last_run_conclusion="failure")
+        self.assertEqual(self._decide(state, max_start=3), (True, "Last run failed (failure), restarting (1/3)"))
+        self.assertFalse(self._decide(dict(state, run_count=3), max_start=3)[0])
+        self.assertFalse(self._decide(state)[0])
+
+    def test_restart_conclusions(self):
+        """Test timed out and cancelled runs are restarted, successful ones are not"""
+        for conclusion, run_count, expected in (("timed_out", 1, True), ("cancelled", 2, True), ("success", 2, False)):
+            with self.subTest(conclusion=conclusion):
+                state = self._state(days_since=1, run_count=run_count, last_run_conclusion=conclusion)
+                trigger, reason = self._decide(state, max_start=3)
+                self.assertEqual(trigger, expected)
+                if expected:
+                    self.assertEqual(reason, f"Last run failed ({conclusion}), restarting ({run_count}/3)")
+
+    def test_weekly_health_check_after_max_restarts(self):
+        """Test the weekly health check still triggers when restarts are exhausted"""
+        state = self._state(hours_ago=48, days_since=7, run_count=3, last_run_conclusion="failure")
+        self.assertEqual(self._decide(state, max_start=3), (True, "Weekly health check (7 days since last run)"))
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_fetch_state(self, mock_api_get):
+        """Test the commit, the branch runs and the runs of the commit are fetched without checkout"""
+        mock_api_get.side_effect = [
+            json.dumps({"sha": "abc", "date": "2023-11-14T12:00:00Z"}),
+            json.dumps({"total_count": 3, "workflow_runs": [
+                {"id": 3, "status": "completed", "conclusion": "failure", "head_sha": "abc",
+                 "created_at": "2023-11-13T22:00:00Z", "html_url": "x"},
+                {"id": 2, "status": "completed", "conclusion": "failure", "head_sha": "abc",
+                 "created_at": "2023-11-12T22:00:00Z"},
+                {"id": 1, "status": "completed", "conclusion": "success", "head_sha": "old",
+                 "created_at": "2023-11-01T22:00:00Z"},
+            ]}),
+            # Also run on another branch
+            json.dumps({"total_count": 2, "workflow_runs": [
+                {"id": 4, "status": "completed", "conclusion": "failure", "head_sha": "abc",
+                 "created_at": "2023-11-13T23:00:00Z"},
+                {"id": 3, "status": "completed", "conclusion": "failure", "head_sha": "abc",
+                 "created_at": "2023-11-13T22:00:00Z"},
+            ]})
+        ]
+
+        trigger = retry_workflow.NightlyTrigger(
+            retry_workflow.GitHubClient("owner/repo"), "nightly.yaml", "main", max_start_if_last_failed=3
+        )
+        result = trigger.evaluate(now=self.NOW)
+
+        self.assertEqual(mock_api_get.call_count, 3)
+        self.assertEqual(mock_api_get.call_args_list[0][0][0], "repos/owner/repo/commits/main")
+        runs_endpoint = mock_api_get.call_args_list[1][0][0]
+        self.assertIn("workflows/nightly.yaml/runs?branch=main", runs_endpoint)
+        self.assertIn("per_page=100", runs_endpoint)
+        self.assertIn("workflows/nightly.yaml/runs?head_sha=abc", mock_api_get.call_args_list[2][0][0])
+        self.assertEqual(result["last_commit_time"], 1699963200)
+        self.assertEqual(result["run_id"], 3)
+        self.assertEqual(result["days_since_last_run"], 1)
+        self.assertEqual(result["run_count"], 2)
+        self.assertEqual(result["last_run_on_commit_conclusion"], "failure")
+        self.assertEqual((result["trigger"], result["reason"]), (True, "Last run failed (failure), restarting (2/3)"))
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_fetch_state_no_run(self, mock_api_get):
+        """Test the default branch is resolved and missing runs are reported as not_found"""
+        mock_api_get.side_effect = [
+            "develop",
+            json.dumps({"sha": "abc", "date": "2023-11-14T12:00:00Z"}),
+            json.dumps({"total_count": 0, "workflow_runs": []}),
+            json.dumps({"total_count": 0, "workflow_runs": []})
+        ]
+
+        trigger = retry_workflow.NightlyTrigger(retry_workflow.GitHubClient("owner/repo"), "nightly.yaml")
+        state = trigger.fetch_state(now=self.NOW)
+
+        self.assertEqual(trigger.branch, "develop")
+        self.assertEqual(state["status"], "not_found")
+        self.assertEqual(state["days_since_last_run"], 999)
+        self.assertEqual(state["last_run_on_commit_conclusion"], "not_found")
+
+    @patch.object(retry_workflow.WorkflowDispatch, 'execute')
+    def test_dispatch(self, mock_execute):
+        """Test dispatching runs the workflow on the resolved branch"""
+        mock_execute.return_value = {"dispatched": True, "run_id": 7}
+        trigger = retry_workflow.NightlyTrigger(retry_workflow.GitHubClient("owner/repo"), "nightly.yaml", "main")
+
+        with patch.object(retry_workflow, 'WorkflowDispatch', wraps=retry_workflow.WorkflowDispatch) as dispatch:
+            self.assertEqual(trigger.dispatch("correlation_id", 30)["run_id"], 7)
+
+        self.assertEqual(dispatch.call_args[0][1:], ("nightly.yaml", "main"))
+        self.assertEqual(dispatch.call_args[1], {"correlation_input": "correlation_id"})
+        mock_execute.assert_called_once_with(30)
+
+
+class TestWorkflowDispatch(unittest.TestCase):
+    """Test WorkflowDispatch class"""
+
+    @staticmethod
+    def _runs(*runs):
+        return json.dumps({"total_count": len(runs), "workflow_runs": [
+            {"id": run_id, "display_title": title, "status": "queued"} for run_id, title in runs
+        ]})
+
+    @patch('time.sleep')
+    @patch.object(retry_workflow.GitHubClient, 'api_get_conditional')
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_execute_with_marker(self, mock_api_get, mock_run, mock_conditional, mock_sleep):
+        """Test the run carrying the marker is found, ignoring runs dispatched by others"""
+        mock_api_get.return_value = self._runs((10, "Nightly"))
+        dispatch = retry_workflow.WorkflowDispatch(
+            retry_workflow.GitHubClient("owner/repo"), "nightly.yaml", "main",
+            inputs={"suite": "full"}, correlation_input="correlation_id"
+        )
+        mock_conditional.side_effect = [
+            (self._runs((10, "Nightly")), '"a"'),
+            (None, '"a"'),
+            (self._runs((12, f"Nightly {dispatch.marker}"), (11, "Nightly other"), (10, "Nightly")), '"b"'),
+        ]
+
+        result = dispatch.execute()
+
+        self.assertTrue(result["dispatched"])
+        self.assertEqual(result["run_id"], 12)
+        endpoint = mock_api_get.call_args[0][0]
+        self.assertIn("event=workflow_dispatch", endpoint)
+        self.assertIn("branch=main", endpoint)
+        self.assertIn("created=%3E%3D", endpoint)
+        self.assertTrue(mock_api_get.call_args[1]["fresh"])
+        self.assertEqual(mock_conditional.call_args_list[1][0], (endpoint, '"a"'))
+        self.assertEqual(mock_run.call_args[0][0], [
+            "api", "--method", "POST", "repos/owner/repo/actions/workflows/nightly.yaml/dispatches",
+            "-f", "ref=main", "-f", "inputs[suite]=full", "-f", f"inputs[correlation_id]={dispatch.marker}"
+        ])
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [1, 1.5])
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get_conditional')
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_execute_without_marker(self, mock_api_get, mock_run, mock_conditional):
+        """Test the oldest new run is used without marker"""
+        mock_api_get.return_value = self._runs((10, "Nightly"))
+        mock_conditional.return_value = (self._runs((12, "Nightly"), (11, "Nightly"), (10, "Nightly")), None)
+
+        with self.assertLogs("retry_workflow", level="WARNING"):
+            result = retry_workflow.WorkflowDispatch(
+                retry_workflow.GitHubClient("owner/repo"), "nightly.yaml", "main"
+            ).execute()
+
+        self.assertEqual(result["run_id"], 11)
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get_conditional')
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_execute_dispatch_failed(self, mock_api_get, mock_run, mock_conditional):
+        """Test runs are not looked for when the dispatch fails"""
+        mock_api_get.return_value = self._runs()
+        mock_run.side_effect = subprocess.CalledProcessError(1, ["gh"], stderr="HTTP 422")
+
+        result = retry_workflow.WorkflowDispatch(
+            retry_workflow.GitHubClient("owner/repo"), "nightly.yaml", "main"
+        ).execute()
+
+        self.assertEqual((result["dispatched"], result["run_id"]), (False, None))
+        mock_conditional.assert_not_called()
+
+
+class TestBulkDispatch(unittest.TestCase):
+    """Test BulkDispatch class"""
+
+    def test_parse_workflow_list(self):
+        """Test workflows are parsed with their gh workflow run inputs"""
+        self.assertEqual(
+            retry_workflow.parse_workflow_list("test-1.yaml, test-2.yaml -f field_one=true -F 'name=a b',"),
+            [("test-1.yaml", {}), ("test-2.yaml", {"field_one": "true", "name": "a b"})]
+        )
+        self.assertEqual(
+            retry_workflow.parse_workflow_list("mocke.yaml, moke tests -f field_one=true, 'Nightly  run'"),
+            [("mocke.yaml", {}), ("moke tests", {"field_one": "true"}), ("Nightly  run", {})]
+        )
+        with self.assertRaises(ValueError):
+            retry_workflow.parse_workflow_list("-f field_one=true")
+        with self.assertRaises(ValueError):
+            retry_workflow.parse_workflow_list("test.yaml --ref main")
+        with self.assertRaises(ValueError):
+            retry_workflow.parse_workflow_list("test.yaml -f field_one")
+
+    @patch.object(retry_workflow.WorkflowDispatch, 'execute', autospec=True)
+    def test_execute(self, mock_execute):
+        """Test every workflow is dispatched even when one fails"""
+        def execute(dispatch, track_timeout):
+            if dispatch.workflow == "b.yaml":
+                raise subprocess.TimeoutExpired(["gh"], 60)
+            return {"workflow": dispatch.workflow, "ref": dispatch.ref, "dispatched": True,
+                    "run_id": 1, "seconds": 0.5, "inputs_seen": dispatch.inputs}
+        mock_execute.side_effect = execute
+
+        bulk = retry_workflow.BulkDispatch(
+            retry_workflow.GitHubClient("owner/repo"), "main",
+            [("a.yaml", {"x": "1"}), ("b.yaml", {}), ("c.yaml", {})]
+        )
+        with self.assertLogs("retry_workflow", level="WARNING"):
+            results = bulk.execute(0)
+
+        self.assertEqual([r["workflow"] for r in results], ["a.yaml", "b.yaml", "c.yaml"])
+        self.assertEqual([r["dispatched"] for r in results], [True, False, True])
+        self.assertEqual(results[0]["inputs_seen"], {"x": "1"})
+        self.assertIn("error", results[1])
+
+    @patch.object(retry_workflow.GitHubClient, 'api_get_pages')
+    def test_resolve_workflow_names(self, mock_pages):
+        """Test workflow names are resolved to file names with a single listing"""
+        mock_pages.return_value = [
+            {"id": 1, "name": "Nightly Tests", "path": ".github/workflows/nightly.yaml"},
+            {"id": 2, "name": "Build", "path": ".github/workflows/build.yml"},
+            {"id": 3, "name": "Build", "path": ".github/workflows/build-old.yml"},
+        ]
+        bulk = retry_workflow.BulkDispatch(retry_workflow.GitHubClient("owner/repo"), "main", [])
+
+        self.assertEqual(bulk.resolve("ci.yaml"), "ci.yaml")
+        self.assertEqual(bulk.resolve("1234"), "1234")
+        mock_pages.assert_not_called()
+        self.assertEqual(bulk.resolve("nightly tests"), "nightly.yaml")
+        with self.assertRaisesRegex(ValueError, "Several workflows"):
+            bulk.resolve("Build")
+        with self.assertRaisesRegex(ValueError, "No workflow"):
+            bulk.resolve("Deploy")
+        mock_pages.assert_called_once_with("repos/owner/repo/actions/workflows", "workflows")
+
+
 class TestRetryOutputWriter(unittest.TestCase):
     """Test RetryOutputWriter class"""
 
@@ -548,6 +2982,33 @@ class TestRetryOutputWriter(unittest.TestCase):
         mock_file.write.assert_any_call("retry_count=1\n")
         mock_file.write.assert_any_call("was_retried=true\n")
 
+    def test_write_batch_summary_timings(self):
+        """Test aggregated timings are added to the batch summary"""
+        timings = retry_workflow.TimingsAggregate()
+        timings.add({"retry_overhead_seconds": 600, "queue_seconds": 90, "max_queue_seconds": 60,
+                     "execution_seconds": 400, "jobs": [{}, {}]})
+        timings.add({"time_to_green_seconds": 3000})
+        timings.add({})
+        batch_result = {
+            "results": [{"repo": "o/r", "workflow": "ci.yaml", "branch": "main", "status": "failure", "was_retried": True}],
+            "runner_minutes_spent": 7,
+            "runner_minutes_saved": 0
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            summary_file = os.path.join(tmpdir, "summary.md")
+            with patch.dict('os.environ', {'GITHUB_STEP_SUMMARY': summary_file}):
+                retry_workflow.RetryOutputWriter.write_batch_summary(
+                    batch_result, 1, "failed-only", timings=timings.to_dict()
+                )
+            with open(summary_file) as f:
+                summary = f.read()
+
+        self.assertEqual(timings.to_dict()["runs"], 2)
+        self.assertIn("| Job Queue Time | 1m 30s (avg 45s, max 1m 00s over 2 jobs) |", summary)
+        self.assertIn("| Retry Overhead | 10m 00s over 1 retried runs |", summary)
+        self.assertIn("| Avg Time to Green | 50m 00s over 1 successful runs |", summary)
+
     def test_write_github_output_without_file(self):
         """Test writing output without file"""
         # Should not raise any exceptions
@@ -562,6 +3023,179 @@ class TestRetryOutputWriter(unittest.TestCase):
 class TestMain(unittest.TestCase):
     """Test main function"""
 
+    @patch.dict('os.environ', {'GITHUB_REPOSITORY': 'owner/repo'})
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    def test_main_dispatch(self, mock_run):
+        """Test the dispatch command reports failed workflows and fails"""
+        def run_command(args, scope=None):
+            if "b.yaml" in args[3]:
+                raise subprocess.CalledProcessError(1, ["gh"], stderr="HTTP 422")
+            return ""
+        mock_run.side_effect = run_command
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "output.txt")
+            argv = ['retry_workflow.py', 'dispatch', '--workflows', 'a.yaml -f x=1, b.yaml', '--ref', 'main',
+                    '--track-timeout', '0', '--output-file', output_file]
+            with patch('sys.argv', argv):
+                self.assertEqual(retry_workflow.main(), 1)
+
+            with open(output_file) as f:
+                content = f.read()
+
+        self.assertEqual(mock_run.call_count, 2)
+        self.assertIn("dispatched_count=1", content)
+        self.assertIn("failed_workflows=b.yaml", content)
+
+    @patch.object(retry_workflow.GitHubClient, 'run_command')
+    def test_main_dispatch_dry_run(self, mock_run):
+        """Test a dry run dispatch reports the workflows without calling the API"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "output.txt")
+            argv = ['retry_workflow.py', 'dispatch', '--workflows', 'a.yaml -f x=1, Nightly', '--ref', 'main',
+                    '--dry-run', '--output-file', output_file]
+            with patch('sys.argv', argv):
+                self.assertEqual(retry_workflow.main(), 0)
+
+            with open(output_file) as f:
+                content = f.read()
+
+        mock_run.assert_not_called()
+        self.assertIn("dispatched_count=0", content)
+
+    @patch.dict('os.environ', {'GITHUB_REPOSITORY': 'owner/repo'})
+    @patch.object(retry_workflow.NightlyTrigger, 'evaluate')
+    def test_main_nightly_batch(self, mock_evaluate):
+        """Test nightly decisions of a targets file share one client per repository, and errors fail the step"""
+        mock_evaluate.side_effect = [
+            {"repo": "owner/repo", "branch": "main", "workflow": "a.yaml", "trigger": True, "reason": "r"},
+            RuntimeError("boom"),
+            {"repo": "other/repo", "branch": "main", "workflow": "a.yaml", "trigger": False, "reason": "r"},
+        ]
+        targets = [{"workflow": "a.yaml"}, {"workflow": "b.yaml"}, {"workflow": "a.yaml", "repo": "other/repo"}]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            targets_file = os.path.join(tmpdir, "targets.json")
+            with open(targets_file, "w") as f:
+                json.dump(targets, f)
+            output_file = os.path.join(tmpdir, "output.txt")
+
+            argv = ['retry_workflow.py', 'nightly', '--targets-file', targets_file, '--branch', 'main',
+                    '--max-concurrency', '1', '--output-file', output_file]
+            with patch('sys.argv', argv), \
+                    patch.object(retry_workflow, 'GitHubClient', wraps=retry_workflow.GitHubClient) as client:
+                self.assertEqual(retry_workflow.main(), 1)
+
+            with open(output_file) as f:
+                content = f.read()
+
+        self.assertEqual(client.call_count, 2)
+        self.assertIn("trigger=true", content)
+        self.assertIn("triggered_count=1", content)
+
+    @patch.dict('os.environ', {'GITHUB_REPOSITORY': 'owner/repo'})
+    @patch.object(retry_workflow.NightlyTrigger, 'dispatch')
+    @patch.object(retry_workflow.NightlyTrigger, 'evaluate')
+    def test_main_nightly_dispatch_failed(self, mock_evaluate, mock_dispatch):
+        """Test a nightly dispatch that was not started fails the step"""
+        mock_evaluate.return_value = {
+            "repo": "owner/repo", "branch": "main", "workflow": "a.yaml", "trigger": True, "reason": "r",
+            "last_commit_time": 0, "days_since_last_run": 1, "conclusion": "failure"
+        }
+        mock_dispatch.return_value = {"dispatched": False, "run_id": None}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "output.txt")
+            argv = ['retry_workflow.py', 'nightly', '--workflow', 'a.yaml', '--branch', 'main',
+                    '--dispatch', '--output-file', output_file]
+            with patch('sys.argv', argv):
+                self.assertEqual(retry_workflow.main(), 1)
+
+            with open(output_file) as f:
+                content = f.read()
+
+        self.assertIn("dispatched=false", content)
+
+    @patch.dict('os.environ', {'GITHUB_REPOSITORY': 'owner/repo'})
+    @patch.object(retry_workflow.RetryBatch, 'execute')
+    def test_main_batch_shard_and_merge(self, mock_execute):
+        """Test a shard only processes its targets, and merge combines shard results"""
+        mock_execute.side_effect = lambda: {
+            "results": [{"status": "failure", "retry_count": 1, "was_retried": True, "run_id": 1}],
+            "runner_minutes_spent": 3,
+            "runner_minutes_saved": 0
+        }
+        targets = [{"workflow": f"wf-{i}.yaml"} for i in range(10)]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            targets_file = os.path.join(tmpdir, "targets.json")
+            with open(targets_file, "w") as f:
+                json.dump(targets, f)
+
+            sizes = []
+            for index in (1, 2):
+                argv = ['retry_workflow.py', '--targets-file', targets_file, '--branch', 'main',
+                        '--shard', f'{index}/2', '--results-file', os.path.join(tmpdir, f'{index}.json')]
+                with patch('sys.argv', argv), \
+                        patch.object(retry_workflow, 'RetryBatch', wraps=retry_workflow.RetryBatch) as batch:
+                    self.assertEqual(retry_workflow.main(), 0)
+                sizes.append(len(batch.call_args[0][0]))
+
+            output_file = os.path.join(tmpdir, "output.txt")
+            argv = ['retry_workflow.py', 'merge', os.path.join(tmpdir, '1.json'), os.path.join(tmpdir, '2.json'),
+                    '--output-file', output_file]
+            with patch('sys.argv', argv):
+                self.assertEqual(retry_workflow.main(), 0)
+            with open(output_file) as f:
+                output = f.read()
+
+        self.assertEqual(sum(sizes), 10)
+        self.assertNotIn(0, sizes)
+        self.assertIn("retry_count=2", output)
+        self.assertIn("runner_minutes_spent=6", output)
+
+    def test_main_merge_missing_shard(self):
+        """Test merge exits with an error when a shard result is missing"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "1.json")
+            retry_workflow.RetryOutputWriter.write_partial_results(
+                path, {"results": [], "runner_minutes_spent": 0, "runner_minutes_saved": 0}, (1, 2), 2, "all"
+            )
+            output_file = os.path.join(tmpdir, "output.txt")
+            argv = ['retry_workflow.py', 'merge', path, '--output-file', output_file]
+            with patch('sys.argv', argv):
+                self.assertEqual(retry_workflow.main(), 1)
+
+            self.assertFalse(os.path.exists(output_file))
+
+    @patch.dict('os.environ', {'GITHUB_REPOSITORY': 'org/caller'})
+    @patch.object(retry_workflow.OrgSweep, 'execute')
+    @patch.object(retry_workflow.RetryOutputWriter, 'write_sweep_summary')
+    def test_main_sweep(self, mock_summary, mock_execute):
+        """Test main function in organization sweep mode"""
+        mock_execute.return_value = iter([
+            {"repo": "org/a", "branch": "main", "workflow": "ci.yaml", "status": "failure", "retry_count": 1, "was_retried": True},
+            {"repo": "org/b", "branch": "main", "workflow": "ci.yaml", "status": "not_found", "retry_count": 0, "was_retried": False},
+            {"repo": "org/c", "branch": "main", "workflow": "ci.yaml", "status": "success", "retry_count": 0, "was_retried": False},
+        ])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "output.txt")
+            argv = ['retry_workflow.py', '--sweep-org', 'org', '--workflow', 'ci.yaml, nightly.yaml',
+                    '--output-file', output_file]
+            with patch('sys.argv', argv):
+                result = retry_workflow.main()
+            with open(output_file) as f:
+                output = f.read()
+
+        self.assertEqual(result, 0)
+        self.assertIn("status=failure", output)
+        self.assertIn("retry_count=1", output)
+        org, counts, notable = mock_summary.call_args[0][:3]
+        self.assertEqual(org, "org")
+        self.assertEqual(counts, {"failure": 1, "not_found": 1, "success": 1})
+        self.assertEqual([r["repo"] for r in notable], ["org/a"])
+
     @patch('sys.argv', ['retry_workflow.py', '--branch', 'main', '--workflow', 'test.yaml'])
     @patch.dict('os.environ', {'GITHUB_REPOSITORY': 'test-owner/test-repo'})
     @patch.object(retry_workflow.WorkflowRetryManager, 'execute_retry_logic')
@@ -583,6 +3217,85 @@ class TestMain(unittest.TestCase):
         mock_output.assert_called_once()
         mock_summary.assert_called_once()
 
+    @patch.dict('os.environ', {'GITHUB_REPOSITORY': 'test-owner/test-repo'})
+    @patch.object(retry_workflow.GitHubClient, 'api_get_pages')
+    @patch.object(retry_workflow.GitHubClient, 'api_get')
+    def test_main_profile(self, mock_api_get, mock_api_get_pages):
+        """Test --profile writes a pstats file and a report of the phases"""
+        mock_api_get.return_value = "abc123"
+        mock_api_get_pages.side_effect = [
+            [{"id": 1, "name": "CI", "path": ".github/workflows/ci.yaml", "status": "completed",
+              "conclusion": "failure", "run_attempt": 2, "created_at": "2025-12-05T10:00:00Z"}],
+            [{"id": 2, "name": "Test", "status": "completed", "conclusion": "failure"}],
+        ]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profile_file = os.path.join(tmpdir, "retry.pstats")
+            argv = ['retry_workflow.py', '--branch', 'main', '--workflow', 'ci.yaml', '--job-name', 'Test',
+                    '--profile', profile_file]
+            with patch('sys.argv', argv):
+                self.assertEqual(retry_workflow.main(), 0)
+
+            self.assertIsNone(retry_workflow.Profiler.active)
+            stats = pstats.Stats(profile_file)
+            with open(os.path.join(tmpdir, "retry.pstats.txt")) as f:
+                report = f.read()
+
+        self.assertTrue(stats.total_calls > 0)
+        for phase in ("ref resolution", "run listing", "job fetch", "decision", "output"):
+            self.assertIn(f"  {phase}: ", report)
+        self.assertIn("Allocated until the end of the first run listing:", report)
+        self.assertIn("Top allocations at the end:", report)
+        self.assertEqual(retry_workflow.Profiler("out.txt").report_path, "out.txt.txt")
+
+    @patch.dict('os.environ', {'GITHUB_REPOSITORY': 'test-owner/test-repo'})
+    @patch.object(retry_workflow, 'run_single', return_value=0)
+    def test_main_profile_unwritable(self, mock_run_single):
+        """Test a profile that cannot be written does not change the exit code"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profile_file = os.path.join(tmpdir, "missing", "retry.pstats")
+            argv = ['retry_workflow.py', '--branch', 'main', '--workflow', 'ci.yaml', '--profile', profile_file]
+            with patch('sys.argv', argv):
+                self.assertEqual(retry_workflow.main(), 0)
+
+        mock_run_single.assert_called_once()
+        self.assertIsNone(retry_workflow.Profiler.active)
+        self.assertFalse(retry_workflow.tracemalloc.is_tracing())
+
+    @patch.dict('os.environ', {'GITHUB_REPOSITORY': 'test-owner/test-repo'})
+    @patch.object(retry_workflow.RetryBatch, 'execute')
+    @patch.object(retry_workflow.RetryOutputWriter, 'write_batch_summary')
+    def test_main_batch(self, mock_summary, mock_execute):
+        """Test main function in batch mode"""
+        mock_execute.return_value = {
+            "results": [
+                {"status": "failure", "retry_count": 1, "was_retried": True, "run_id": 1},
+                {"status": "success", "retry_count": 0, "was_retried": False, "run_id": 2}
+            ],
+            "runner_minutes_spent": 12,
+            "runner_minutes_saved": 0
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            targets_file = os.path.join(tmpdir, "targets.json")
+            output_file = os.path.join(tmpdir, "output.txt")
+            with open(targets_file, "w") as f:
+                json.dump([{"workflow": "a.yaml"}, {"workflow": "b.yaml"}], f)
+
+            argv = ['retry_workflow.py', '--branch', 'main', '--targets-file', targets_file,
+                    '--output-file', output_file]
+            with patch('sys.argv', argv):
+                result = retry_workflow.main()
+
+            with open(output_file) as f:
+                outputs = f.read()
+
+        self.assertEqual(result, 0)
+        self.assertIn("status=failure\n", outputs)
+        self.assertIn("retry_count=1\n", outputs)
+        self.assertIn("runner_minutes_spent=12\n", outputs)
+        mock_summary.assert_called_once()
+
 
 if __name__ == '__main__':
     unittest.main()